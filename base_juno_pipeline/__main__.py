@@ -2,8 +2,7 @@ import argparse
 import pathlib
 import sys
 
-import juno_info
-import base_juno_pipeline
+from base_juno_pipeline import juno_info
 
 
 def get_args():
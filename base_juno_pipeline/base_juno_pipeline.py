@@ -5,12 +5,29 @@ bioinformatics group at the RIVM. All our pipelines use Snakemake.
 '''
 
 from base_juno_pipeline import helper_functions
+from base_juno_pipeline.cluster_executors import get_executor
+from base_juno_pipeline.discovery_cache import DiscoveryCache
+from base_juno_pipeline.filename_classifiers import CombinedClassifier, get_classifier
+from base_juno_pipeline.input_checksums import ChecksumCache, InputChecksums
+from base_juno_pipeline.instrumentation import PhaseTimer
+from base_juno_pipeline.resource_model import ResourceModel
+from base_juno_pipeline.run_history import JobHistoryCollector, RunHistory
+from base_juno_pipeline.sample_discovery import InputDiscovery
+from base_juno_pipeline.sample_records import Sample
+from base_juno_pipeline.sample_sheets import YAML_DUMPER, get_processed_samples_file, get_sample_sheet_format, \
+    get_sample_sheet_name, read_sample_sheet, write_sample_sheet
+import concurrent.futures
+import copy
 from datetime import datetime
-from pandas import read_csv
+import multiprocessing
+import os
 import pathlib
 import re
-from snakemake import snakemake
+import shutil
+import socket
 import subprocess
+import sys
+import time
 from uuid import uuid4
 import yaml
 
@@ -28,18 +45,80 @@ class PipelineStartup(helper_functions.JunoHelpers):
     def __init__(self,
                 input_dir, 
                 input_type='fastq',
-                min_num_lines=0):
+                min_num_lines=0,
+                max_workers=None,
+                use_cache=False,
+                cache_file=None,
+                previous_sample_sheet=None,
+                compact_sample_dict=False,
+                naming_schemes=None,
+                recursive=False,
+                max_depth=None,
+                include=None,
+                exclude=None,
+                timer=None):
         '''Constructor'''
         self.input_dir = pathlib.Path(input_dir)
         self.input_type = input_type
         self.min_num_lines = int(min_num_lines)
+        self.max_workers = max_workers
+        self.use_cache = use_cache
+        self.cache_file = cache_file
+        self.previous_sample_sheet = previous_sample_sheet
+        # If True, the files of every sample are stored in a Sample record
+        # (see sample_records) instead of a dictionary to save memory
+        self.compact_sample_dict = compact_sample_dict
+        # Classifiers of the fastq and fasta file names (see 
+        # filename_classifiers). Other naming schemes can be given as
+        # {'fastq': FilenameClassifier, 'fasta': FilenameClassifier}
+        self.naming_schemes = naming_schemes if naming_schemes is not None else {}
+        # If recursive is True, the input files are also searched in the 
+        # subdirectories of the input directory (e.g. one per sequencing run)
+        # up to max_depth levels deep (None for no limit). The include and
+        # exclude globs select the files and subdirectories (see 
+        # InputDiscovery.walk)
+        self.recursive = recursive
+        self.max_depth = max_depth
+        self.include = [include] if isinstance(include, str) else list(include or [])
+        self.exclude = [exclude] if isinstance(exclude, str) else list(exclude or [])
+        # Optional function that receives every InputFile found and returns
+        # whether it should be used (e.g. only files that are not being 
+        # written anymore, see watch_mode)
+        self.input_file_filter = None
+        # The timer can be shared with RunSnakemake to get the timings of the
+        # whole run in the audit trail
+        self.timer = timer if timer is not None else PhaseTimer()
         self.__validate_arguments()
+        self.classifiers = {input_type: get_classifier(self.naming_schemes.get(input_type, input_type))
+                            for input_type in ['fastq', 'fasta']}
+        self.__discovery = InputDiscovery(min_num_lines=self.min_num_lines,
+                                        max_workers=self.max_workers,
+                                        cache=self.__get_discovery_cache())
 
     def __validate_arguments(self):
         assert self.input_dir.is_dir(), \
             f"The provided input directory ({str(self.input_dir)}) does not exist. Please provide an existing directory"
         assert self.input_type in ['fastq', 'fasta', 'both'], \
             "input_type to be checked can only be 'fastq', 'fasta' or 'both'"
+        assert self.max_workers is None or int(self.max_workers) > 0, \
+            "max_workers should be a positive number (or None to use the default of the thread pool)"
+        assert set(self.naming_schemes).issubset({'fastq', 'fasta'}), \
+            "naming_schemes can only be given for 'fastq' and/or 'fasta' files"
+        assert self.max_depth is None or int(self.max_depth) >= 0, \
+            "max_depth should be 0 or a positive number (or None to walk all subdirectories)"
+        assert self.recursive or (self.max_depth is None and not self.include and not self.exclude), \
+            "max_depth, include and exclude can only be used when recursive is True"
+
+    def __get_discovery_cache(self):
+        '''
+        Function to open the cache with the results of previous input 
+        discoveries (only if use_cache is True). If the cache cannot be used,
+        the pipeline continues without it
+        '''
+        if not self.use_cache:
+            return None
+        return self.open_cache(DiscoveryCache, self.cache_file,
+                                "cache for the input files", "All input files will be validated.")
         
     def start_juno_pipeline(self):
         '''
@@ -49,14 +128,27 @@ class PipelineStartup(helper_functions.JunoHelpers):
         (from which a sample_sheet can be made), etc. This is the main (and 
         often only) function that is usually needed to run a Juno pipeline
         '''
-        self.supported_extensions = {'fastq': ('.fastq', '.fastq.gz', '.fq', '.fq.gz'),
-                                    'fasta': ('.fasta')}
-        self.__subdirs_ = self.__define_input_subdirs()
-        self.__validate_input_dir()
+        self.supported_extensions = {input_type: classifier.extensions
+                                    for input_type, classifier in self.classifiers.items()}
+        with self.timer.phase('input_validation'):
+            self.__subdirs_ = self.__define_input_subdirs()
+            # With recursive discovery the files can also be in subdirectories
+            if not self.recursive:
+                self.__validate_input_dir()
         print("Making a list of samples to be processed in this pipeline run...")
-        self.sample_dict = self.make_sample_dict()
+        with self.timer.phase('input_discovery'):
+            self.sample_dict = self.make_sample_dict()
         print("Validating that all expected input files per sample are present in the input directory...")
-        self.validate_sample_dict()
+        with self.timer.phase('sample_validation'):
+            self.validate_sample_dict()
+        if self.previous_sample_sheet is not None:
+            with self.timer.phase('incremental_samples'):
+                self.full_sample_dict = self.sample_dict
+                self.sample_dict = self.make_incremental_sample_dict(self.previous_sample_sheet)
+        # The sizes can be passed to RunSnakemake to estimate the resources
+        # of every job (see ResourceModel)
+        self.sample_input_sizes = ResourceModel.get_sample_input_sizes(self.sample_dict, 
+                                                                        self.input_files)
 
     def __input_dir_is_juno_assembly_output(self):
         '''
@@ -118,57 +210,147 @@ class PipelineStartup(helper_functions.JunoHelpers):
             return self.__validate_input_subdir(self.__subdirs_[self.input_type], 
                                                 self.supported_extensions[self.input_type])
 
-    def __enlist_fastq_samples(self):
+    def __enlist_samples(self, input_types):
         '''
-        Function to enlist the fastq files found in the input directory. 
-        Returns a dictionary with the form:
-        {sample: {R1: fastq_file1, R2: fastq_file2}}
+        Function to enlist the files of the given input types (fastq and/or
+        fasta) found in the input directory. Every directory is only listed
+        once (and every file only validated once), also when the fastq and
+        fasta files are in the same directory. Returns a dictionary with the 
+        form: {sample: {R1: fastq_file1, R2: fastq_file2, assembly: fasta_file}}
         '''
-        # Regex to detect different sample names in de fastq file names
-        # It does NOT accept sample names that contain _1 or _2 in the name
-        # because they get confused with the identifiers of forward and reverse
-        # reads.
-        pattern = re.compile("(.*?)(?:_S\d+_|_S\d+.|_|\.)(?:_L555_)?(?:p)?R?(1|2)(?:_.*\.|\..*\.|\.)f(ast)?q(\.gz)?")
+        classifiers_per_dir = {}
+        for input_type in input_types:
+            classifiers_per_dir.setdefault(self.__subdirs_[input_type], []).append(
+                self.classifiers[input_type]
+            )
         samples = {}
-        for file_ in self.__subdirs_['fastq'].iterdir():
-            if self.validate_file_has_min_lines(file_, self.min_num_lines):
-                match = pattern.fullmatch(file_.name)
-                if match:
-                    sample = samples.setdefault(match.group(1), {})
-                    sample[f"R{match.group(2)}"] = str(file_)        
+        # Directories where the files of every sample were found (per 
+        # input_subdir), since all the files of a sample should be in the 
+        # same (run) directory
+        sample_dirs = {}
+        for input_subdir, classifiers in classifiers_per_dir.items():
+            # The classifiers (FastqClassifier and FastaClassifier by default)
+            # detect the sample names and the reads in the file names
+            if len(classifiers) == 1:
+                classifier = classifiers[0]
+            else:
+                classifier = CombinedClassifier(classifiers)
+            if self.recursive:
+                files_per_dir = self.__discovery.walk(input_subdir,
+                                                    max_depth=self.max_depth,
+                                                    include=self.include,
+                                                    exclude=self.exclude)
+            elif self.input_file_filter is not None:
+                files_per_dir = {input_subdir: self.__discovery.scan_dir(input_subdir)}
+            else:
+                files_per_dir = {input_subdir: None}
+            # The walk already left out the files that do not match the 
+            # include/exclude globs, so it cannot tell which files were removed
+            listed_files_per_dir = {} if self.recursive else files_per_dir
+            if self.input_file_filter is not None:
+                files_per_dir = {directory: [file_ for file_ in input_files if self.input_file_filter(file_)]
+                                for directory, input_files in files_per_dir.items()}
+            for directory, input_files in files_per_dir.items():
+                for file_, sample, read in self.__discovery.discover(directory, 
+                                                                    classifier.classify, 
+                                                                    scheme=classifier.cache_scheme,
+                                                                    input_files=input_files,
+                                                                    listed_files=listed_files_per_dir.get(directory)):
+                    if sample not in samples:
+                        samples[sample] = self.__new_sample_files()
+                    sample_dirs.setdefault((input_subdir, sample), {}).setdefault(
+                        str(directory), []
+                    ).append(file_.path)
+                    samples[sample][read] = file_.path
+                    self.input_files[file_.path] = file_
+        duplicated_samples = {}
+        for (input_subdir, sample), files_per_dir in sample_dirs.items():
+            if len(files_per_dir) > 1:
+                duplicated_samples.setdefault(sample, []).extend(
+                    file_path for file_paths in files_per_dir.values() for file_path in file_paths
+                )
+        if duplicated_samples:
+            duplicates = '\n'.join(f'{sample}: {", ".join(file_paths)}' 
+                                    for sample, file_paths in duplicated_samples.items())
+            raise ValueError(self.error_formatter(
+                f'The following samples were found in more than one directory of {self.input_dir}. Sample names should be unique, use exclude to skip some of the directories:\n{duplicates}'
+            ))
         return samples
 
-    def __enlist_fasta_samples(self):
-        '''
-        Function to enlist the fasta files found in the input 
-        directory. Returns a dictionary with the form 
-        {sample: {assembly: fasta_file}}
-        '''
-        pattern = re.compile("(.*?).fasta")
-        samples = {}
-        for file_ in self.__subdirs_['fasta'].iterdir():
-            if self.validate_file_has_min_lines(file_, self.min_num_lines):
-                match = pattern.fullmatch(file_.name)
-                if match:
-                    sample = samples.setdefault(match.group(1), {})
-                    sample["assembly"] = str(file_)
-        return samples            
+    def __new_sample_files(self):
+        if self.compact_sample_dict:
+            return Sample(self.input_dir)
+        return {}
 
     def make_sample_dict(self):
         '''
         Function to make a sample sheet from the input directory (expecting 
-        either fastq or fasta files as input)
+        either fastq or fasta files or both as input). When both are 
+        expected, the samples are the ones with fastq files (assemblies of 
+        other samples are ignored) and samples without assembly are kept so
+        validate_sample_dict can report them
         '''
-        if self.input_type == 'fastq':
-            samples = self.__enlist_fastq_samples()
-        elif self.input_type == 'fasta':
-            samples = self.__enlist_fasta_samples()
-        else:
-            samples = self.__enlist_fastq_samples()
-            samples_fasta = self.__enlist_fasta_samples()
-            for k in samples.keys():
-                samples[k]['assembly'] = samples_fasta[k]['assembly']
-        return samples
+        self.input_files = {}
+        if self.input_type != 'both':
+            return self.__enlist_samples([self.input_type])
+        samples = self.__enlist_samples(['fastq', 'fasta'])
+        fastq_extensions = self.classifiers['fastq'].extensions
+        return {sample: sample_files for sample, sample_files in samples.items()
+                if any(file_.endswith(fastq_extensions) for file_ in sample_files.values())}
+
+    def find_samples(self):
+        '''
+        Function to make the sample_dict without validating the input 
+        directory and without checking that the samples are complete. It 
+        is used to follow an input directory that is still being filled 
+        (see watch_mode)
+        '''
+        self.__subdirs_ = self.__define_input_subdirs()
+        self.sample_dict = self.make_sample_dict()
+        return self.sample_dict
+
+    def make_incremental_sample_dict(self, previous_sample_sheet):
+        '''
+        Function to get the part of the sample_dict that was not processed 
+        yet in a previous run. The previous_sample_sheet is normally the copy
+        of the sample sheet stored in the audit trail of that run 
+        (<output_dir>/audit_trail/sample_sheet.yaml). That sample sheet only 
+        has the samples of the last run, so the processed_samples file next 
+        to it (with the samples of all the successful runs, see 
+        RunSnakemake.update_processed_samples) is used if it exists. A sample
+        is kept if it was not processed before, if its input files are 
+        different or if any of its input files was modified after the 
+        previous sample sheet was written. If the previous sample sheet does
+        not exist, all samples are kept
+        '''
+        previous_sample_sheet = pathlib.Path(previous_sample_sheet)
+        processed_samples_file = get_processed_samples_file(previous_sample_sheet)
+        if processed_samples_file.is_file():
+            previous_sample_sheet = processed_samples_file
+        if not previous_sample_sheet.is_file():
+            print(self.message_formatter(
+                f"The previous sample sheet ({previous_sample_sheet}) does not exist. All samples will be processed."
+            ))
+            return self.sample_dict
+        previous_samples = read_sample_sheet(previous_sample_sheet)
+        previous_run_time_ns = previous_sample_sheet.stat().st_mtime_ns
+        new_samples = {}
+        for sample, sample_files in self.sample_dict.items():
+            previous_files = previous_samples.get(sample)
+            changed = (previous_files != sample_files
+                        or any(self.__get_mtime_ns(file_) > previous_run_time_ns 
+                                for file_ in sample_files.values()))
+            if changed:
+                new_samples[sample] = sample_files
+        print(self.message_formatter(
+            f"{len(new_samples)} out of {len(self.sample_dict)} samples are new or changed since the previous run ({previous_sample_sheet})."
+        ))
+        return new_samples
+
+    def __get_mtime_ns(self, file_path):
+        if file_path in self.input_files:
+            return self.input_files[file_path].mtime_ns
+        return pathlib.Path(file_path).stat().st_mtime_ns
 
     def validate_sample_dict(self):
         if not self.sample_dict:
@@ -189,10 +371,16 @@ class PipelineStartup(helper_functions.JunoHelpers):
                 if 'assembly' not in assembly_present:
                     raise KeyError(self.error_formatter(f'The assembly is mising for sample {sample}. This pipeline expects an assembly per sample.'))
 
-    def get_metadata_from_csv_file(self, filepath=None, expected_colnames=['sample', 'genus']):
+    def get_metadata_from_csv_file(self, 
+                                    filepath=None, 
+                                    expected_colnames=['sample', 'genus'],
+                                    only_expected_columns=False,
+                                    read_only=False):
         '''
         Function to get a dictionary with the sample, genus and species per 
-        sample
+        sample. If only_expected_columns is True, only the expected_colnames
+        are kept (by default all columns are kept) and if read_only is True,
+        read-only mappings are made instead of dictionaries
         ''' 
         if filepath is None:
             # Only when the input_dir comes from the Juno-assembly pipeline 
@@ -203,13 +391,17 @@ class PipelineStartup(helper_functions.JunoHelpers):
         else:
             juno_species_file = pathlib.Path(filepath)
         if juno_species_file.exists():
-            juno_metadata = read_csv(juno_species_file, dtype={'sample': str})
-            assert all([col in juno_metadata.columns for col in expected_colnames]), \
+            columns = self.read_csv_columns(juno_species_file)
+            assert all([col in columns for col in expected_colnames]), \
                 self.error_formatter(
                     f'The provided metadata file ({filepath}) does not contain one or more of the expected column names ({",".join(expected_colnames)}). Are you using the right capitalization for the column names?'
                 )
-            juno_metadata.set_index('sample', inplace=True)
-            self.juno_metadata = juno_metadata.to_dict(orient='index')
+            self.juno_metadata = self.read_csv_as_dict(
+                juno_species_file,
+                index_col='sample',
+                usecols=expected_colnames if only_expected_columns else None,
+                read_only=read_only
+            )
         else:
             self.juno_metadata = None
 
@@ -245,6 +437,30 @@ class RunSnakemake(helper_functions.JunoHelpers):
                 latency_wait=60,
                 time_limit=60,
                 name_snakemake_report='snakemake_report.html',
+                audit_timeout=300,
+                background_audit=False,
+                cache_conda_audit=True,
+                timer=None,
+                batch_jobs=False,
+                batch_size=10,
+                batch_target_runtime=None,
+                batch_job_runtimes=None,
+                batch_rules=None,
+                executor='lsf',
+                max_submissions_per_second=10,
+                max_jobs=None,
+                use_cluster_status=True,
+                status_cache_ttl=5,
+                resource_factors=None,
+                sample_input_sizes=None,
+                use_run_history=False,
+                run_history_file=None,
+                throttle_file=None,
+                input_checksums=False,
+                checksum_algorithm='sha256',
+                checksum_workers=None,
+                checksum_cache_file=None,
+                sample_sheet_format=None,
                 **kwargs):
         '''Constructor'''
         self.pipeline_name=pipeline_name
@@ -252,6 +468,9 @@ class RunSnakemake(helper_functions.JunoHelpers):
         self.output_dir=pathlib.Path(output_dir)
         self.workdir=pathlib.Path(workdir)
         self.sample_sheet=sample_sheet
+        # yaml, json or msgpack (see sample_sheets). By default it is taken
+        # from the extension of the sample sheet
+        self.sample_sheet_format=get_sample_sheet_format(sample_sheet, sample_sheet_format)
         self.user_parameters=user_parameters
         self.fixed_parameters=fixed_parameters
         self.snakefile=snakefile
@@ -272,7 +491,36 @@ class RunSnakemake(helper_functions.JunoHelpers):
         self.restarttimes=restarttimes
         self.latency=latency_wait
         self.time_limit = time_limit
+        self.audit_timeout = audit_timeout
+        self.background_audit = background_audit
+        self.cache_conda_audit = cache_conda_audit
+        self.timer = timer if timer is not None else PhaseTimer()
+        self.batch_jobs = batch_jobs
+        self.batch_size = batch_size
+        self.batch_target_runtime = batch_target_runtime
+        self.batch_job_runtimes = batch_job_runtimes if batch_job_runtimes is not None else {}
+        self.batch_rules = batch_rules
+        self.executor = executor
+        self.max_submissions_per_second = max_submissions_per_second
+        self.max_jobs = max_jobs if max_jobs is not None else cores
+        self.use_cluster_status = use_cluster_status
+        self.status_cache_ttl = status_cache_ttl
+        self.resource_factors = resource_factors
+        self.sample_input_sizes = sample_input_sizes
+        self.use_run_history = use_run_history
+        self.run_history_file = run_history_file
+        self.history_estimates = {}
+        self.throttle_file = throttle_file
+        self.input_checksums = input_checksums
+        self.checksum_algorithm = checksum_algorithm
+        self.checksum_workers = checksum_workers
+        self.checksum_cache_file = checksum_cache_file
+        # Extra config for Snakemake (used to send the shards of a sharded
+        # run to their own output directory)
+        self.config_overrides = {}
         self.kwargs = kwargs
+        self.__audit_futures = {}
+        self.__audit_step_deadlines = {}
 
     def get_run_info(self):
         '''
@@ -281,7 +529,7 @@ class RunSnakemake(helper_functions.JunoHelpers):
         '''
         self.unique_id = uuid4()
         self.date_and_time=datetime.now().strftime('%d-%m-%Y %H:%M:%S')
-        self.hostname=str(subprocess.check_output(['hostname']).strip())
+        self.hostname=socket.gethostname()
 
     def get_git_audit(self, git_file):
         '''
@@ -289,8 +537,8 @@ class RunSnakemake(helper_functions.JunoHelpers):
         through git)
         '''
         print(self.message_formatter(f"Collecting information about the Git repository of this pipeline (see {str(git_file)})"))
-        git_audit = {"repo": self.get_repo_url('.'),
-                    "commit": self.get_commit_git('.')}
+        git_audit = {"repo": self.get_repo_url('.', timeout=self.audit_timeout),
+                    "commit": self.get_commit_git('.', timeout=self.audit_timeout)}
         with open(git_file, 'w') as file:
             yaml.dump(git_audit, file, default_flow_style=False)
 
@@ -310,100 +558,652 @@ class RunSnakemake(helper_functions.JunoHelpers):
 
     def get_conda_audit(self, conda_file):
         '''
-        Get list of environments in current conda environment
+        Get list of packages in current conda environment. They are read from 
+        the conda-meta directory of the environment (and cached between runs
+        if cache_conda_audit is True). 'conda list' is only used if the
+        conda-meta directory cannot be found
         '''
         print(
             self.message_formatter(
                 "Getting information of the master environment used for this pipeline."
             )
         )
-        conda_audit = subprocess.check_output(["conda","list"]).strip()
+        conda_prefix = self.get_conda_prefix()
+        if conda_prefix is None:
+            conda_audit = subprocess.check_output(["conda","list"], timeout=self.audit_timeout)
+            conda_audit = conda_audit.decode().strip()
+        else:
+            cache_dir = self.get_cache_dir() if self.cache_conda_audit else None
+            packages = self.get_conda_packages(conda_prefix, cache_dir=cache_dir)
+            conda_audit = self.format_conda_packages(conda_prefix, packages)
         with open(conda_file, 'w') as file:
             file.writelines("Master environment list:\n\n")
-            file.write(str(conda_audit))
+            file.write(conda_audit)
+
+    def get_input_checksums_audit(self, checksums_file):
+        '''
+        Get the checksums of the input files of all the samples in the sample
+        sheet. The digests of files that did not change since they were 
+        checksummed before are taken from a cache
+        '''
+        print(self.message_formatter(
+            f"Computing the checksums ({self.checksum_algorithm}) of the input files (see {str(checksums_file)})"
+        ))
+        cache = self.open_cache(ChecksumCache, self.checksum_cache_file,
+                                "cache for the checksums", "All input files will be checksummed.")
+        sample_dict = read_sample_sheet(self.sample_sheet, self.sample_sheet_format)
+        checksums = InputChecksums(algorithm=self.checksum_algorithm,
+                                    max_workers=self.checksum_workers,
+                                    cache=cache).checksum_sample_dict(sample_dict)
+        with open(checksums_file, 'w') as file:
+            yaml.dump(checksums, file, Dumper=YAML_DUMPER, default_flow_style=False)
+
+    def get_audit_sample_sheet(self):
+        '''Path of the copy of the sample sheet in the audit trail'''
+        return self.path_to_audit.joinpath(get_sample_sheet_name('sample_sheet', self.sample_sheet_format))
+
+    def update_processed_samples(self, processed_samples_file, modified_ns=None):
+        '''
+        Function to add the samples of the sample sheet to the file with the 
+        samples processed in all the runs with this output_dir, so the next 
+        incremental run (see PipelineStartup.make_incremental_sample_dict) 
+        does not process them again. It should only be called once the run 
+        finished successfully. If modified_ns is given (e.g. the start of the
+        run), it is used as modification time of the file, so input files 
+        that were modified during the run are seen as changed
+        '''
+        processed_samples_file = pathlib.Path(processed_samples_file)
+        processed_samples = {}
+        if processed_samples_file.is_file():
+            processed_samples = read_sample_sheet(processed_samples_file, self.sample_sheet_format)
+        processed_samples.update(read_sample_sheet(self.sample_sheet, self.sample_sheet_format))
+        tmp_file = processed_samples_file.with_name(f'.{processed_samples_file.name}.tmp')
+        write_sample_sheet(processed_samples, tmp_file, self.sample_sheet_format)
+        if modified_ns is not None:
+            os.utime(tmp_file, ns=(modified_ns, modified_ns))
+        os.replace(tmp_file, processed_samples_file)
+
+    def __init_processed_samples(self, processed_samples_file, samples_audit_file):
+        '''
+        Make the file with the processed samples (see update_processed_samples)
+        if it does not exist yet. Output directories of runs made before 
+        this file existed only have the sample sheet of their last run in the
+        audit trail, so that sample sheet is used as starting point
+        '''
+        if processed_samples_file.exists():
+            return
+        if samples_audit_file.is_file():
+            shutil.copy2(samples_audit_file, processed_samples_file)
+        else:
+            write_sample_sheet({}, processed_samples_file, self.sample_sheet_format)
+
+    def copy_to_audit_trail(self, file_path, audit_file):
+        '''
+        Function to store a copy of a file in the audit trail (without 
+        starting a new process, see stage_file)
+        '''
+        self.stage_file(file_path, audit_file)
 
-    def generate_audit_trail(self):
+    def generate_audit_trail(self, wait=True):
         '''
         Produce audit trail in the output_dir. Most file contents are produced
         within this function but the sample_sheet and the user_parameters file
         should be produced in the individual pipelines and this step just 
-        ensures a copy is stored in the output_dir for audit trail
+        ensures a copy is stored in the output_dir for audit trail. The 
+        different files are produced concurrently. If wait is False, the 
+        function returns before the audit trail is finished and 
+        wait_for_audit_trail should be called to make sure it was completed.
+        If input_checksums is True, the checksums of the input files are also
+        stored (input_checksums.yaml). Since this can take long for big 
+        cohorts, this step is not limited by the audit_timeout. The other 
+        steps have audit_timeout seconds each (counted from the start of the
+        step) and the git and conda commands they call are killed after it
         '''
         assert pathlib.Path(self.sample_sheet).exists(), \
             f"The sample sheet ({str(self.sample_sheet)}) does not exist. Either this file was not created properly by the pipeline or was deleted before starting the pipeline."
         assert pathlib.Path(self.user_parameters).exists(), \
             f"The provided user_parameters ({self.user_parameters}) does not exist. Either this file was not created properly by the pipeline or was deleted before starting the pipeline"
         git_file = self.path_to_audit.joinpath('log_git.yaml')
-        self.get_git_audit(git_file)
         conda_file = self.path_to_audit.joinpath('log_conda.txt')
-        self.get_conda_audit(conda_file)
         pipeline_file = self.path_to_audit.joinpath('log_pipeline.yaml')
-        self.get_pipeline_audit(pipeline_file)
         user_parameters_audit_file = self.path_to_audit.joinpath('user_parameters.yaml')
-        subprocess.run(['cp', self.user_parameters, user_parameters_audit_file],
-                                            check=True, timeout=60)
-        samples_audit_file = self.path_to_audit.joinpath('sample_sheet.yaml')
-        subprocess.run(['cp', self.sample_sheet, samples_audit_file],
-                                            check=True, timeout=60)
-        return [git_file, conda_file, pipeline_file, user_parameters_audit_file, samples_audit_file]
+        samples_audit_file = self.get_audit_sample_sheet()
+        # Before the sample sheet of the previous run is overwritten
+        self.__init_processed_samples(get_processed_samples_file(samples_audit_file), samples_audit_file)
+        audit_steps = [(self.get_git_audit, git_file),
+                        (self.get_conda_audit, conda_file),
+                        (self.get_pipeline_audit, pipeline_file),
+                        (self.copy_to_audit_trail, self.user_parameters, user_parameters_audit_file),
+                        (self.copy_to_audit_trail, self.sample_sheet, samples_audit_file)]
+        audit_files = [git_file, conda_file, pipeline_file, user_parameters_audit_file, samples_audit_file]
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=len(audit_steps) + 1)
+        self.__audit_step_deadlines = {}
+        self.__audit_futures = {executor.submit(self.__run_audit_step, step, *args): (args[-1], True) 
+                                for step, *args in audit_steps}
+        if self.input_checksums:
+            checksums_file = self.path_to_audit.joinpath('input_checksums.yaml')
+            self.__audit_futures[executor.submit(self.get_input_checksums_audit, checksums_file)] = \
+                (checksums_file, False)
+            audit_files.append(checksums_file)
+        executor.shutdown(wait=False)
+        if wait:
+            self.wait_for_audit_trail()
+        return audit_files
+
+    def __run_audit_step(self, step, *args):
+        self.__audit_step_deadlines[args[-1]] = time.monotonic() + self.audit_timeout
+        step(*args)
+
+    def wait_for_audit_trail(self):
+        '''
+        Function to wait until all the files of the audit trail (started by 
+        generate_audit_trail) are produced. Every step (except the checksums of
+        the input files) has to finish within audit_timeout seconds from its 
+        own start. Errors in any of the steps are raised here
+        '''
+        for future, (audit_file, has_timeout) in self.__audit_futures.items():
+            remaining_time = None
+            if has_timeout:
+                deadline = self.__audit_step_deadlines.get(audit_file, time.monotonic() + self.audit_timeout)
+                remaining_time = max(deadline - time.monotonic(), 0)
+            try:
+                future.result(timeout=remaining_time)
+            except concurrent.futures.TimeoutError:
+                raise TimeoutError(self.error_formatter(
+                    f"The audit trail file {str(audit_file)} could not be produced within {self.audit_timeout} seconds."
+                    ))
+        self.__audit_futures = {}
+
+    # Patterns to read the rules of a Snakefile without loading the workflow
+    SNAKEFILE_PATTERNS = {
+        'rule': re.compile(r'^\s*(?:rule|checkpoint)\s+(\w+)\s*:', re.MULTILINE),
+        'use_rule': re.compile(r'^\s*use\s+rule\s+[\w*]+(?:\s+from\s+\w+)?\s+as\s+([\w*]+)', re.MULTILINE),
+        'include': re.compile(r'^\s*include\s*:\s*[\'"]([^\'"]+)[\'"]', re.MULTILINE),
+        'localrules': re.compile(r'^\s*localrules\s*:\s*((?:[^\n]*\\\n)*[^\n]*)', re.MULTILINE),
+        'default_target': re.compile(r'^\s*default_target\s*:\s*(True)\b', re.MULTILINE)
+    }
+
+    def parse_snakefile(self, snakefile=None):
+        '''
+        Function to read the rules of a Snakefile and of the files it 
+        includes without loading the workflow. Returns a dictionary with the
+        names of the rules in order of appearance (including the ones made 
+        with 'use rule ... as'), the default target and the local rules. As
+        in Snakemake, the default target is the rule with 
+        'default_target: True' or else the first rule of the Snakefile 
+        itself (rules of included files do not become the default target)
+        '''
+        snakefile = pathlib.Path(self.snakefile if snakefile is None else snakefile)
+        parsed_snakefile = {'rules': [], 'default_target': None, 'local_rules': set()}
+        first_rule = self.__parse_snakefile(snakefile, parsed_snakefile)
+        if parsed_snakefile['default_target'] is None:
+            parsed_snakefile['default_target'] = first_rule
+        return parsed_snakefile
+
+    def __parse_snakefile(self, snakefile, parsed_snakefile):
+        '''
+        Add the rules of a Snakefile (and of the files it includes) to the 
+        parsed_snakefile. Returns the first rule of the Snakefile itself
+        '''
+        with open(snakefile) as file_:
+            content = file_.read()
+        # Rules, includes... are kept in the order they appear in the file
+        items = sorted((match.start(), item_type, match.group(1))
+                        for item_type, pattern in self.SNAKEFILE_PATTERNS.items()
+                        for match in pattern.finditer(content))
+        first_rule = None
+        last_rule = None
+        for _, item_type, value in items:
+            if item_type in ('rule', 'use_rule'):
+                # Rules of a module imported with a pattern (use rule * from
+                # module as module_*) cannot be known without loading it
+                if '*' in value:
+                    continue
+                parsed_snakefile['rules'].append(value)
+                first_rule = value if first_rule is None else first_rule
+                last_rule = value
+            elif item_type == 'include':
+                self.__parse_snakefile(snakefile.parent.joinpath(value), parsed_snakefile)
+            elif item_type == 'localrules':
+                parsed_snakefile['local_rules'].update(
+                    rule for rule in re.split(r'[\s,\\]+', value) if rule
+                )
+            elif last_rule is not None:
+                parsed_snakefile['default_target'] = last_rule
+        return first_rule
+
+    def get_snakefile_rules(self, snakefile=None):
+        '''
+        Function to get the names of the rules (in order of appearance) of a 
+        Snakefile and of the files it includes, without loading the workflow
+        '''
+        return self.parse_snakefile(snakefile)['rules']
+
+    def make_job_batches(self):
+        '''
+        Function to group the jobs of every rule in batches that are sent to 
+        the cluster as a single job. Returns the overwrite_groups and 
+        group_components to be passed to snakemake. Every rule gets its own
+        group (so jobs of different rules are not mixed) with batch_size jobs
+        or, if batch_target_runtime is given, as many jobs as fit in that 
+        runtime according to batch_job_runtimes (minutes per job of every 
+        rule). By default all rules except the default target and the local
+        rules are batched (see parse_snakefile)
+        '''
+        if self.batch_rules is None:
+            parsed_snakefile = self.parse_snakefile()
+            rules = [rule for rule in dict.fromkeys(parsed_snakefile['rules'])
+                    if rule != parsed_snakefile['default_target'] 
+                    and rule not in parsed_snakefile['local_rules']]
+        else:
+            rules = self.batch_rules
+        overwrite_groups = {}
+        group_components = {}
+        for rule in rules:
+            group = f'batch_{rule}'
+            if self.batch_target_runtime is not None and rule in self.batch_job_runtimes:
+                jobs_per_batch = int(self.batch_target_runtime // max(self.batch_job_runtimes[rule], 1e-6))
+            else:
+                jobs_per_batch = self.batch_size
+            overwrite_groups[rule] = group
+            group_components[group] = max(int(jobs_per_batch), 1)
+        return overwrite_groups, group_components
+
+    def get_cluster_executor(self):
+        '''
+        Function to get the backend (LSF, SLURM, local processes...) used to 
+        send the jobs to the cluster. The cluster logs are written to 
+        output_dir/log/cluster. If use_cluster_status is True, Snakemake asks
+        the scheduler (in batch, see cluster_executors) whether the jobs 
+        finished instead of waiting for marker files in the file system. If
+        there are resource_factors, the resources of every job are estimated
+        from the size of its input when it is submitted. The estimates of the
+        run history (if used) are also applied when submitting
+        '''
+        log_dir = self.output_dir.joinpath('log', 'cluster')
+        if self.resource_factors or self.history_estimates:
+            log_dir.mkdir(parents=True, exist_ok=True)
+            resource_model_file = log_dir.joinpath('resource_model.json')
+            self.get_resource_model().to_file(resource_model_file)
+        else:
+            resource_model_file = None
+        return get_executor(self.executor,
+                            queue=self.queue,
+                            log_dir=log_dir,
+                            time_limit=self.time_limit,
+                            max_submissions_per_second=self.max_submissions_per_second,
+                            max_jobs=self.max_jobs,
+                            use_cluster_status=self.use_cluster_status,
+                            status_cache_ttl=self.status_cache_ttl,
+                            resource_model_file=resource_model_file,
+                            throttle_file=self.throttle_file)
+
+    def get_sample_input_sizes(self):
+        '''
+        Function to get the size of the input files of every sample. The 
+        sizes are taken from the sample sheet if they were not given (e.g. 
+        from PipelineStartup.sample_input_sizes)
+        '''
+        if self.sample_input_sizes is None:
+            sample_dict = read_sample_sheet(self.sample_sheet, self.sample_sheet_format)
+            self.sample_input_sizes = ResourceModel.get_sample_input_sizes(sample_dict)
+        return self.sample_input_sizes
+
+    def get_resource_model(self):
+        '''
+        Function to get the model that estimates the memory, threads and time
+        limit of the jobs of every rule (with resource_factors) from the size
+        of the input of every sample and of the rules with enough jobs in the
+        run history
+        '''
+        return ResourceModel(rule_factors=self.resource_factors,
+                            sample_sizes=self.get_sample_input_sizes(),
+                            time_limit=self.time_limit,
+                            rule_estimates=self.history_estimates)
+
+    def get_run_history(self):
+        '''
+        Function to open the history of the jobs of previous runs (only if
+        use_run_history is True). If the history cannot be used, the pipeline
+        continues without it
+        '''
+        if not self.use_run_history:
+            return None
+        return self.open_cache(RunHistory, self.run_history_file,
+                                "run history", "The resources of the Snakefile will be used.")
 
     def run_snakemake(self):
         '''
         Main function to run snakemake. It has all the pre-determined input for
         running a Juno pipeline. Everything is customizable to run outside the 
         RIVM but the defaults are set for the RIVM and especially for an LSF 
-        cluster. The commands are for now set to use bsub so it will not work
-        with other types of clusters but it is on the to-do list to do it.
+        cluster. Other clusters can be used by choosing another executor (see
+        cluster_executors).
         '''
         print(self.message_formatter(f"Running {self.pipeline_name} pipeline."))
+        run_start_ns = time.time_ns()
         
         # Generate pipeline audit trail only if not dryrun (or unlock)
         if not self.dryrun or self.unlock:
             self.path_to_audit.mkdir(parents=True, exist_ok=True)
-            self.audit_trail = self.generate_audit_trail()
+            with self.timer.phase('audit_trail'):
+                self.audit_trail = self.generate_audit_trail(wait=not self.background_audit)
+
+        run_history = self.get_run_history()
+        if run_history is not None:
+            with self.timer.phase('run_history_read'):
+                self.history_estimates = run_history.estimate_resources(self.pipeline_name)
+                priority_rules = run_history.get_priority_rules(self.pipeline_name)
+            print(self.message_formatter(
+                f"Resources of {len(self.history_estimates)} rules estimated from previous runs. Rules started first: {', '.join(priority_rules) or 'none'}"
+            ))
+            history_collector = JobHistoryCollector(self.workdir)
 
         if self.local:
             print(self.message_formatter("Jobs will run locally"))
-            cluster = None
+            executor_kwargs = {'cluster': None, 'nodes': self.cores}
         else:
-            print(self.message_formatter("Jobs will be sent to the cluster"))
-            cluster_log_dir = pathlib.Path(str(self.output_dir)).joinpath('log', 'cluster')
-            cluster_log_dir.mkdir(parents=True, exist_ok=True)
-            cluster = "bsub -q %s \
-                    -n {threads} \
-                    -o %s/{name}_{wildcards}_{jobid}.out \
-                    -e %s/{name}_{wildcards}_{jobid}.err \
-                    -R \"span[hosts=1]\" \
-                    -R \"rusage[mem={resources.mem_gb}G]\" \
-                    -M {resources.mem_gb}G \
-                    -W %s " % (str(self.queue), str(cluster_log_dir), str(cluster_log_dir), str(self.time_limit))
+            cluster_executor = self.get_cluster_executor()
+            print(self.message_formatter(f"Jobs will be sent to the cluster ({cluster_executor.name})"))
+            executor_kwargs = cluster_executor.get_snakemake_kwargs()
         
-        pipeline_run_successful = snakemake(self.snakefile,
-                                    workdir=self.workdir,
-                                    configfiles=[self.user_parameters, self.fixed_parameters],
-                                    config={"sample_sheet": str(self.sample_sheet)},
-                                    cores=self.cores,
-                                    nodes=self.cores,
-                                    cluster=cluster,
-                                    jobname=self.pipeline_name + "_{name}.jobid{jobid}",
-                                    use_conda=self.useconda,
-                                    conda_frontend=self.conda_frontend,
-                                    conda_prefix=self.conda_prefix,
-                                    use_singularity=self.usesingularity,
-                                    singularity_args=self.singularityargs,
-                                    singularity_prefix=self.singularity_prefix,
-                                    keepgoing=True,
-                                    printshellcmds=True,
-                                    force_incomplete=self.rerunincomplete,
-                                    restart_times=self.restarttimes, 
-                                    latency_wait=self.latency,
-                                    unlock=self.unlock,
-                                    dryrun=self.dryrun,
-                                    **self.kwargs)
+        # snakemake is only imported when needed because importing it is slow
+        from snakemake import snakemake
+        # The arguments given by the user (kwargs) have priority
+        kwargs = {**executor_kwargs, **self.kwargs}
+        kwargs['log_handler'] = list(kwargs.get('log_handler', [])) + [self.__time_snakemake_phases]
+        if run_history is not None:
+            kwargs['log_handler'].append(history_collector)
+            if priority_rules:
+                kwargs.setdefault('prioritytargets', priority_rules)
+        if self.batch_jobs and not self.local:
+            # Groups given by the user (kwargs) are respected
+            overwrite_groups, group_components = self.make_job_batches()
+            kwargs.setdefault('overwrite_groups', overwrite_groups)
+            kwargs.setdefault('group_components', group_components)
+            print(self.message_formatter(
+                f"Jobs will be sent to the cluster in batches: {group_components}"
+            ))
+        self.timer.start('snakemake_dag')
+        try:
+            pipeline_run_successful = snakemake(self.snakefile,
+                                        workdir=self.workdir,
+                                        configfiles=[self.user_parameters, self.fixed_parameters],
+                                        config={"sample_sheet": str(self.sample_sheet), 
+                                                "sample_sheet_format": self.sample_sheet_format,
+                                                **self.config_overrides},
+                                        cores=self.cores,
+                                        jobname=self.pipeline_name + "_{name}.jobid{jobid}",
+                                        use_conda=self.useconda,
+                                        conda_frontend=self.conda_frontend,
+                                        conda_prefix=self.conda_prefix,
+                                        use_singularity=self.usesingularity,
+                                        singularity_args=self.singularityargs,
+                                        singularity_prefix=self.singularity_prefix,
+                                        keepgoing=True,
+                                        printshellcmds=True,
+                                        force_incomplete=self.rerunincomplete,
+                                        restart_times=self.restarttimes, 
+                                        latency_wait=self.latency,
+                                        unlock=self.unlock,
+                                        dryrun=self.dryrun,
+                                        **kwargs)
+        finally:
+            for phase in ['snakemake_dag', 'snakemake_jobs']:
+                if self.timer.is_running(phase):
+                    self.timer.stop(phase)
+        if run_history is not None and not self.dryrun:
+            # The jobs that finished are stored even if the run failed
+            with self.timer.phase('run_history_write'):
+                run_history.add_records(self.pipeline_name, history_collector.get_records())
+        # If the audit trail was produced in the background, make sure it is
+        # complete before finishing
+        with self.timer.phase('audit_trail_wait'):
+            self.wait_for_audit_trail()
+        # Only the samples of successful runs are skipped by the next 
+        # incremental run (not the ones of failed runs, dry runs or unlocks)
+        if pipeline_run_successful and not self.dryrun and not self.unlock:
+            self.update_processed_samples(get_processed_samples_file(self.get_audit_sample_sheet()),
+                                            modified_ns=run_start_ns)
+        self.write_timings()
         assert pipeline_run_successful, self.error_formatter(f"An error occured while running the {self.pipeline_name} pipeline.")
         print(self.message_formatter(f"Finished running {self.pipeline_name} pipeline!"))
         return pipeline_run_successful
 
+    @staticmethod
+    def split_sample_dict(sample_dict, num_shards, sample_sizes=None):
+        '''
+        Function to split a sample_dict in (at most) num_shards sample_dicts.
+        The samples are distributed so every shard gets a similar total input
+        size (or a similar number of samples if the sizes are not known). The
+        order of the samples is kept within every shard
+        '''
+        assert int(num_shards) > 0, \
+            f'The number of shards should be a positive number. {num_shards} was given.'
+        sample_sizes = sample_sizes if sample_sizes is not None else {}
+        shard_sizes = [0] * int(num_shards)
+        shard_of_sample = {}
+        # The biggest samples are placed first, always in the smallest shard
+        for sample in sorted(sample_dict, key=lambda sample: -sample_sizes.get(str(sample), 0)):
+            smallest_shard = min(range(len(shard_sizes)), key=lambda shard: shard_sizes[shard])
+            shard_of_sample[sample] = smallest_shard
+            shard_sizes[smallest_shard] += max(sample_sizes.get(str(sample), 0), 1)
+        shards = [{} for _ in shard_sizes]
+        for sample, sample_files in sample_dict.items():
+            shards[shard_of_sample[sample]][sample] = sample_files
+        return [shard for shard in shards if shard]
+
+    def make_shard(self, shard_index, shard_sample_dict, num_shards):
+        '''
+        Function to make the RunSnakemake of one shard of a sharded run. The
+        shard writes its output and audit trail to 
+        <output_dir>/shards/shard_<index>, gets its part of the cores and of
+        the maximum number of cluster jobs and shares the submission rate 
+        limit with the other shards
+        '''
+        shard_dir = self.output_dir.joinpath('shards', f'shard_{shard_index}')
+        shard_dir.mkdir(parents=True, exist_ok=True)
+        shard_sample_sheet = shard_dir.joinpath(get_sample_sheet_name('sample_sheet', self.sample_sheet_format))
+        write_sample_sheet(shard_sample_dict, shard_sample_sheet, self.sample_sheet_format)
+        shard = copy.copy(self)
+        shard.output_dir = shard_dir
+        shard.path_to_audit = shard_dir.joinpath('audit_trail')
+        shard.snakemake_report = str(shard.path_to_audit.joinpath(pathlib.Path(self.snakemake_report).name))
+        shard.sample_sheet = shard_sample_sheet
+        shard.cores = max(self.cores // num_shards, 1)
+        shard.max_jobs = max(self.max_jobs // num_shards, 1)
+        shard.throttle_file = self.output_dir.joinpath('log', 'cluster', 'submission_throttle')
+        shard.timer = PhaseTimer()
+        # The audit trail of the sharded run (still being produced) is not
+        # part of the shard
+        shard.__audit_futures = {}
+        shard.config_overrides = {**self.config_overrides, 'output_dir': str(shard_dir)}
+        shard.kwargs = dict(self.kwargs)
+        return shard
+
+    def create_environments(self):
+        '''
+        Function to create the conda environments (and pull the containers)
+        of the jobs of the sample sheet without running the jobs
+        '''
+        print(self.message_formatter("Creating the environments of the pipeline..."))
+        from snakemake import snakemake
+        return snakemake(self.snakefile,
+                        workdir=self.workdir,
+                        configfiles=[self.user_parameters, self.fixed_parameters],
+                        config={"sample_sheet": str(self.sample_sheet), 
+                                "sample_sheet_format": self.sample_sheet_format,
+                                **self.config_overrides},
+                        cores=1,
+                        nodes=1,
+                        use_conda=True,
+                        conda_frontend=self.conda_frontend,
+                        conda_prefix=self.conda_prefix,
+                        conda_create_envs_only=True,
+                        use_singularity=self.usesingularity,
+                        singularity_args=self.singularityargs,
+                        singularity_prefix=self.singularity_prefix,
+                        **self.kwargs)
+
+    def run_snakemake_sharded(self, num_shards, final_run=False):
+        '''
+        Function to run a big cohort as num_shards independent Snakemake 
+        instances running at the same time (in separate processes), each with
+        part of the samples of the sample sheet. The pipeline should take the
+        output directory from the config (config['output_dir']), which is 
+        changed to <output_dir>/shards/shard_<index> for every shard. The 
+        shards share the working directory (and its .snakemake directory), so
+        the conda environments are created once before the shards start and
+        the shards should not write to the same files. The audit trail of the
+        complete sample sheet is written to <output_dir>/audit_trail. If all
+        the shards finish successfully, their outputs are moved to the output
+        directory (see merge_shards), their audit trails to
+        <output_dir>/audit_trail/shards and the samples are added to the 
+        processed samples (see update_processed_samples). If final_run is 
+        True, the pipeline is run once more with the complete sample sheet 
+        to produce the outputs that combine all the samples (the outputs of 
+        the single samples are already there so they are not produced again,
+        but the DAG of the complete cohort has to be built). If any shard 
+        fails, the shards are left as they are, so the run can be restarted.
+        The shards run in new (spawned) processes, so they have to be 
+        picklable (e.g. the hooks given to Snakemake in the kwargs)
+        '''
+        run_start_ns = time.time_ns()
+        sample_dict = read_sample_sheet(self.sample_sheet, self.sample_sheet_format)
+        shard_sample_dicts = self.split_sample_dict(sample_dict, num_shards, 
+                                                    self.get_sample_input_sizes())
+        num_shards = len(shard_sample_dicts)
+        print(self.message_formatter(
+            f"Running {self.pipeline_name} pipeline in {num_shards} shards of around {len(sample_dict) // max(num_shards, 1)} samples."
+        ))
+        if not self.dryrun:
+            self.path_to_audit.mkdir(parents=True, exist_ok=True)
+            with self.timer.phase('audit_trail'):
+                self.audit_trail = self.generate_audit_trail(wait=False)
+            if self.useconda:
+                with self.timer.phase('create_environments'):
+                    environments_created = self.create_environments()
+                assert environments_created, self.error_formatter(
+                    f"The environments of the {self.pipeline_name} pipeline could not be created."
+                )
+        self.output_dir.joinpath('log', 'cluster').mkdir(parents=True, exist_ok=True)
+        shards = [self.make_shard(shard_index, shard_sample_dict, num_shards)
+                    for shard_index, shard_sample_dict in enumerate(shard_sample_dicts)]
+        with self.timer.phase('snakemake_shards'):
+            processes = [self.start_in_process(shard, f'shard_{shard_index}')
+                        for shard_index, shard in enumerate(shards)]
+            for process in processes:
+                process.join()
+        with self.timer.phase('audit_trail_wait'):
+            self.wait_for_audit_trail()
+        failed_shards = [str(shard.output_dir) for shard, process in zip(shards, processes)
+                            if process.exitcode != 0]
+        assert not failed_shards, self.error_formatter(
+            f"An error occured while running the {self.pipeline_name} pipeline in the shards: {', '.join(failed_shards)}."
+        )
+        with self.timer.phase('merge_shards'):
+            self.merge_shards(shards)
+        if final_run:
+            return self.run_snakemake()
+        if not self.dryrun:
+            self.update_processed_samples(get_processed_samples_file(self.get_audit_sample_sheet()),
+                                            modified_ns=run_start_ns)
+        self.write_timings()
+        return True
+
+    @staticmethod
+    def run_in_process(run):
+        '''
+        Target of the processes that run a RunSnakemake (e.g. the shards of
+        a sharded run). The exit code of the process is 0 if the run was
+        successful
+        '''
+        try:
+            successful_run = run.run_snakemake()
+        except Exception as err:
+            print(run.error_formatter(f"The run in {run.output_dir} failed: {err}"))
+            successful_run = False
+        sys.stdout.flush()
+        sys.stderr.flush()
+        sys.exit(0 if successful_run else 1)
+
+    @staticmethod
+    def start_in_process(run, name):
+        '''
+        Function to start a RunSnakemake in a new process (see 
+        run_in_process). Returns the started process
+        '''
+        # Forking is not safe on macOS nor once threads (e.g. of the input
+        # discovery or the audit trail) were started
+        context = multiprocessing.get_context('spawn')
+        process = context.Process(target=RunSnakemake.run_in_process, args=(run,), name=name)
+        process.start()
+        return process
+
+    def merge_shards(self, shards):
+        '''
+        Function to move the outputs of the shards to the output directory. 
+        Files produced by a single shard are moved to the same relative path
+        in the output directory. Files produced by more than one shard (e.g.
+        summaries or cluster logs such as submissions.txt) are moved to the 
+        same directory with the name of the shard in front of their name 
+        (shard_<index>_<name>). The audit trail of every shard is moved to 
+        <output_dir>/audit_trail/shards/shard_<index> and a summary of the 
+        shards is written to <output_dir>/audit_trail/shards.yaml
+        '''
+        shard_files = {}
+        for shard in shards:
+            for root, _, files in os.walk(shard.output_dir):
+                relative_root = pathlib.Path(root).relative_to(shard.output_dir)
+                if relative_root.parts[:1] == ('audit_trail',):
+                    continue
+                for file_name in files:
+                    relative_path = relative_root.joinpath(file_name)
+                    if relative_path != pathlib.Path(shard.sample_sheet.name):
+                        shard_files.setdefault(relative_path, []).append(shard.output_dir)
+        for relative_path, shard_dirs in shard_files.items():
+            for shard_dir in shard_dirs:
+                if len(shard_dirs) == 1:
+                    destination = self.output_dir.joinpath(relative_path)
+                else:
+                    destination = self.output_dir.joinpath(relative_path.parent, 
+                                                            f'{shard_dir.name}_{relative_path.name}')
+                destination.parent.mkdir(parents=True, exist_ok=True)
+                os.replace(shard_dir.joinpath(relative_path), destination)
+        shards_audit_dir = self.path_to_audit.joinpath('shards')
+        shards_audit_dir.mkdir(parents=True, exist_ok=True)
+        summary = {}
+        for shard in shards:
+            shard_audit_dir = shards_audit_dir.joinpath(shard.output_dir.name)
+            if shard_audit_dir.exists():
+                shutil.rmtree(shard_audit_dir)
+            if shard.path_to_audit.exists():
+                os.replace(shard.path_to_audit, shard_audit_dir)
+            shard_samples = read_sample_sheet(shard.sample_sheet, shard.sample_sheet_format)
+            summary[shard.output_dir.name] = {'samples': list(shard_samples),
+                                            'audit_trail': str(shard_audit_dir)}
+        with open(self.path_to_audit.joinpath('shards.yaml'), 'w') as file_:
+            yaml.dump(summary, file_, default_flow_style=False, sort_keys=False)
+        shutil.rmtree(self.output_dir.joinpath('shards'))
+
+    def __time_snakemake_phases(self, msg):
+        '''
+        Snakemake log handler to split the time spent building the DAG from 
+        the time spent running the jobs. The job statistics (run_info) are 
+        logged once the DAG is ready
+        '''
+        if msg.get('level') == 'run_info' and self.timer.is_running('snakemake_dag'):
+            self.timer.stop('snakemake_dag')
+            self.timer.start('snakemake_jobs')
+
+    def write_timings(self):
+        '''
+        Write the timings of the phases of the run to the audit trail 
+        (log_timings.yaml) if the audit trail exists
+        '''
+        if self.path_to_audit.is_dir():
+            self.timer.write(self.path_to_audit.joinpath('log_timings.yaml'))
+
     def make_snakemake_report(self):
         '''
         Function to make a snakemake report after having run a pipeline. Note
@@ -415,20 +1215,24 @@ class RunSnakemake(helper_functions.JunoHelpers):
         # used instead of the original sample sheet. This is to avoid that if
         # a new run is started while there is one running, the correct sample
         # sheet for this new run is used.
-        snakemake_report_successful = snakemake(self.snakefile,
-                                    workdir=self.workdir,
-                                    configfiles=[self.user_parameters, self.fixed_parameters],
-                                    config={"sample_sheet": str(self.path_to_audit.joinpath('sample_sheet.yaml'))},
-                                    cores=1,
-                                    nodes=1,
-                                    use_conda=self.useconda,
-                                    conda_frontend=self.conda_frontend,
-                                    conda_prefix=self.conda_prefix,
-                                    use_singularity=self.usesingularity,
-                                    singularity_args=self.singularityargs,
-                                    singularity_prefix=self.singularity_prefix,
-                                    report=self.snakemake_report,
-                                    **self.kwargs)
+        from snakemake import snakemake
+        with self.timer.phase('snakemake_report'):
+            snakemake_report_successful = snakemake(self.snakefile,
+                                        workdir=self.workdir,
+                                        configfiles=[self.user_parameters, self.fixed_parameters],
+                                        config={"sample_sheet": str(self.get_audit_sample_sheet()),
+                                                "sample_sheet_format": self.sample_sheet_format},
+                                        cores=1,
+                                        nodes=1,
+                                        use_conda=self.useconda,
+                                        conda_frontend=self.conda_frontend,
+                                        conda_prefix=self.conda_prefix,
+                                        use_singularity=self.usesingularity,
+                                        singularity_args=self.singularityargs,
+                                        singularity_prefix=self.singularity_prefix,
+                                        report=self.snakemake_report,
+                                        **self.kwargs)
+        self.write_timings()
         return snakemake_report_successful
 
         
\ No newline at end of file
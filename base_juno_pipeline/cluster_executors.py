@@ -0,0 +1,519 @@
+'''
+Backends to send the jobs of a Juno pipeline to a cluster. Every backend
+knows how to build the submission command that Snakemake uses for every job
+(or group of jobs) and how fast and how many jobs can be submitted, so the
+scheduler is not flooded when a big run starts. Besides LSF and SLURM there
+is a local stand-in backend that "submits" the jobs as background processes
+of the local machine, which is useful to test the submission path (and the
+throttling) without a real cluster.
+
+The submissions are throttled by wrapping the submission command, so the
+limit also holds for several Snakemake instances sharing the same throttle
+file. The same wrapper can estimate the resources of every job with a
+ResourceModel before submitting it. The status of the jobs is asked to the scheduler for all the jobs at
+once (e.g. a single bjobs call) and cached for a few seconds, so Snakemake
+knows immediately when a job finished without waiting for marker files in a
+shared file system. This module is also the script used for the throttling,
+for the status checks and for the local backend (it only uses the standard
+library so it can be run without installing the package):
+
+    python cluster_executors.py wrap [--throttle-file <file> --max-submissions-per-second <n>]
+                                     [--resource-model <json> --default-mem-gb <n>] <command...> <jobscript>
+    python cluster_executors.py status <executor> <log_dir> <cache_ttl> <jobid>
+    python cluster_executors.py submit <log_dir> <jobscript>
+'''
+
+import argparse
+import fcntl
+import json
+import os
+import pathlib
+import re
+import shlex
+import subprocess
+import sys
+import time
+
+if __package__:
+    from base_juno_pipeline.resource_model import ResourceModel
+else:
+    # Run as a script (the package may not be installed): the modules next
+    # to this one can be imported directly
+    from resource_model import ResourceModel
+
+
+class ClusterExecutor:
+    '''
+    Base class for the cluster backends. Subclasses only need to implement
+    submit_command. max_submissions_per_second limits how fast jobs are sent
+    to the scheduler and max_jobs how many jobs can be submitted (queued or
+    running) at the same time. The time of the last submission is kept in
+    the throttle_file (log_dir/submission_throttle by default). The states
+    of the jobs are cached for status_cache_ttl seconds in 
+    log_dir/job_states.json. Subclasses that can be asked for the state of 
+    their jobs implement status_query_command and parse_job_states. If a
+    resource_model_file (see ResourceModel) is given, the memory, threads 
+    and time limit of every job are estimated when it is submitted and
+    jobs without memory (in the Snakefile or estimated) get default_mem_gb
+    '''
+
+    name = None
+    # State of a job for Snakemake
+    RUNNING = 'running'
+    SUCCESS = 'success'
+    FAILED = 'failed'
+
+    def __init__(self,
+                queue=None,
+                log_dir='log/cluster',
+                time_limit=60,
+                max_submissions_per_second=10,
+                max_jobs=300,
+                throttle_file=None,
+                use_cluster_status=True,
+                status_cache_ttl=5,
+                resource_model_file=None,
+                default_mem_gb=4):
+        '''Constructor'''
+        assert max_submissions_per_second is None or max_submissions_per_second > 0, \
+            f'The maximum number of submissions per second should be positive. {max_submissions_per_second} was given.'
+        assert max_jobs is None or int(max_jobs) > 0, \
+            f'The maximum number of jobs in the cluster should be positive. {max_jobs} was given.'
+        self.queue = queue
+        self.log_dir = pathlib.Path(log_dir)
+        self.time_limit = time_limit
+        self.max_submissions_per_second = max_submissions_per_second
+        self.max_jobs = max_jobs
+        if throttle_file is None:
+            throttle_file = self.log_dir.joinpath('submission_throttle')
+        self.throttle_file = pathlib.Path(throttle_file)
+        self.use_cluster_status = use_cluster_status
+        self.status_cache_ttl = status_cache_ttl
+        self.status_cache_file = self.log_dir.joinpath('job_states.json')
+        self.resource_model_file = resource_model_file
+        self.default_mem_gb = default_mem_gb
+
+    def submit_command(self):
+        '''
+        Command (with Snakemake wildcards) used to submit a job script.
+        Snakemake appends the path to the job script to it
+        '''
+        raise NotImplementedError
+
+    def resource_fields(self):
+        '''
+        Values for the threads, memory and time limit in the submission 
+        command. If the resources are estimated, they are placeholders that
+        are filled in by the submission wrapper (Snakemake turns {{x}} into
+        {x} when formatting the command)
+        '''
+        if self.resource_model_file is not None:
+            return {'threads': '{{threads}}', 'mem_gb': '{{mem_gb}}', 'time_limit': '{{time_limit}}'}
+        return {'threads': '{threads}', 'mem_gb': '{resources.mem_gb}', 'time_limit': str(self.time_limit)}
+
+    def wrapped_submit_command(self):
+        '''
+        Submission command that waits (if necessary) so no more than
+        max_submissions_per_second jobs are submitted and that fills in the
+        estimated resources of the job (if a resource model is used)
+        '''
+        wrapper_args = []
+        if self.max_submissions_per_second is not None:
+            wrapper_args += ['--throttle-file', shlex.quote(str(self.throttle_file.resolve())),
+                            '--max-submissions-per-second', str(self.max_submissions_per_second)]
+        if self.resource_model_file is not None:
+            wrapper_args += ['--resource-model', 
+                            shlex.quote(str(pathlib.Path(self.resource_model_file).resolve())),
+                            '--default-mem-gb', str(self.default_mem_gb)]
+        if not wrapper_args:
+            return self.submit_command()
+        return f'{shlex.quote(sys.executable)} {shlex.quote(os.path.abspath(__file__))} wrap ' \
+                f'{" ".join(wrapper_args)} {self.submit_command()}'
+
+    def status_query_command(self):
+        '''
+        Command to ask the scheduler for the state of all the jobs of the 
+        user. None if the backend cannot be asked for the state of its jobs
+        '''
+        return None
+
+    @staticmethod
+    def parse_job_states(output):
+        '''
+        Parse the output of the status_query_command. Returns a dictionary 
+        with the job id as key and 'running', 'success' or 'failed' as value
+        '''
+        raise NotImplementedError
+
+    def query_job_states(self):
+        '''Ask the scheduler for the state of all the jobs at once'''
+        output = subprocess.check_output(self.status_query_command(), timeout=60).decode()
+        return self.parse_job_states(output)
+
+    @staticmethod
+    def parse_job_id(job_id):
+        '''
+        Get the job id from the output of the submission command, e.g.
+        'Job <123> is submitted to queue <bio>.' for LSF
+        '''
+        match = re.search(r'\d+', job_id)
+        return job_id.strip() if match is None else match.group()
+
+    def get_job_state(self, job_id):
+        '''
+        State of a job according to the scheduler. The states of all the 
+        jobs are cached for status_cache_ttl seconds so the scheduler is only
+        asked once for all the jobs running at the same time. Jobs that are
+        not known (yet) by the scheduler are considered to be running. If 
+        the scheduler cannot be asked (e.g. it does not answer in time), the
+        cached states are used until the cache expires again
+        '''
+        job_id = self.parse_job_id(job_id)
+        self.status_cache_file.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.status_cache_file, 'a+') as file_:
+            fcntl.flock(file_, fcntl.LOCK_EX)
+            try:
+                file_.seek(0)
+                content = file_.read()
+                cache = json.loads(content) if content else {'time': 0, 'states': {}}
+                if time.time() - cache['time'] > self.status_cache_ttl:
+                    try:
+                        states = self.query_job_states()
+                    except (subprocess.CalledProcessError, subprocess.TimeoutExpired, OSError) as err:
+                        # Snakemake stops the whole run if the status script
+                        # fails, so a scheduler hiccup should not make it fail.
+                        # The output goes to stderr (stdout is the state)
+                        print(f'Warning: the state of the jobs could not be asked to the scheduler ({err}). '
+                            'The previous states are used.', file=sys.stderr)
+                        states = cache['states']
+                    cache = {'time': time.time(), 'states': states}
+                    file_.seek(0)
+                    file_.truncate()
+                    json.dump(cache, file_)
+                    file_.flush()
+            finally:
+                fcntl.flock(file_, fcntl.LOCK_UN)
+        return cache['states'].get(job_id, self.RUNNING)
+
+    def cluster_status_command(self):
+        '''
+        Command used by Snakemake to get the state of a job (Snakemake 
+        appends the job id to it). None if the states of the jobs cannot
+        be asked to the scheduler
+        '''
+        if not self.use_cluster_status or self.status_query_command() is None \
+                or EXECUTORS.get(self.name) is not type(self):
+            return None
+        return f'{shlex.quote(sys.executable)} {shlex.quote(os.path.abspath(__file__))} status ' \
+                f'{self.name} {shlex.quote(str(self.log_dir.resolve()))} {self.status_cache_ttl}'
+
+    def get_snakemake_kwargs(self):
+        '''
+        Arguments for the snakemake function to submit the jobs with this
+        backend. The number of nodes is the number of jobs that Snakemake
+        keeps in the cluster at the same time
+        '''
+        self.log_dir.mkdir(parents=True, exist_ok=True)
+        self.throttle_file.parent.mkdir(parents=True, exist_ok=True)
+        snakemake_kwargs = {'cluster': self.wrapped_submit_command()}
+        if self.max_jobs is not None:
+            snakemake_kwargs['nodes'] = int(self.max_jobs)
+        cluster_status = self.cluster_status_command()
+        if cluster_status is not None:
+            snakemake_kwargs['cluster_status'] = cluster_status
+            # The states are cached so checking them often is cheap
+            snakemake_kwargs['max_status_checks_per_second'] = 100
+        return snakemake_kwargs
+
+
+class LsfExecutor(ClusterExecutor):
+    '''Backend for LSF clusters (bsub)'''
+
+    name = 'lsf'
+
+    def submit_command(self):
+        fields = self.resource_fields()
+        return "bsub -q %s \
+                -n %s \
+                -o %s/{name}_{wildcards}_{jobid}.out \
+                -e %s/{name}_{wildcards}_{jobid}.err \
+                -R \"span[hosts=1]\" \
+                -R \"rusage[mem=%sG]\" \
+                -M %sG \
+                -W %s " % (str(self.queue), fields['threads'], str(self.log_dir), str(self.log_dir),
+                            fields['mem_gb'], fields['mem_gb'], fields['time_limit'])
+
+    def status_query_command(self):
+        # -a also lists the jobs that finished recently
+        return ['bjobs', '-a', '-noheader', '-o', 'jobid stat']
+
+    @staticmethod
+    def parse_job_states(output):
+        states = {}
+        for line in output.splitlines():
+            fields = line.split()
+            if len(fields) < 2:
+                continue
+            if fields[1] == 'DONE':
+                states[fields[0]] = ClusterExecutor.SUCCESS
+            elif fields[1] in ('EXIT', 'ZOMBI'):
+                states[fields[0]] = ClusterExecutor.FAILED
+            else:
+                states[fields[0]] = ClusterExecutor.RUNNING
+        return states
+
+
+class SlurmExecutor(ClusterExecutor):
+    '''Backend for SLURM clusters (sbatch)'''
+
+    name = 'slurm'
+
+    def submit_command(self):
+        fields = self.resource_fields()
+        # --parsable makes sbatch print only the job id
+        return "sbatch --parsable \
+                -p %s \
+                -N 1 \
+                -c %s \
+                -o %s/{name}_{wildcards}_{jobid}.out \
+                -e %s/{name}_{wildcards}_{jobid}.err \
+                --mem=%sG \
+                -t %s " % (str(self.queue), fields['threads'], str(self.log_dir), str(self.log_dir),
+                            fields['mem_gb'], fields['time_limit'])
+
+    def status_query_command(self):
+        # Running jobs are listed even if they started before the start time
+        return ['sacct', '-X', '-n', '-P', '-o', 'JobIDRaw,State', '-S', 'now-1days']
+
+    @staticmethod
+    def parse_job_states(output):
+        running_states = ('PENDING', 'RUNNING', 'CONFIGURING', 'COMPLETING',
+                        'REQUEUED', 'RESIZING', 'SUSPENDED')
+        states = {}
+        for line in output.splitlines():
+            fields = line.split('|')
+            if len(fields) < 2 or not fields[1]:
+                continue
+            # e.g. 'CANCELLED by 1234'
+            state = fields[1].split()[0]
+            if state == 'COMPLETED':
+                states[fields[0]] = ClusterExecutor.SUCCESS
+            elif state in running_states:
+                states[fields[0]] = ClusterExecutor.RUNNING
+            else:
+                states[fields[0]] = ClusterExecutor.FAILED
+        return states
+
+
+class LocalProcessExecutor(ClusterExecutor):
+    '''
+    Stand-in backend that runs every job as a background process of the
+    local machine. The time and the requested resources of every 
+    submission are written to submissions.txt in the log directory and the 
+    exit code of every job to <jobscript>.exit
+    '''
+
+    name = 'local_process'
+
+    def submit_command(self):
+        fields = self.resource_fields()
+        return f'{shlex.quote(sys.executable)} {shlex.quote(os.path.abspath(__file__))} submit ' \
+                f'--threads {fields["threads"]} --mem-gb {fields["mem_gb"]} ' \
+                f'--time-limit {fields["time_limit"]} {shlex.quote(str(self.log_dir.resolve()))}'
+
+    @staticmethod
+    def submit(log_dir, jobscript, threads=None, mem_gb=None, time_limit=None):
+        '''
+        Start the job script in the background (in its own session so it
+        is not stopped together with the submitting process). Returns the
+        process id, which is used as job id
+        '''
+        log_dir = pathlib.Path(log_dir)
+        log_file = log_dir.joinpath(pathlib.Path(jobscript).name + '.log')
+        exit_file = log_dir.joinpath(pathlib.Path(jobscript).name + '.exit')
+        with open(log_file, 'w') as file_:
+            process = subprocess.Popen(['/bin/sh', '-c', '/bin/sh "$1"; echo $? > "$2"',
+                                        'sh', jobscript, str(exit_file)],
+                                        stdout=file_,
+                                        stderr=subprocess.STDOUT,
+                                        stdin=subprocess.DEVNULL,
+                                        start_new_session=True)
+        with open(log_dir.joinpath('submissions.txt'), 'a') as file_:
+            file_.write(f'{time.time()}\t{process.pid}\t{jobscript}\t{threads}\t{mem_gb}\t{time_limit}\n')
+        return process.pid
+
+    def status_query_command(self):
+        # The submissions and exit files are read directly
+        return []
+
+    def query_job_states(self):
+        states = {}
+        submissions_file = self.log_dir.joinpath('submissions.txt')
+        if not submissions_file.exists():
+            return states
+        with open(submissions_file) as file_:
+            for line in file_:
+                _, job_id, jobscript = line.rstrip('\n').split('\t')[:3]
+                exit_file = self.log_dir.joinpath(pathlib.Path(jobscript).name + '.exit')
+                exit_code = exit_file.read_text().strip() if exit_file.exists() else ''
+                if not exit_code:
+                    states[job_id] = self.RUNNING
+                elif exit_code == '0':
+                    states[job_id] = self.SUCCESS
+                else:
+                    states[job_id] = self.FAILED
+        return states
+
+
+def wait_for_submission_slot(throttle_file, max_submissions_per_second):
+    '''
+    Wait until the next submission is allowed. The throttle file is locked
+    while waiting so concurrent submissions are queued one after the other
+    '''
+    min_interval = 1 / float(max_submissions_per_second)
+    with open(throttle_file, 'a+') as file_:
+        fcntl.flock(file_, fcntl.LOCK_EX)
+        try:
+            file_.seek(0)
+            content = file_.read().strip()
+            last_submission = float(content) if content else 0.0
+            waiting_time = last_submission + min_interval - time.time()
+            if waiting_time > 0:
+                time.sleep(waiting_time)
+            file_.seek(0)
+            file_.truncate()
+            file_.write(str(time.time()))
+            file_.flush()
+        finally:
+            fcntl.flock(file_, fcntl.LOCK_UN)
+
+
+def read_jobscript_properties(jobscript):
+    '''
+    Read the properties (rule, wildcards, input, threads, resources...) that
+    Snakemake writes in the header of every job script
+    '''
+    with open(jobscript) as file_:
+        for line in file_:
+            if line.startswith('# properties = '):
+                return json.loads(line[len('# properties = '):])
+    return {}
+
+
+def read_jobscript_target_jobs(jobscript):
+    '''
+    Read the jobs of a group job script as (rule, wildcards) from the 
+    --target-jobs arguments (rule:name=value,...) of the Snakemake command
+    in it
+    '''
+    with open(jobscript) as file_:
+        for line in file_:
+            if '--target-jobs' not in line:
+                continue
+            args = shlex.split(line)
+            target_jobs = []
+            for arg in args[args.index('--target-jobs') + 1:]:
+                if arg.startswith('--'):
+                    break
+                rule, _, wildcards = arg.partition(':')
+                target_jobs.append((rule, dict(wildcard.split('=', 1) 
+                                                for wildcard in wildcards.split(',') if wildcard)))
+            return target_jobs
+    return []
+
+
+def fill_in_resources(command, resource_model, jobscript, default_mem_gb=None):
+    '''
+    Replace the resource placeholders ({threads}, {mem_gb} and {time_limit})
+    of a submission command by the resources estimated for the job. The 
+    resources of group jobs (batches) are estimated from the jobs in the
+    group (see ResourceModel.estimate_group). Jobs without memory get the
+    default_mem_gb
+    '''
+    properties = read_jobscript_properties(jobscript)
+    if properties.get('type') == 'single':
+        estimates = resource_model.estimate(properties['rule'],
+                                            wildcards=properties.get('wildcards'),
+                                            input_files=properties.get('input'),
+                                            resources=properties.get('resources'),
+                                            threads=properties.get('threads', 1))
+    else:
+        estimates = resource_model.estimate_group(read_jobscript_target_jobs(jobscript),
+                                                resources=properties.get('resources'),
+                                                threads=properties.get('threads', 1))
+    if estimates['mem_gb'] is None:
+        estimates['mem_gb'] = default_mem_gb
+    filled_command = []
+    for arg in command:
+        for resource, value in estimates.items():
+            arg = arg.replace('{' + resource + '}', str(value))
+        filled_command.append(arg)
+    return filled_command
+
+
+EXECUTORS = {executor.name: executor
+            for executor in [LsfExecutor, SlurmExecutor, LocalProcessExecutor]}
+
+
+def get_executor(executor, **kwargs):
+    '''
+    Get a cluster backend by name ('lsf', 'slurm' or 'local_process'). If a
+    ClusterExecutor is given, it is returned as it is
+    '''
+    if isinstance(executor, ClusterExecutor):
+        return executor
+    assert executor in EXECUTORS, \
+        f'Unknown cluster executor {executor}. Choose one of: {", ".join(EXECUTORS)}.'
+    return EXECUTORS[executor](**kwargs)
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(
+        description='Helpers to submit Snakemake job scripts'
+    )
+    subparsers = parser.add_subparsers(dest='action', required=True)
+    wrap_parser = subparsers.add_parser(
+        'wrap', help='Run a submission command respecting a maximum submission rate and/or '
+                    'filling in the resources estimated by a resource model'
+    )
+    wrap_parser.add_argument('--throttle-file')
+    wrap_parser.add_argument('--max-submissions-per-second', type=float)
+    wrap_parser.add_argument('--resource-model')
+    wrap_parser.add_argument('--default-mem-gb')
+    wrap_parser.add_argument('command', nargs=argparse.REMAINDER)
+    status_parser = subparsers.add_parser(
+        'status', help='Print the state of a job (running, success or failed)'
+    )
+    status_parser.add_argument('executor', choices=list(EXECUTORS))
+    status_parser.add_argument('log_dir', type=pathlib.Path)
+    status_parser.add_argument('status_cache_ttl', type=float)
+    status_parser.add_argument('job_id')
+    submit_parser = subparsers.add_parser(
+        'submit', help='Submit a job script as a local background process'
+    )
+    submit_parser.add_argument('--threads')
+    submit_parser.add_argument('--mem-gb')
+    submit_parser.add_argument('--time-limit')
+    submit_parser.add_argument('log_dir', type=pathlib.Path)
+    submit_parser.add_argument('jobscript')
+    args = parser.parse_args(args)
+    if args.action == 'wrap':
+        command = args.command
+        if args.resource_model is not None:
+            command = fill_in_resources(command, ResourceModel.from_file(args.resource_model), 
+                                        jobscript=command[-1], default_mem_gb=args.default_mem_gb)
+        if args.max_submissions_per_second is not None:
+            wait_for_submission_slot(args.throttle_file, args.max_submissions_per_second)
+        os.execvp(command[0], command)
+    elif args.action == 'status':
+        executor = EXECUTORS[args.executor](log_dir=args.log_dir,
+                                            status_cache_ttl=args.status_cache_ttl)
+        print(executor.get_job_state(args.job_id))
+    else:
+        args.log_dir.mkdir(parents=True, exist_ok=True)
+        print(LocalProcessExecutor.submit(args.log_dir, args.jobscript, threads=args.threads,
+                                            mem_gb=args.mem_gb, time_limit=args.time_limit))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+'''
+Persistent cache for the discovery of input files. For every file that was
+found in an input directory it stores the sample/read that was parsed from
+the file name and whether the file had the minimum number of lines. Entries
+are keyed on the path and only used if the size, modification time and inode
+of the file did not change, so unchanged files are not read again when a
+pipeline is started multiple times on the same input directory.
+'''
+
+from base_juno_pipeline import helper_functions
+from collections import namedtuple
+from contextlib import closing
+import os
+
+
+CacheRecord = namedtuple('CacheRecord', ['path', 'size', 'mtime_ns', 'inode',
+                                        'sample', 'read', 'min_num_lines', 'valid'])
+
+
+class DiscoveryCache(helper_functions.SQLiteCache):
+    '''
+    SQLite cache with the results of the discovery of the input files. The
+    records are grouped per directory and per naming scheme (e.g. 'fastq' or
+    'fasta') since the same file can be parsed with different schemes
+    '''
+
+    default_name = 'discovery_cache.sqlite'
+
+    def create_tables(self, connection):
+        connection.execute(
+            '''CREATE TABLE IF NOT EXISTS files (
+                directory TEXT NOT NULL,
+                scheme TEXT NOT NULL,
+                path TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                inode INTEGER NOT NULL,
+                sample TEXT,
+                read TEXT,
+                min_num_lines INTEGER,
+                valid INTEGER,
+                PRIMARY KEY (scheme, path))'''
+        )
+        connection.execute(
+            'CREATE INDEX IF NOT EXISTS files_directory ON files (directory, scheme)'
+        )
+
+    @staticmethod
+    def matches_fingerprint(record, input_file):
+        '''Whether the cached record belongs to the same version of the file'''
+        return (record.size == input_file.size
+                and record.mtime_ns == input_file.mtime_ns
+                and record.inode == input_file.inode)
+
+    @staticmethod
+    def cached_validity(record, min_num_lines):
+        '''
+        Whether the file has min_num_lines according to the cached record.
+        A file that had at least N lines also has at least M<=N lines and a
+        file with less than N lines also has less than M>=N lines. Returns
+        None if the validity cannot be deduced from the record
+        '''
+        if record.valid is None:
+            return None
+        if record.valid and record.min_num_lines >= min_num_lines:
+            return True
+        if not record.valid and record.min_num_lines <= min_num_lines:
+            return False
+        return None
+
+    def lookup(self, directory, scheme):
+        '''
+        Get all the records stored for the files in a directory. Returns a
+        dictionary with the (absolute) path as key
+        '''
+        directory = os.path.abspath(directory)
+        with closing(self.connect()) as connection:
+            rows = connection.execute(
+                '''SELECT path, size, mtime_ns, inode, sample, read, min_num_lines, valid
+                FROM files WHERE directory = ? AND scheme = ?''',
+                (directory, scheme)
+            ).fetchall()
+        return {row[0]: CacheRecord(*row) for row in rows}
+
+    def update(self, directory, scheme, records, stale_paths=()):
+        '''
+        Store (or replace) the given records and remove the records of files
+        that do not exist anymore in the directory
+        '''
+        directory = os.path.abspath(directory)
+        with closing(self.connect()) as connection, connection:
+            connection.executemany(
+                'DELETE FROM files WHERE scheme = ? AND path = ?',
+                [(scheme, path) for path in stale_paths]
+            )
+            connection.executemany(
+                '''INSERT OR REPLACE INTO files
+                (directory, scheme, path, size, mtime_ns, inode, sample, read, min_num_lines, valid)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+                [(directory, scheme) + tuple(record) for record in records]
+            )
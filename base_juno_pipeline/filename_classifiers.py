@@ -0,0 +1,179 @@
+'''
+Classification of the input files of a Juno pipeline by their name. A
+classifier receives a file name and returns a (sample, read) tuple, e.g.
+('sample1', 'R1') or ('sample1', 'assembly'), or None if the file does not
+belong to any sample. The names are first filtered by their extension (so
+files of other types never reach a regular expression), Illumina names are
+parsed without regular expressions and other names with a regular
+expression. Other naming schemes can be used by passing a FilenameClassifier
+(or the name of a classifier in NAMING_SCHEMES) to PipelineStartup.
+'''
+
+import re
+
+
+class FilenameClassifier:
+    '''
+    Base class for the naming schemes. Subclasses need a name, the
+    extensions of the files they accept and a parse function for the names
+    with one of these extensions. The version is part of the key under which
+    the results are cached (see DiscoveryCache) and should be increased when
+    the parsing changes
+    '''
+
+    name = None
+    version = 1
+    extensions = ()
+
+    def classify(self, file_name):
+        '''Get the (sample, read) of a file name or None'''
+        if not file_name.endswith(self.extensions):
+            return None
+        return self.parse(file_name)
+
+    def __call__(self, file_name):
+        return self.classify(file_name)
+
+    def parse(self, file_name):
+        raise NotImplementedError
+
+    @property
+    def cache_scheme(self):
+        return f'{self.name}:v{self.version}'
+
+
+class RegexClassifier(FilenameClassifier):
+    '''
+    Naming scheme given by a regular expression that has to match the whole
+    file name and has the named groups 'sample' and (optionally) 'read'.
+    The read_names translate the read group (e.g. {'1': 'R1'}) and the
+    default_read is used if the pattern has no read group
+    '''
+
+    def __init__(self, name, pattern, extensions, read_names=None, default_read=None, version=1):
+        '''Constructor'''
+        self.name = name
+        self.pattern = re.compile(pattern)
+        self.extensions = tuple(extensions)
+        self.read_names = read_names if read_names is not None else {}
+        self.default_read = default_read
+        self.version = version
+        assert 'sample' in self.pattern.groupindex, \
+            f'The pattern of the {name} naming scheme does not have a group called sample.'
+
+    def parse(self, file_name):
+        match = self.pattern.fullmatch(file_name)
+        if match is None:
+            return None
+        read = match.groupdict().get('read') or self.default_read
+        return match.group('sample'), self.read_names.get(read, read)
+
+
+class FastqClassifier(RegexClassifier):
+    '''
+    Paired fastq files. Illumina names
+    (<sample>_S<number>[_L<lane>]_R<1|2>_001.fastq.gz) are parsed with a
+    pattern that only fits this naming (so the read and sample name cannot 
+    be confused), other names need to match the general regular expression.
+    The sample names are the same as the ones of the general regular 
+    expression: <sample>_S<number>_L<lane> for names with a lane (so the 
+    files of different lanes are not taken for the same sample) and <sample>
+    for names without lane or with lane L555 (used for files with the lanes
+    already merged). Only names that the general regular expression parsed
+    wrongly (e.g. the read of <sample>_S182_L001_R1_001.fastq.gz was taken
+    from the sample number) are classified differently.
+    The general regular expression does NOT accept sample names that 
+    contain _1 or _2 in the name because they get confused with the 
+    identifiers of forward and reverse reads
+    '''
+
+    PATTERN = r'(?P<sample>.*?)(?:_S\d+_|_S\d+.|_|\.)(?:_L555_)?(?:p)?R?(?P<read>1|2)(?:_.*\.|\..*\.|\.)f(ast)?q(\.gz)?'
+    ILLUMINA_PATTERN = re.compile(
+        r'(?P<sample>.+)_S(?P<number>\d+)(?:_(?P<lane>L\d{3}))?_(?P<read>R[12])_001\.f(?:ast)?q(?:\.gz)?'
+    )
+    EXTENSIONS = ('.fastq', '.fastq.gz', '.fq', '.fq.gz')
+
+    def __init__(self):
+        '''Constructor'''
+        # Version 2: Illumina names are parsed with their own pattern
+        # Version 3: the lane is kept in the sample name
+        # Version 4: same sample names as the general regular expression
+        super().__init__('fastq', self.PATTERN, self.EXTENSIONS,
+                        read_names={'1': 'R1', '2': 'R2'}, version=4)
+
+    def classify(self, file_name):
+        # Called for every file in the input directory, so everything is done
+        # here instead of in separate functions
+        if not file_name.endswith(self.extensions):
+            return None
+        if '_001.' in file_name:
+            match = self.ILLUMINA_PATTERN.fullmatch(file_name)
+            if match is not None:
+                sample, number, lane, read = match.group('sample', 'number', 'lane', 'read')
+                # The general regular expression only leaves L555 out of the
+                # sample name if the sample number has more than one digit
+                if lane is not None and (lane != 'L555' or len(number) == 1):
+                    sample = f'{sample}_S{number}_{lane}'
+                return sample, read
+        return self.parse(file_name)
+
+
+class FastaClassifier(FilenameClassifier):
+    '''Assemblies (<sample>.fasta)'''
+
+    name = 'fasta'
+    # Version 2: only names ending with .fasta (not e.g. samplefasta)
+    version = 2
+    extensions = ('.fasta',)
+
+    def parse(self, file_name):
+        sample = file_name[:-len('.fasta')]
+        if not sample:
+            return None
+        return sample, 'assembly'
+
+
+class CombinedClassifier(FilenameClassifier):
+    '''
+    Classifier for directories with files of several naming schemes (e.g.
+    fastq and fasta files in the same directory). The classifiers are tried
+    in order and the first classification is used
+    '''
+
+    def __init__(self, classifiers):
+        '''Constructor'''
+        self.classifiers = list(classifiers)
+        self.name = '+'.join(classifier.name for classifier in self.classifiers)
+        self.extensions = tuple(extension for classifier in self.classifiers
+                                for extension in classifier.extensions)
+        self.__classify_functions = [classifier.classify for classifier in self.classifiers]
+
+    def classify(self, file_name):
+        if not file_name.endswith(self.extensions):
+            return None
+        for classify in self.__classify_functions:
+            classification = classify(file_name)
+            if classification is not None:
+                return classification
+        return None
+
+    @property
+    def cache_scheme(self):
+        return '+'.join(classifier.cache_scheme for classifier in self.classifiers)
+
+
+# Classifiers that can be chosen by name. Pipelines can add their own
+NAMING_SCHEMES = {'fastq': FastqClassifier,
+                'fasta': FastaClassifier}
+
+
+def get_classifier(naming_scheme):
+    '''
+    Get a classifier by the name of its naming scheme. If a
+    FilenameClassifier is given, it is returned as it is
+    '''
+    if isinstance(naming_scheme, FilenameClassifier):
+        return naming_scheme
+    assert naming_scheme in NAMING_SCHEMES, \
+        f'Unknown naming scheme {naming_scheme}. Choose one of: {", ".join(NAMING_SCHEMES)}.'
+    return NAMING_SCHEMES[naming_scheme]()
@@ -1,6 +1,22 @@
 import argparse
+import configparser
+from contextlib import closing
+import csv
+import errno
+import fcntl
+import gzip
+import hashlib
+import json
+import os
 import subprocess
 import pathlib
+import re
+import shutil
+import sqlite3
+import stat
+import sys
+from types import MappingProxyType
+import zlib
 
 
 class TextHelpers:
@@ -26,6 +42,78 @@ class TextHelpers:
 class FileHelpers:
     '''Class with helper functions for file/dir validation and manipulation'''
 
+    # ioctl to make a reflink (copy-on-write clone) of a file in Linux 
+    # (supported by Btrfs, XFS, ...)
+    FICLONE = 0x40049409
+
+    @staticmethod
+    def get_cache_dir():
+        '''
+        Directory where the Juno pipelines can cache information between runs:
+        $XDG_CACHE_HOME/base_juno (or ~/.cache/base_juno)
+        '''
+        cache_home = os.environ.get('XDG_CACHE_HOME',
+                                    pathlib.Path.home().joinpath('.cache'))
+        return pathlib.Path(cache_home).joinpath('base_juno')
+
+    def stage_file(self, source, destination):
+        '''
+        Copy a file in-process without reading it when the file system allows
+        it. First a reflink (copy-on-write clone, so the copy is independent 
+        of the source) is tried, then a hard link (only if the source is 
+        read-only, because otherwise changing the source would also change the
+        copy) and finally a normal (buffered) copy. The destination is 
+        replaced atomically and gets the permissions of the source. Returns 
+        the method that was used: 'reflink', 'hardlink' or 'copy'
+        '''
+        source = pathlib.Path(source)
+        destination = pathlib.Path(destination)
+        if destination.is_dir():
+            destination = destination.joinpath(source.name)
+        tmp_destination = destination.with_name(f'.{destination.name}.{os.getpid()}.tmp')
+        try:
+            if self.__reflink(source, tmp_destination):
+                method = 'reflink'
+            elif self.__hardlink_if_read_only(source, tmp_destination):
+                method = 'hardlink'
+            else:
+                shutil.copyfile(source, tmp_destination)
+                method = 'copy'
+            if method != 'hardlink':
+                shutil.copymode(source, tmp_destination)
+            os.replace(tmp_destination, destination)
+        except BaseException:
+            if tmp_destination.exists():
+                tmp_destination.unlink()
+            raise
+        return method
+
+    def __reflink(self, source, destination):
+        if not sys.platform.startswith('linux'):
+            return False
+        with open(source, 'rb') as source_file, open(destination, 'wb') as destination_file:
+            try:
+                fcntl.ioctl(destination_file.fileno(), self.FICLONE, source_file.fileno())
+                return True
+            except OSError as err:
+                # Not supported by the file system or different file systems
+                if err.errno in (errno.EOPNOTSUPP, errno.ENOTTY, errno.EXDEV, 
+                                errno.EINVAL, errno.ENOSYS, errno.EPERM):
+                    return False
+                raise
+        
+    def __hardlink_if_read_only(self, source, destination):
+        if source.stat().st_mode & (stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH):
+            return False
+        if destination.exists():
+            destination.unlink()
+        try:
+            os.link(source, destination)
+            return True
+        except OSError:
+            # e.g. different file systems or links not supported
+            return False
+
     def validate_is_nonempty_file(self, file_path, min_file_size=0):
         file_path = pathlib.Path(file_path)
         nonempty_file = (file_path.is_file() 
@@ -39,23 +127,221 @@ class FileHelpers:
         with open(filepath, 'rb') as file_:
             return file_.read(2) == b'\x1f\x8b'
         
-    def validate_file_has_min_lines(self, file_path, min_num_lines=-1):
+    def count_lines(self, file_path, max_num_lines=None, block_size=1024*1024, gzipped=None):
+        '''
+        Count the number of lines in a (gzipped) file. Newlines are counted in
+        blocks of block_size bytes (no object is made per line) and a last 
+        line without newline also counts. If max_num_lines is given, the 
+        counting stops as soon as that number of lines is reached
+        '''
+        if gzipped is None:
+            gzipped = self.is_gz_file(file_path)
+        opener = gzip.open if gzipped else open
+        buffer = bytearray(block_size)
+        num_lines = 0
+        last_byte = b'\n'
+        with opener(file_path, 'rb') as file_:
+            while True:
+                num_bytes = file_.readinto(buffer)
+                if not num_bytes:
+                    break
+                num_lines += buffer.count(b'\n', 0, num_bytes)
+                last_byte = buffer[num_bytes-1:num_bytes]
+                if max_num_lines is not None and num_lines >= max_num_lines:
+                    return num_lines
+        if last_byte != b'\n':
+            num_lines += 1
+        return num_lines
+
+    def get_file_digest(self, file_path, algorithm='sha256', block_size=8*1024*1024):
+        '''
+        Compute the checksum of a file (as it is on disk, so gzipped files 
+        are not decompressed). The file is read in big blocks into a single
+        buffer. The hashing releases the GIL, so several files can be 
+        checksummed in parallel with threads
+        '''
+        digest = hashlib.new(algorithm)
+        buffer = bytearray(block_size)
+        view = memoryview(buffer)
+        with open(file_path, 'rb', buffering=0) as file_:
+            while True:
+                num_bytes = file_.readinto(buffer)
+                if not num_bytes:
+                    break
+                digest.update(view[:num_bytes])
+        return digest.hexdigest()
+
+    # Margins for the size of a gzipped file expected from the compression
+    # ratio of its first block: files that could be 4 GiB or bigger with a 
+    # ratio gz_ratio_margin times higher and files with an ISIZE more than
+    # gz_size_tolerance times smaller than expected are counted instead
+    gz_ratio_margin = 2
+    gz_size_tolerance = 1.25
+
+    def estimate_gz_num_lines(self, file_path, sample_size=1024*1024, chunk_size=16*1024):
+        '''
+        Estimate the number of lines of a gzipped file without decompressing
+        it completely. The uncompressed size is read from the ISIZE field of 
+        the gzip trailer (last 4 bytes) and the mean line length is taken from
+        the first sample_size bytes. Returns None if the file cannot be 
+        estimated this way: multi-member files (the trailer only has the 
+        size of the last member), recognized by the BGZF extra field, by a 
+        member ending within the sample or by an ISIZE that is too small 
+        for the compression ratio of the sample, and files that could be 
+        4 GiB or bigger uncompressed (ISIZE is stored modulo 2**32)
+        '''
+        decompressor = zlib.decompressobj(wbits=zlib.MAX_WBITS | 16)
+        sample = b''
+        compressed_sample_size = 0
+        with open(file_path, 'rb') as file_:
+            if file_.read(4)[3:4] == b'\x04':
+                # Only FEXTRA set: BGZF (blocks of 64 KiB in separate members)
+                return None
+            file_.seek(0)
+            while len(sample) < sample_size and not decompressor.eof:
+                chunk = decompressor.unconsumed_tail
+                if not chunk:
+                    chunk = file_.read(chunk_size)
+                    if not chunk:
+                        raise EOFError(f'{file_path} ended before the end of the gzip stream')
+                    compressed_sample_size += len(chunk)
+                sample += decompressor.decompress(chunk, sample_size - len(sample))
+            compressed_sample_size -= len(decompressor.unconsumed_tail)
+            if decompressor.eof:
+                if decompressor.unused_data or file_.read(1):
+                    # More than one member
+                    return None
+                # The whole file fitted in the sample so it can be counted
+                return sample.count(b'\n') + (not sample.endswith(b'\n') and len(sample) > 0)
+            file_.seek(-4, 2)
+            uncompressed_size = int.from_bytes(file_.read(4), 'little')
+            compressed_size = file_.tell()
+        expected_size = compressed_size * len(sample) / max(compressed_sample_size, 1)
+        if expected_size * self.gz_ratio_margin >= 2**32:
+            return None
+        if uncompressed_size * self.gz_size_tolerance < expected_size:
+            # Most likely the size of only the last member
+            return None
+        lines_in_sample = max(sample.count(b'\n'), 1)
+        return round(uncompressed_size * lines_in_sample / len(sample))
+
+    def validate_file_has_min_lines(self, file_path, min_num_lines=-1, approximate=False):
         '''
-        Test if gzip file contains more than the desired number of lines. 
-        Returns True/False
+        Test if a (gzipped) file contains more than the desired number of 
+        lines. Gzipped files are decompressed while reading them. If 
+        approximate is True, the number of lines of gzipped files is estimated
+        (see estimate_gz_num_lines) instead of counted. Truncated or corrupt
+        gzipped files are not valid. Returns True/False
         '''
         if not self.validate_is_nonempty_file(file_path, min_file_size=1):
             return False
-        else:
-            with open(file_path, 'rb') as f:
-                line=0
-                file_right_num_lines = False
-                for lines in f:
-                    line=line+1
-                    if line >= min_num_lines:
-                        file_right_num_lines = True
-                        break
-            return file_right_num_lines
+        if min_num_lines <= 0:
+            return True
+        gzipped = self.is_gz_file(file_path)
+        if not gzipped and min_num_lines == 1:
+            return True
+        try:
+            if gzipped and approximate:
+                estimated_num_lines = self.estimate_gz_num_lines(file_path)
+                if estimated_num_lines is not None:
+                    return estimated_num_lines >= min_num_lines
+            num_lines = self.count_lines(file_path, max_num_lines=min_num_lines, gzipped=gzipped)
+        except (EOFError, OSError, zlib.error):
+            # gzip.BadGzipFile is an OSError
+            return False
+        return num_lines >= min_num_lines
+
+
+    # Values that are read as missing (NaN) from a csv file. Same as the 
+    # default of pandas.read_csv
+    csv_na_values = frozenset(['', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', 
+                                '-NaN', '-nan', '1.#IND', '1.#QNAN', '<NA>', 'N/A', 
+                                'NA', 'NULL', 'NaN', 'None', 'n/a', 'nan', 'null'])
+
+    def read_csv_columns(self, file_path):
+        '''Function to get the column names (header) of a csv file'''
+        with open(file_path, newline='', encoding='utf-8-sig') as file_:
+            return next(csv.reader(file_), [])
+
+    def __convert_csv_column(self, values):
+        '''
+        Convert the values (strings) of a csv column to int, float, bool or 
+        str in the same way as pandas.read_csv would infer the type of the 
+        column. Missing values become NaN
+        '''
+        nan = float('nan')
+        present_values = [value for value in values if value not in self.csv_na_values]
+        if not present_values:
+            return [nan] * len(values)
+        if all(re.fullmatch('[+-]?[0-9]+', value) for value in present_values):
+            if len(present_values) == len(values):
+                return [int(value) for value in values]
+            return [nan if value in self.csv_na_values else float(value) for value in values]
+        try:
+            if not any('_' in value for value in present_values):
+                return [nan if value in self.csv_na_values else float(value) for value in values]
+        except ValueError:
+            pass
+        booleans = {'True': True, 'TRUE': True, 'true': True,
+                    'False': False, 'FALSE': False, 'false': False}
+        if all(value in booleans for value in present_values):
+            return [nan if value in self.csv_na_values else booleans[value] for value in values]
+        return [nan if value in self.csv_na_values else value for value in values]
+
+    def read_csv_as_dict(self, file_path, index_col='sample', usecols=None, read_only=False):
+        '''
+        Function to read a csv file into a dictionary with the values of the
+        index_col as keys and a dictionary {column: value} per row as values.
+        It gives the same result as pandas.read_csv(file_path, dtype={index_col: 
+        str}).set_index(index_col).to_dict(orient='index') but the file is 
+        streamed with the csv module and only the columns in usecols (default:
+        all columns) are kept. If read_only is True, read-only mappings are 
+        returned instead of dictionaries
+        '''
+        with open(file_path, newline='', encoding='utf-8-sig') as file_:
+            reader = csv.reader(file_)
+            header = next(reader, [])
+            # Duplicated column names get a suffix (.1, .2, ...) like in pandas
+            columns = []
+            for column in header:
+                name, suffix = column, 1
+                while name in columns:
+                    name, suffix = f'{column}.{suffix}', suffix + 1
+                columns.append(name)
+            if index_col not in columns:
+                raise KeyError(self.error_formatter(
+                    f'The csv file {str(file_path)} does not have a column called {index_col}.'
+                    ))
+            kept_columns = [column for column in columns 
+                            if column != index_col and (usecols is None or column in usecols)]
+            kept_positions = [columns.index(column) for column in kept_columns]
+            index_position = columns.index(index_col)
+            num_columns = len(columns)
+            index_values = []
+            column_values = [[] for _ in kept_columns]
+            for row in reader:
+                if not row:
+                    continue
+                if len(row) > num_columns:
+                    raise ValueError(self.error_formatter(
+                        f'Line {reader.line_num} of {str(file_path)} has {len(row)} fields instead of {num_columns}.'
+                        ))
+                row += [''] * (num_columns - len(row))
+                index_values.append(row[index_position])
+                for values, position in zip(column_values, kept_positions):
+                    values.append(row[position])
+        nan = float('nan')
+        index_values = [nan if value in self.csv_na_values else value for value in index_values]
+        if len(set(index_values)) < len(index_values):
+            raise ValueError(self.error_formatter(
+                f'The values of the column {index_col} in {str(file_path)} are not unique.'
+                ))
+        column_values = [self.__convert_csv_column(values) for values in column_values]
+        rows = zip(*column_values) if column_values else ([] for _ in index_values)
+        table = {index: dict(zip(kept_columns, row)) for index, row in zip(index_values, rows)}
+        if read_only:
+            return MappingProxyType({index: MappingProxyType(row) for index, row in table.items()})
+        return table
 
 
 class GitHelpers:
@@ -87,42 +373,282 @@ class GitHelpers:
             downloading.kill()
             raise
             
-    def get_repo_url(self, gitrepo_dir):
+    git_not_available = "Not available. This might be because this folder is not a repository or it was downloaded manually instead of through the command line."
+
+    def find_git_dir(self, gitrepo_dir, search_parents=True):
+        '''
+        Function to find the git directory of a repository (normally 
+        <gitrepo_dir>/.git). Like git, the parent directories are also 
+        searched if search_parents is True. A .git file (used by worktrees and
+        submodules) is followed to the actual git directory. Returns None if 
+        no git directory is found
+        '''
+        directory = pathlib.Path(gitrepo_dir).absolute()
+        candidates = [directory] + list(directory.parents) if search_parents else [directory]
+        for candidate in candidates:
+            dot_git = candidate.joinpath('.git')
+            if dot_git.is_dir():
+                return dot_git
+            if dot_git.is_file():
+                with open(dot_git) as file_:
+                    content = file_.read().strip()
+                if content.startswith('gitdir:'):
+                    return candidate.joinpath(content[len('gitdir:'):].strip())
+        return None
+
+    def read_git_remote_url(self, git_dir, remote='origin'):
+        '''
+        Function to read the URL of a remote from the config file of a git
+        directory. Returns None if it is not found there
+        '''
+        config = configparser.ConfigParser(strict=False, interpolation=None)
+        try:
+            config.read(pathlib.Path(git_dir).joinpath('config'))
+            return config.get(f'remote "{remote}"', 'url')
+        except configparser.Error:
+            return None
+
+    def read_git_head_commit(self, git_dir):
+        '''
+        Function to get the commit that HEAD points to by reading the HEAD 
+        file, the loose refs and the packed-refs of a git directory. Returns 
+        None if the commit cannot be found this way
+        '''
+        git_dir = pathlib.Path(git_dir)
+        # Worktrees share the refs of the main git directory
+        common_dir = git_dir
+        if git_dir.joinpath('commondir').is_file():
+            with open(git_dir.joinpath('commondir')) as file_:
+                common_dir = git_dir.joinpath(file_.read().strip())
+        try:
+            with open(git_dir.joinpath('HEAD')) as file_:
+                head = file_.read().strip()
+        except OSError:
+            return None
+        # Symbolic refs are followed for a limited number of steps
+        for _ in range(5):
+            if not head.startswith('ref:'):
+                return head if re.fullmatch('[0-9a-f]{40}|[0-9a-f]{64}', head) else None
+            ref = head[len('ref:'):].strip()
+            head = None
+            for refs_dir in [git_dir, common_dir]:
+                try:
+                    with open(refs_dir.joinpath(ref)) as file_:
+                        head = file_.read().strip()
+                    break
+                except OSError:
+                    continue
+            if head is None:
+                return self.__read_packed_ref(common_dir, ref)
+        return None
+
+    def __read_packed_ref(self, git_dir, ref):
+        try:
+            with open(pathlib.Path(git_dir).joinpath('packed-refs')) as file_:
+                for line in file_:
+                    if line.startswith(('#', '^')):
+                        continue
+                    pieces = line.split()
+                    if len(pieces) == 2 and pieces[1] == ref:
+                        return pieces[0]
+        except OSError:
+            pass
+        return None
+
+    def get_repo_url(self, gitrepo_dir, timeout=30):
         '''
         Function to get the URL of a directory. It first checks wheter it is
         actually a repo (sometimes the code is just downloaded as zip and it
         does not have the .git sub directory with the information that identifies
-        it as a git repo
+        it as a git repo. The URL is read from the git config and git itself
+        is only called if it cannot be found there (and killed after timeout
+        seconds)
         '''
+        git_dir = self.find_git_dir(gitrepo_dir)
+        if git_dir is None:
+            return self.git_not_available
+        url = self.read_git_remote_url(git_dir)
+        if url is not None:
+            return url
         try:
             url = subprocess.check_output(["git","config", "--get", "remote.origin.url"],
-                                            cwd = f'{str(gitrepo_dir)}').strip()
+                                            cwd = f'{str(gitrepo_dir)}',
+                                            timeout = timeout).strip()
             url = url.decode()
         except:
-            url = "Not available. This might be because this folder is not a repository or it was downloaded manually instead of through the command line."
+            url = self.git_not_available
         return url
 
-    def get_commit_git(self, gitrepo_dir):
+    def get_commit_git(self, gitrepo_dir, timeout=30):
         '''
-        Function to get the commit number from a folder (must be a git repo)
+        Function to get the commit number from a folder (must be a git repo).
+        The commit is read from the git directory and git itself is only 
+        called if it cannot be found there (and killed after timeout 
+        seconds). The format is the same as the output of 
+        git log --pretty=format:"%H"
         '''
+        git_dir = pathlib.Path(gitrepo_dir).joinpath('.git')
+        if not git_dir.exists():
+            return self.git_not_available
+        if git_dir.is_file():
+            git_dir = self.find_git_dir(gitrepo_dir, search_parents=False)
+            if git_dir is None:
+                # A .git file without a gitdir: line
+                return self.git_not_available
+        commit = self.read_git_head_commit(git_dir)
+        if commit is not None:
+            return f'"{commit}"'
         try:
             commit = subprocess.check_output(['git', 
                                             '--git-dir', 
                                             f'{str(gitrepo_dir)}/.git', 
                                             'log', '-n', '1', '--pretty=format:"%H"'],
-                                            timeout = 30)
+                                            timeout = timeout)
             commit = commit.decode()
         except (subprocess.CalledProcessError, subprocess.TimeoutExpired):
-            commit = "Not available. This might be because this folder is not a repository or it was downloaded manually instead of through the command line."                
+            commit = self.git_not_available
         return commit
 
 
-class JunoHelpers(TextHelpers, FileHelpers, GitHelpers):
+class CondaHelpers:
+    '''Class with helper functions to get information about conda environments'''
+
+    def get_conda_prefix(self):
+        '''
+        Function to get the prefix of the active conda environment (or None 
+        if the code is not running in a conda environment)
+        '''
+        for prefix in [os.environ.get('CONDA_PREFIX'), sys.prefix]:
+            if prefix and pathlib.Path(prefix).joinpath('conda-meta').is_dir():
+                return pathlib.Path(prefix)
+        return None
+
+    def read_conda_meta(self, conda_prefix):
+        '''
+        Function to get the packages installed in a conda environment by 
+        reading the records in <conda_prefix>/conda-meta. Returns a list of 
+        dictionaries with the name, version, build and channel of every package
+        '''
+        packages = []
+        for record_file in sorted(pathlib.Path(conda_prefix).joinpath('conda-meta').glob('*.json')):
+            with open(record_file) as file_:
+                record = json.load(file_)
+            channel = record.get('channel', '')
+            subdir = record.get('subdir', '')
+            if subdir and channel.endswith(f'/{subdir}'):
+                channel = channel[:-len(subdir)-1]
+            channel = re.sub('^https?://(conda.anaconda.org|repo.anaconda.com)/', '', channel)
+            packages.append({'name': record.get('name', record_file.stem),
+                            'version': record.get('version', ''),
+                            'build': record.get('build', ''),
+                            'channel': channel})
+        return sorted(packages, key=lambda package: package['name'])
+
+    def get_conda_packages(self, conda_prefix, cache_dir=None):
+        '''
+        Same as read_conda_meta but the result is cached in cache_dir (if 
+        given). The cache is only used if the modification time and the list
+        of files of the conda-meta directory did not change
+        '''
+        conda_meta = pathlib.Path(conda_prefix).joinpath('conda-meta')
+        if cache_dir is None:
+            return self.read_conda_meta(conda_prefix)
+        meta_state = hashlib.sha1()
+        meta_state.update(str(conda_meta.stat().st_mtime_ns).encode())
+        for record_file in sorted(os.listdir(conda_meta)):
+            meta_state.update(record_file.encode())
+        meta_state = meta_state.hexdigest()
+        prefix_hash = hashlib.sha1(str(conda_meta.resolve()).encode()).hexdigest()
+        cache_file = pathlib.Path(cache_dir).joinpath(f'conda_audit_{prefix_hash}.json')
+        try:
+            with open(cache_file) as file_:
+                cached_audit = json.load(file_)
+            if cached_audit['conda_meta_state'] == meta_state:
+                return cached_audit['packages']
+        except (OSError, ValueError, KeyError):
+            pass
+        packages = self.read_conda_meta(conda_prefix)
+        try:
+            cache_file.parent.mkdir(parents=True, exist_ok=True)
+            tmp_cache_file = cache_file.with_name(f'{cache_file.name}.{os.getpid()}.tmp')
+            with open(tmp_cache_file, 'w') as file_:
+                json.dump({'conda_meta_state': meta_state, 'packages': packages}, file_)
+            os.replace(tmp_cache_file, cache_file)
+        except OSError:
+            # Not being able to cache the audit should not stop the pipeline
+            pass
+        return packages
+
+    def format_conda_packages(self, conda_prefix, packages):
+        '''
+        Function to format a list of packages (see read_conda_meta) as a 
+        table similar to the output of 'conda list'
+        '''
+        lines = [f'# packages in environment at {str(conda_prefix)}:',
+                '#',
+                f'# {"Name":<30} {"Version":<20} {"Build":<25} Channel']
+        for package in packages:
+            lines.append(f'{package["name"]:<32} {package["version"]:<20} {package["build"]:<25} {package["channel"]}')
+        return '\n'.join(lines)
+
+
+class SQLiteCache:
+    '''
+    Base class for the SQLite files that the Juno pipelines keep between
+    runs (e.g. DiscoveryCache, ChecksumCache and RunHistory). If no 
+    cache_file is given, the file default_name in the cache directory (see
+    FileHelpers.get_cache_dir) is used. Subclasses make their tables in 
+    create_tables
+    '''
+
+    default_name = None
+
+    def __init__(self, cache_file=None):
+        '''Constructor'''
+        if cache_file is None:
+            cache_file = self.default_cache_file()
+        self.cache_file = pathlib.Path(cache_file)
+        self.cache_file.parent.mkdir(parents=True, exist_ok=True)
+        with closing(self.connect()) as connection, connection:
+            self.create_tables(connection)
+
+    @classmethod
+    def default_cache_file(cls):
+        '''
+        Default location of the file (inside the cache directory of the Juno
+        pipelines)
+        '''
+        return FileHelpers.get_cache_dir().joinpath(cls.default_name)
+
+    def connect(self):
+        '''
+        Open a connection to the file. Other pipelines can be using the same
+        file, so it waits up to 30 seconds for them
+        '''
+        return sqlite3.connect(str(self.cache_file), timeout=30)
+
+    def create_tables(self, connection):
+        '''Make the tables (and indexes) if they do not exist yet'''
+        raise NotImplementedError
+
+
+class JunoHelpers(TextHelpers, FileHelpers, GitHelpers, CondaHelpers):
     '''
     This Class just puts together all the other helpers in one class.
     '''
-    pass
+
+    def open_cache(self, cache_class, cache_file, description, consequence):
+        '''
+        Function to open a SQLiteCache. If it cannot be used (e.g. the file 
+        is not writable or is corrupt), the pipeline continues without it: 
+        a message with the description of the cache and the consequence is
+        printed and None is returned
+        '''
+        try:
+            return cache_class(cache_file)
+        except (OSError, sqlite3.Error) as err:
+            print(self.message_formatter(f"The {description} could not be used ({err}). {consequence}"))
+            return None
 
 
 class SnakemakeKwargsAction(argparse.Action,
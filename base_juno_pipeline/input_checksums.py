@@ -0,0 +1,143 @@
+'''
+Checksums of the input files of a pipeline run for the audit trail. The
+files are hashed in parallel (in a bounded thread pool) and the digests are
+stored in a persistent cache keyed on the path, size and modification time of
+the file, so unchanged input files are never hashed again in later runs.
+'''
+
+from base_juno_pipeline import helper_functions
+from collections.abc import Mapping
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+import os
+import pathlib
+
+
+class ChecksumCache(helper_functions.SQLiteCache):
+    '''
+    SQLite cache with the digests of the files that were checksummed before.
+    A digest is only used if the size and modification time of the file did
+    not change
+    '''
+
+    default_name = 'checksum_cache.sqlite'
+
+    def create_tables(self, connection):
+        connection.execute(
+            '''CREATE TABLE IF NOT EXISTS digests (
+                path TEXT NOT NULL,
+                algorithm TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                digest TEXT NOT NULL,
+                PRIMARY KEY (path, algorithm))'''
+        )
+
+    def lookup(self, file_stats, algorithm):
+        '''
+        Get the cached digests of the files whose size and modification time
+        did not change. file_stats is a dictionary with the (absolute) path
+        as key and a (size, mtime_ns) tuple as value. Returns a dictionary
+        with the path as key and the digest as value
+        '''
+        digests = {}
+        with closing(self.connect()) as connection:
+            for path, (size, mtime_ns) in file_stats.items():
+                row = connection.execute(
+                    '''SELECT digest FROM digests
+                    WHERE path = ? AND algorithm = ? AND size = ? AND mtime_ns = ?''',
+                    (path, algorithm, size, mtime_ns)
+                ).fetchone()
+                if row is not None:
+                    digests[path] = row[0]
+        return digests
+
+    def update(self, file_stats, algorithm, digests):
+        '''Store (or replace) the digests of the given files'''
+        with closing(self.connect()) as connection, connection:
+            connection.executemany(
+                '''INSERT OR REPLACE INTO digests (path, algorithm, size, mtime_ns, digest)
+                VALUES (?, ?, ?, ?, ?)''',
+                [(path, algorithm) + tuple(file_stats[path]) + (digest,)
+                    for path, digest in digests.items()]
+            )
+
+
+class InputChecksums(helper_functions.JunoHelpers):
+    '''
+    Class to compute the checksums of the input files of the samples of a
+    pipeline run
+    '''
+
+    def __init__(self,
+                algorithm='sha256',
+                max_workers=None,
+                cache=None):
+        '''Constructor'''
+        self.algorithm = algorithm
+        self.max_workers = max_workers
+        self.cache = cache
+
+    @staticmethod
+    def get_file_stats(file_paths):
+        '''
+        Function to get the (size, mtime_ns) of every file. Returns a
+        dictionary with the (absolute) path as key
+        '''
+        file_stats = {}
+        for file_path in file_paths:
+            file_stat = os.stat(file_path)
+            file_stats[os.path.abspath(file_path)] = (file_stat.st_size, file_stat.st_mtime_ns)
+        return file_stats
+
+    def checksum_files(self, file_paths):
+        '''
+        Function to get the digest of every file. The cached digests are used
+        for unchanged files and the rest of the files are hashed in parallel.
+        Returns a dictionary with the (absolute) path as key
+        '''
+        return self.__checksum_file_stats(self.get_file_stats(file_paths))
+
+    def __checksum_file_stats(self, file_stats):
+        digests = {} if self.cache is None else self.cache.lookup(file_stats, self.algorithm)
+        files_to_hash = [path for path in file_stats if path not in digests]
+        if self.max_workers == 1 or len(files_to_hash) < 2:
+            new_digests = [self.get_file_digest(path, self.algorithm) for path in files_to_hash]
+        else:
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                new_digests = list(executor.map(
+                    lambda path: self.get_file_digest(path, self.algorithm), files_to_hash
+                ))
+        new_digests = dict(zip(files_to_hash, new_digests))
+        if self.cache is not None and new_digests:
+            self.cache.update(file_stats, self.algorithm, new_digests)
+        digests.update(new_digests)
+        return digests
+
+    def checksum_sample_dict(self, sample_dict):
+        '''
+        Function to get the checksums of the input files of every sample in
+        a sample_dict ({sample: {R1: file, R2: file...}}). Returns a
+        dictionary with the form:
+        {sample: {R1: {file: fastq_file1, size: 123, sha256: digest}, ...}}
+        Values of the sample_dict that are not existing files are ignored
+        '''
+        sample_files = {}
+        for sample, files in sample_dict.items():
+            if not isinstance(files, Mapping):
+                continue
+            sample_files[sample] = {key: str(file_path) for key, file_path in files.items()
+                                    if isinstance(file_path, (str, pathlib.Path))
+                                    and os.path.isfile(file_path)}
+        file_stats = self.get_file_stats([file_path for files in sample_files.values()
+                                            for file_path in files.values()])
+        digests = self.__checksum_file_stats(file_stats)
+        checksums = {}
+        for sample, files in sample_files.items():
+            checksums[sample] = {}
+            for key, file_path in files.items():
+                abs_path = os.path.abspath(file_path)
+                checksums[sample][key] = {'file': file_path,
+                                        'size': file_stats[abs_path][0],
+                                        self.algorithm: digests[abs_path]}
+        return checksums
@@ -0,0 +1,82 @@
+'''
+Lightweight instrumentation to find out where the time of a pipeline run
+goes. Every phase of a run (input discovery, audit trail, Snakemake, report,
+...) gets its wall time, CPU time and peak memory recorded. The same
+PhaseTimer can be shared by PipelineStartup and RunSnakemake so the timings
+of the whole run end up in the audit trail (log_timings.yaml).
+'''
+
+from contextlib import contextmanager
+from datetime import datetime
+import resource
+import sys
+import time
+import yaml
+
+
+class PhaseTimer:
+    '''
+    Class to record the wall time, CPU time and peak resident memory (RSS) of
+    the phases of a pipeline run. The CPU time includes the child processes
+    (e.g. local Snakemake jobs). The peak RSS is the maximum reached by the
+    process (and by any of its children) until the end of the phase. If a
+    hook is given, it is called with the record of every finished phase
+    '''
+
+    def __init__(self, hook=None):
+        '''Constructor'''
+        self.hook = hook
+        self.timings = []
+        self.__running_phases = {}
+
+    def __get_cpu_time(self):
+        usage_self = resource.getrusage(resource.RUSAGE_SELF)
+        usage_children = resource.getrusage(resource.RUSAGE_CHILDREN)
+        return (usage_self.ru_utime + usage_self.ru_stime
+                + usage_children.ru_utime + usage_children.ru_stime)
+
+    def __get_peak_rss_mb(self, who):
+        # ru_maxrss is given in bytes in macOS and in kilobytes in Linux
+        peak_rss = resource.getrusage(who).ru_maxrss
+        bytes_per_unit = 1 if sys.platform == 'darwin' else 1024
+        return round(peak_rss * bytes_per_unit / 1024**2, 1)
+
+    def start(self, name):
+        '''Start timing a phase'''
+        self.__running_phases[name] = (datetime.now(), time.perf_counter(), self.__get_cpu_time())
+
+    def is_running(self, name):
+        '''Whether a phase was started but not stopped yet'''
+        return name in self.__running_phases
+
+    def stop(self, name):
+        '''Stop timing a phase and return its record'''
+        start_date, start_wall_time, start_cpu_time = self.__running_phases.pop(name)
+        record = {'phase': name,
+                'start': start_date.strftime('%d-%m-%Y %H:%M:%S'),
+                'wall_time_s': round(time.perf_counter() - start_wall_time, 3),
+                'cpu_time_s': round(self.__get_cpu_time() - start_cpu_time, 3),
+                'peak_rss_mb': self.__get_peak_rss_mb(resource.RUSAGE_SELF),
+                'peak_rss_children_mb': self.__get_peak_rss_mb(resource.RUSAGE_CHILDREN)}
+        self.timings.append(record)
+        if self.hook is not None:
+            try:
+                self.hook(record)
+            except Exception as err:
+                # A failing monitoring hook should not stop the pipeline
+                print(f'The timing hook failed for the phase {name}: {err}', file=sys.stderr)
+        return record
+
+    @contextmanager
+    def phase(self, name):
+        '''Context manager to time a phase'''
+        self.start(name)
+        try:
+            yield
+        finally:
+            self.stop(name)
+
+    def write(self, timings_file):
+        '''Write the records of all finished phases to a yaml file'''
+        with open(timings_file, 'w') as file:
+            yaml.dump({'phases': self.timings}, file, default_flow_style=False, sort_keys=False)
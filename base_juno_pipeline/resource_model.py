@@ -0,0 +1,157 @@
+'''
+Model to estimate the resources (memory, threads and time limit) that a job
+needs from the size of its input. The Snakefiles give the same resources to
+every sample, which means that big samples run out of memory (or time) and
+small samples reserve more than they need and wait longer in the queue. The
+resources of the rules that have scaling factors are estimated per job when
+the job is submitted to the cluster (see cluster_executors), so the
+Snakefiles do not need to be changed.
+
+This module only uses the standard library so it can also be used by the
+submission script of cluster_executors.
+'''
+
+from collections.abc import Mapping
+import json
+import math
+import os
+import pathlib
+
+
+class ResourceModel:
+    '''
+    Class to estimate the resources of a job as:
+        base + per_gb * input_size_gb (rounded up and limited to min/max)
+    The factors are given per rule and per resource, e.g.:
+        {'assembly': {'mem_gb': {'base': 4, 'per_gb': 2, 'max': 200},
+                      'threads': {'base': 2, 'per_gb': 1, 'max': 16},
+                      'time_limit': {'base': 30, 'per_gb': 20}}}
+    The input size of a job is the size of the input files of its sample
+    (wildcard 'sample') or, if the sample is unknown, the size of the input
+    files of the job. Resources without factors keep the value estimated for
+    the rule from previous runs (rule_estimates, see RunHistory) or, if there
+    is no estimate, the value given in the Snakefile (and the default 
+    time_limit)
+    '''
+
+    RESOURCES = ('mem_gb', 'threads', 'time_limit')
+    # The jobs of a group run at the same time, so (as Snakemake does for
+    # the resources of a group) their memory and threads are summed and the 
+    # longest time limit is used
+    GROUP_AGGREGATES = {'mem_gb': sum, 'threads': sum, 'time_limit': max}
+
+    def __init__(self, rule_factors=None, sample_sizes=None, time_limit=60, rule_estimates=None):
+        '''Constructor'''
+        self.rule_factors = rule_factors if rule_factors is not None else {}
+        self.sample_sizes = sample_sizes if sample_sizes is not None else {}
+        self.time_limit = time_limit
+        self.rule_estimates = rule_estimates if rule_estimates is not None else {}
+        self.__validate_factors()
+
+    def __validate_factors(self):
+        for rule, factors in self.rule_factors.items():
+            for resource, factor in factors.items():
+                assert resource in self.RESOURCES, \
+                    f'Unknown resource {resource} for rule {rule}. The resources that can be estimated are: {", ".join(self.RESOURCES)}.'
+                unknown_keys = set(factor) - {'base', 'per_gb', 'min', 'max'}
+                assert not unknown_keys, \
+                    f'Unknown factors {", ".join(sorted(unknown_keys))} for the {resource} of rule {rule}. Use base, per_gb, min and/or max.'
+
+    @staticmethod
+    def get_sample_input_sizes(sample_dict, input_files=None):
+        '''
+        Function to get the total size (in bytes) of the input files of every
+        sample in a sample_dict ({sample: {R1: file, R2: file...}}). The
+        input_files (path: InputFile) that were already listed by the
+        PipelineStartup are used instead of asking the size of the files
+        again. Values that are not existing files are ignored
+        '''
+        input_files = input_files if input_files is not None else {}
+        sample_sizes = {}
+        for sample, sample_files in sample_dict.items():
+            if not isinstance(sample_files, Mapping):
+                continue
+            total_size = 0
+            for file_path in sample_files.values():
+                if file_path in input_files:
+                    total_size += input_files[file_path].size
+                elif isinstance(file_path, (str, pathlib.Path)) and os.path.isfile(file_path):
+                    total_size += os.path.getsize(file_path)
+            sample_sizes[str(sample)] = total_size
+        return sample_sizes
+
+    def get_input_size_gb(self, wildcards=None, input_files=()):
+        '''
+        Size of the input of a job in GB (taken from the sample if the job has
+        a sample wildcard or from the input files otherwise)
+        '''
+        sample = (wildcards or {}).get('sample')
+        if sample is not None and str(sample) in self.sample_sizes:
+            return self.sample_sizes[str(sample)] / 1024**3
+        total_size = sum(os.path.getsize(file_) for file_ in input_files or ()
+                        if os.path.isfile(file_))
+        return total_size / 1024**3
+
+    def estimate(self, rule, wildcards=None, input_files=(), resources=None, threads=1):
+        '''
+        Estimate the mem_gb, threads and time_limit of a job of a rule. The
+        estimates of previous runs or the resources and threads given by the
+        Snakefile are used for the resources that have no factors for this 
+        rule
+        '''
+        resources = resources if resources is not None else {}
+        estimates = {'mem_gb': resources.get('mem_gb'),
+                    'threads': threads,
+                    'time_limit': resources.get('time_limit', self.time_limit)}
+        estimates.update(self.__estimate_job(rule, wildcards, input_files))
+        return estimates
+
+    def estimate_group(self, jobs, resources=None, threads=1):
+        '''
+        Estimate the mem_gb, threads and time_limit of a group job (e.g. a 
+        batch of jobs, see RunSnakemake.make_job_batches) from the estimates
+        of its jobs, given as (rule, wildcards). The resources that cannot be
+        estimated for all the jobs keep the value computed by Snakemake for
+        the group (resources and threads)
+        '''
+        resources = resources if resources is not None else {}
+        estimates = {'mem_gb': resources.get('mem_gb'),
+                    'threads': threads,
+                    'time_limit': resources.get('time_limit', self.time_limit)}
+        job_estimates = [self.__estimate_job(rule, wildcards) for rule, wildcards in jobs]
+        for resource, aggregate in self.GROUP_AGGREGATES.items():
+            if job_estimates and all(resource in job_estimate for job_estimate in job_estimates):
+                estimates[resource] = aggregate(job_estimate[resource] for job_estimate in job_estimates)
+        return estimates
+
+    def __estimate_job(self, rule, wildcards=None, input_files=()):
+        '''
+        Resources of a job that can be estimated: the ones with factors for
+        its rule or with an estimate of previous runs
+        '''
+        estimates = dict(self.rule_estimates.get(rule, {}))
+        factors = self.rule_factors.get(rule, {})
+        if not factors:
+            return estimates
+        input_size_gb = self.get_input_size_gb(wildcards, input_files)
+        for resource, factor in factors.items():
+            value = factor.get('base', 0) + factor.get('per_gb', 0) * input_size_gb
+            value = max(value, factor.get('min', 1))
+            if 'max' in factor:
+                value = min(value, factor['max'])
+            estimates[resource] = int(math.ceil(value))
+        return estimates
+
+    def to_file(self, model_file):
+        '''Write the model to a json file'''
+        with open(model_file, 'w') as file_:
+            json.dump({'rule_factors': self.rule_factors,
+                        'sample_sizes': self.sample_sizes,
+                        'time_limit': self.time_limit,
+                        'rule_estimates': self.rule_estimates}, file_)
+
+    @classmethod
+    def from_file(cls, model_file):
+        '''Read a model written with to_file'''
+        with open(model_file) as file_:
+            return cls(**json.load(file_))
@@ -0,0 +1,201 @@
+'''
+History of the jobs run by the Juno pipelines. For every finished job the
+wall time, CPU time and peak memory (max RSS) are stored in a local SQLite
+database per pipeline, rule and sample, so the next runs can use them to
+request a time limit and memory that fit the rule (instead of the same flat
+values for every rule) and to start the slowest rules first.
+
+If the rule has a benchmark file, the times and memory measured by Snakemake
+are used. Otherwise the wall time is measured from the moment Snakemake
+starts (or submits) the job until it is reported as finished, so for cluster
+jobs it includes the time in the queue. Those records are marked as not
+benchmarked and are not used for the time limits (they would grow with the
+congestion of the queue).
+'''
+
+from base_juno_pipeline import helper_functions
+from collections import namedtuple
+from contextlib import closing
+import csv
+import math
+import pathlib
+import statistics
+import time
+
+
+JobRecord = namedtuple('JobRecord', ['rule', 'sample', 'wall_time_s', 'cpu_time_s', 'max_rss_mb', 'benchmarked'],
+                        defaults=(False,))
+
+
+class JobHistoryCollector:
+    '''
+    Snakemake log handler that collects the JobRecord of every job that
+    finished successfully. The benchmark files are read (relative to the
+    workdir) when the records are requested, after the jobs finished
+    '''
+
+    def __init__(self, workdir='.'):
+        '''Constructor'''
+        self.workdir = pathlib.Path(workdir)
+        self.__started_jobs = {}
+        self.__finished_jobs = []
+
+    def __call__(self, msg):
+        level = msg.get('level')
+        if level == 'job_info':
+            self.__started_jobs[msg['jobid']] = (msg.get('name'),
+                                                msg.get('wildcards') or {},
+                                                msg.get('benchmark'),
+                                                time.perf_counter())
+        elif level == 'job_finished' and msg.get('jobid') in self.__started_jobs:
+            rule, wildcards, benchmark, start_time = self.__started_jobs.pop(msg['jobid'])
+            self.__finished_jobs.append((rule, wildcards, benchmark,
+                                        time.perf_counter() - start_time))
+
+    @staticmethod
+    def read_benchmark(benchmark_file):
+        '''
+        Read the wall time (s), CPU time (s) and max RSS (MB) of a Snakemake
+        benchmark file. If the job was repeated, the mean is returned. Values
+        that are not available are None
+        '''
+        with open(benchmark_file) as file_:
+            rows = list(csv.DictReader(file_, delimiter='\t'))
+        def mean_of(column):
+            values = []
+            for row in rows:
+                try:
+                    values.append(float(row[column]))
+                except (KeyError, TypeError, ValueError):
+                    # Missing columns or 'NA' values
+                    pass
+            return statistics.mean(values) if values else None
+        return mean_of('s'), mean_of('cpu_time'), mean_of('max_rss')
+
+    def get_records(self):
+        '''Get the JobRecord of all the jobs that finished'''
+        records = []
+        for rule, wildcards, benchmark, wall_time_s in self.__finished_jobs:
+            cpu_time_s = max_rss_mb = None
+            benchmarked = False
+            benchmark_file = self.workdir.joinpath(str(benchmark)) if benchmark else None
+            if benchmark_file is not None and benchmark_file.is_file():
+                benchmark_wall_time_s, cpu_time_s, max_rss_mb = self.read_benchmark(benchmark_file)
+                if benchmark_wall_time_s is not None:
+                    wall_time_s = benchmark_wall_time_s
+                    benchmarked = True
+            records.append(JobRecord(rule=rule,
+                                    sample=wildcards.get('sample'),
+                                    wall_time_s=wall_time_s,
+                                    cpu_time_s=cpu_time_s,
+                                    max_rss_mb=max_rss_mb,
+                                    benchmarked=benchmarked))
+        return records
+
+
+class RunHistory(helper_functions.SQLiteCache):
+    '''
+    SQLite database with the JobRecord of the jobs of previous runs. The
+    estimates are based on the most recent max_records jobs of every rule
+    '''
+
+    default_name = 'run_history.sqlite'
+
+    def __init__(self, history_file=None, max_records=100):
+        '''Constructor'''
+        self.max_records = max_records
+        super().__init__(history_file)
+
+    def create_tables(self, connection):
+        connection.execute(
+            '''CREATE TABLE IF NOT EXISTS jobs (
+                pipeline TEXT NOT NULL,
+                rule TEXT NOT NULL,
+                sample TEXT,
+                wall_time_s REAL NOT NULL,
+                cpu_time_s REAL,
+                max_rss_mb REAL,
+                recorded_at REAL NOT NULL,
+                benchmarked INTEGER NOT NULL DEFAULT 0)'''
+        )
+        columns = [row[1] for row in connection.execute('PRAGMA table_info(jobs)')]
+        if 'benchmarked' not in columns:
+            # History written before the benchmarked column existed. Its
+            # records are not known to be benchmarked
+            connection.execute('ALTER TABLE jobs ADD COLUMN benchmarked INTEGER NOT NULL DEFAULT 0')
+        connection.execute(
+            'CREATE INDEX IF NOT EXISTS jobs_rule ON jobs (pipeline, rule, recorded_at)'
+        )
+
+    def add_records(self, pipeline, records):
+        '''Store the JobRecord of the finished jobs of a pipeline'''
+        recorded_at = time.time()
+        with closing(self.connect()) as connection, connection:
+            connection.executemany(
+                '''INSERT INTO jobs
+                (pipeline, rule, sample, wall_time_s, cpu_time_s, max_rss_mb, recorded_at, benchmarked)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)''',
+                [(pipeline, record.rule, None if record.sample is None else str(record.sample),
+                    record.wall_time_s, record.cpu_time_s, record.max_rss_mb, recorded_at, 
+                    int(bool(record.benchmarked)))
+                    for record in records]
+            )
+
+    def get_records(self, pipeline):
+        '''
+        Get the most recent records of every rule of a pipeline. Returns a
+        dictionary with the rule as key and a list of JobRecord as value
+        '''
+        with closing(self.connect()) as connection:
+            rows = connection.execute(
+                '''SELECT rule, sample, wall_time_s, cpu_time_s, max_rss_mb, benchmarked FROM (
+                    SELECT *, ROW_NUMBER() OVER (
+                        PARTITION BY rule ORDER BY recorded_at DESC, rowid DESC) AS position
+                    FROM jobs WHERE pipeline = ?)
+                WHERE position <= ?''',
+                (pipeline, self.max_records)
+            ).fetchall()
+        records = {}
+        for row in rows:
+            records.setdefault(row[0], []).append(JobRecord(*row[:-1], benchmarked=bool(row[-1])))
+        return records
+
+    def estimate_resources(self, pipeline, time_margin=1.5, mem_margin=1.2, min_records=3):
+        '''
+        Estimate the time_limit (minutes) and mem_gb of every rule that has
+        at least min_records benchmarked jobs in the history. The estimate 
+        is the longest time (and largest memory) of the recent jobs of the 
+        rule multiplied by a safety margin. Only the jobs with benchmark 
+        files are used (the other wall times include the time in the queue)
+        '''
+        estimates = {}
+        for rule, records in self.get_records(pipeline).items():
+            records = [record for record in records if record.benchmarked]
+            if len(records) < min_records:
+                continue
+            max_wall_time_s = max(record.wall_time_s for record in records)
+            estimates[rule] = {'time_limit': max(int(math.ceil(max_wall_time_s * time_margin / 60)), 1)}
+            max_rss_mb = [record.max_rss_mb for record in records if record.max_rss_mb is not None]
+            if max_rss_mb:
+                estimates[rule]['mem_gb'] = max(int(math.ceil(max(max_rss_mb) * mem_margin / 1024)), 1)
+        return estimates
+
+    def get_priority_rules(self, pipeline, min_records=3):
+        '''
+        Get the per-sample rules (rules with a sample wildcard) that are
+        slower than most rules of the pipeline (median wall time above the
+        median of all rules), slowest first. Giving them priority starts the
+        long jobs early so they do not delay the end of the run
+        '''
+        records = self.get_records(pipeline)
+        median_times = {rule: statistics.median(record.wall_time_s for record in rule_records)
+                        for rule, rule_records in records.items()
+                        if len(rule_records) >= min_records}
+        if not median_times:
+            return []
+        overall_median = statistics.median(median_times.values())
+        per_sample_rules = {rule for rule, rule_records in records.items()
+                            if all(record.sample is not None for record in rule_records)}
+        return sorted([rule for rule, median_time in median_times.items()
+                        if median_time > overall_median and rule in per_sample_rules],
+                    key=lambda rule: median_times[rule], reverse=True)
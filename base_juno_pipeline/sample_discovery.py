@@ -0,0 +1,228 @@
+'''
+Helpers to discover the input files of a Juno pipeline. The input directory
+is listed with os.scandir so the stat result of every file is only
+requested once and the (potentially slow) validation of the number of lines
+per file is done in a bounded thread pool. Optionally, the results are 
+stored in a DiscoveryCache so unchanged files are skipped in later runs.
+Nested directories (e.g. one directory per sequencing run) can be walked
+recursively, listing the directories of every level in parallel.
+'''
+
+from base_juno_pipeline import helper_functions
+from base_juno_pipeline.discovery_cache import CacheRecord
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from fnmatch import fnmatch
+import os
+import pathlib
+
+
+# File found in the input directory together with the stat information
+# that was collected while listing the directory
+InputFile = namedtuple('InputFile', ['name', 'path', 'size', 'mtime_ns', 'inode'])
+
+
+class InputDiscovery(helper_functions.JunoHelpers):
+    '''
+    Class to list the files in an input directory and to validate that they
+    have the minimum number of lines expected by the pipeline
+    '''
+
+    def __init__(self,
+                min_num_lines=0,
+                max_workers=None,
+                cache=None):
+        '''Constructor'''
+        self.min_num_lines = int(min_num_lines)
+        self.max_workers = max_workers
+        self.cache = cache
+
+    def scan_dir(self, directory):
+        '''
+        Function to list the regular files (or symlinks to regular files) in
+        a directory. Returns a list of InputFile in the order given by the
+        file system
+        '''
+        return self.__scan_dir_entries(directory)[0]
+
+    def __scan_dir_entries(self, directory, list_subdirs=False):
+        '''
+        List the files and (if list_subdirs is True) the subdirectories of 
+        a directory. The subdirectories are (path, (device, inode)) tuples 
+        so directories that are reached twice (through symlinks) can be 
+        recognized
+        '''
+        directory = pathlib.Path(directory)
+        input_files = []
+        subdirs = []
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                try:
+                    if list_subdirs and entry.is_dir():
+                        dir_stat = entry.stat()
+                        subdirs.append((directory.joinpath(entry.name),
+                                        (dir_stat.st_dev, dir_stat.st_ino)))
+                        continue
+                    if not entry.is_file():
+                        continue
+                    file_stat = entry.stat()
+                except OSError:
+                    # Broken symlinks or files removed while listing
+                    continue
+                input_files.append(InputFile(name=entry.name,
+                                            path=str(directory.joinpath(entry.name)),
+                                            size=file_stat.st_size,
+                                            mtime_ns=file_stat.st_mtime_ns,
+                                            inode=file_stat.st_ino))
+        return input_files, subdirs
+
+    def __scan_dir_or_skip(self, directory):
+        try:
+            return self.__scan_dir_entries(directory, list_subdirs=True)
+        except OSError as err:
+            print(self.message_formatter(
+                f'The directory {directory} could not be listed ({err}) and will be skipped.'
+            ))
+            return [], []
+
+    @staticmethod
+    def matches_any(relative_path, patterns):
+        '''
+        Whether a path (relative to the walked directory) matches any of the
+        glob patterns. The patterns are matched with fnmatch, so * also
+        matches the / between directories (e.g. '*_R1_*' matches the R1 files
+        at any depth and 'run_2024*' the runs of 2024)
+        '''
+        return any(fnmatch(relative_path, pattern) for pattern in patterns)
+
+    def walk(self, directory, max_depth=None, include=None, exclude=None):
+        '''
+        Function to list the files of a directory and of all its 
+        subdirectories (up to max_depth levels deep, None for no limit). 
+        The directories of the same level are listed in parallel. Only files
+        whose path (relative to the directory) matches one of the include 
+        globs (if given) and none of the exclude globs are kept and 
+        subdirectories that match an exclude glob are not walked. Returns a
+        dictionary with the (sub)directory as key and a list of InputFile as
+        value (only for directories with files)
+        '''
+        root = pathlib.Path(directory)
+        include = list(include or [])
+        exclude = list(exclude or [])
+        files_per_dir = {}
+        root_stat = root.stat()
+        visited = {(root_stat.st_dev, root_stat.st_ino)}
+        level = [root]
+        depth = 0
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            while level:
+                next_level = []
+                for current_dir, (input_files, subdirs) in zip(level, executor.map(self.__scan_dir_or_skip, level)):
+                    input_files = [file_ for file_ in input_files
+                                    if self.__is_selected(root, file_.path, include, exclude)]
+                    if input_files:
+                        files_per_dir[current_dir] = input_files
+                    if max_depth is not None and depth >= max_depth:
+                        continue
+                    for subdir, dir_id in subdirs:
+                        if dir_id in visited or not self.__is_selected(root, subdir, [], exclude):
+                            continue
+                        visited.add(dir_id)
+                        next_level.append(subdir)
+                level = sorted(next_level)
+                depth += 1
+        return files_per_dir
+
+    def __is_selected(self, root, path, include, exclude):
+        relative_path = pathlib.Path(path).relative_to(root).as_posix()
+        if exclude and self.matches_any(relative_path, exclude):
+            return False
+        return not include or self.matches_any(relative_path, include)
+
+    def file_has_min_lines(self, input_file):
+        '''
+        Same as validate_file_has_min_lines but using the size that was
+        cached when listing the directory. Files are only opened when at 
+        least one line is required
+        '''
+        if input_file.size < 1:
+            return False
+        if self.min_num_lines <= 0:
+            return True
+        return self.validate_file_has_min_lines(input_file.path, self.min_num_lines)
+
+    def validate_files(self, input_files):
+        '''
+        Function to keep only the files that have the minimum number of lines.
+        The order of the input files is kept
+        '''
+        input_files = list(input_files)
+        if self.min_num_lines <= 0 or self.max_workers == 1 or len(input_files) < 2:
+            results = [self.file_has_min_lines(file_) for file_ in input_files]
+        else:
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                results = list(executor.map(self.file_has_min_lines, input_files))
+        return [file_ for file_, valid in zip(input_files, results) if valid]
+
+    def discover(self, directory, classify, scheme, input_files=None, listed_files=None):
+        '''
+        Function to find the input files of a directory that can be assigned
+        to a sample and have the minimum number of lines. The classify 
+        function receives a file name and returns a (sample, read) tuple or 
+        None if the file does not belong to any sample. The scheme is the name
+        under which the results are stored in the cache (if any). The 
+        input_files of the directory can be given if it was already listed 
+        (see walk) or if only some of its files should be used. In that case
+        the listed_files are all the files of the directory (before 
+        filtering), used to know which cached files were removed. Returns a
+        list of (InputFile, sample, read) tuples
+        '''
+        if input_files is None:
+            input_files = self.scan_dir(directory)
+            listed_files = input_files
+        cached_records = {} if self.cache is None else self.cache.lookup(directory, scheme)
+        classified = []
+        validity = {}
+        new_records = []
+        for file_ in input_files:
+            record = cached_records.pop(os.path.abspath(file_.path), None)
+            if record is not None and self.cache.matches_fingerprint(record, file_):
+                classification = None if record.sample is None else (record.sample, record.read)
+                valid = self.cache.cached_validity(record, self.min_num_lines)
+            else:
+                classification = classify(file_.name)
+                valid = None
+                if classification is None:
+                    new_records.append(self.__make_record(file_))
+            if classification is None:
+                continue
+            classified.append((file_,) + tuple(classification))
+            if valid is not None:
+                validity[file_] = valid
+        files_to_validate = [item[0] for item in classified if item[0] not in validity]
+        valid_files = set(self.validate_files(files_to_validate))
+        for file_, sample, read in classified:
+            if file_ not in validity:
+                validity[file_] = file_ in valid_files
+                new_records.append(self.__make_record(file_, sample, read, validity[file_]))
+        if self.cache is not None:
+            # Records left in cached_records belong to files that were removed
+            # or that were not given (e.g. filtered out because they are still
+            # being written). Only the records of removed files are deleted
+            if listed_files is not None:
+                listed_paths = {os.path.abspath(file_.path) for file_ in listed_files}
+                stale_paths = [path for path in cached_records if path not in listed_paths]
+            else:
+                stale_paths = [path for path in cached_records if not os.path.lexists(path)]
+            self.cache.update(directory, scheme, new_records, stale_paths=stale_paths)
+        return [item for item in classified if validity[item[0]]]
+
+    def __make_record(self, input_file, sample=None, read=None, valid=None):
+        return CacheRecord(path=os.path.abspath(input_file.path),
+                            size=input_file.size,
+                            mtime_ns=input_file.mtime_ns,
+                            inode=input_file.inode,
+                            sample=sample,
+                            read=read,
+                            min_num_lines=None if valid is None else self.min_num_lines,
+                            valid=valid)
@@ -0,0 +1,101 @@
+'''
+Compact records for the input files of the samples of a pipeline run. A
+sample_dict normally is a dictionary of dictionaries with the full path of
+every file ({sample: {R1: file, R2: file}}), which costs a lot of memory for
+input directories with millions of files. A Sample stores the files in
+__slots__ and relative to the input directory (which is only stored once for
+all samples) but can be used as the dictionary it replaces:
+sample_dict[sample]['R1'] still gives the full path of the file.
+'''
+
+from collections.abc import MutableMapping
+import os
+import sys
+import yaml
+
+
+class Sample(MutableMapping):
+    '''
+    Input files of a sample. Only the keys R1, R2 and assembly are
+    supported and the paths are stored relative to the root directory (files
+    outside of the root are stored with their full path)
+    '''
+
+    FIELDS = ('R1', 'R2', 'assembly')
+    __slots__ = ('root',) + FIELDS
+
+    def __init__(self, root, files=None, **kwargs):
+        '''Constructor'''
+        # All the samples of a run share the same root string
+        self.root = sys.intern(str(root))
+        for field in self.FIELDS:
+            setattr(self, field, None)
+        self.update(files or {}, **kwargs)
+
+    def __get_relative_path(self, key):
+        if key not in self.FIELDS:
+            raise KeyError(key)
+        relative_path = getattr(self, key)
+        if relative_path is None:
+            raise KeyError(key)
+        return relative_path
+
+    def __getitem__(self, key):
+        return os.path.join(self.root, self.__get_relative_path(key))
+
+    def __setitem__(self, key, file_path):
+        if key not in self.FIELDS:
+            raise KeyError(
+                f'{key} is not supported in a Sample record. The supported keys are: {", ".join(self.FIELDS)}'
+            )
+        file_path = str(file_path)
+        root_prefix = os.path.join(self.root, '')
+        if file_path.startswith(root_prefix):
+            file_path = file_path[len(root_prefix):]
+        setattr(self, key, file_path)
+
+    def __delitem__(self, key):
+        self.__get_relative_path(key)
+        setattr(self, key, None)
+
+    def __iter__(self):
+        return (field for field in self.FIELDS if getattr(self, field) is not None)
+
+    def __len__(self):
+        return sum(getattr(self, field) is not None for field in self.FIELDS)
+
+    def __repr__(self):
+        return f'{type(self).__name__}({self.root!r}, {self.to_dict()!r})'
+
+    def __getstate__(self):
+        return tuple(getattr(self, slot) for slot in self.__slots__)
+
+    def __setstate__(self, state):
+        for slot, value in zip(self.__slots__, state):
+            setattr(self, slot, value)
+        self.root = sys.intern(self.root)
+
+    def to_dict(self):
+        '''Dictionary with the full paths of the files of the sample'''
+        return dict(self.items())
+
+
+def to_plain_sample_dict(sample_dict):
+    '''
+    Convert a sample_dict with Sample records into a dictionary of
+    dictionaries (e.g. to write it as json)
+    '''
+    return {sample: sample_files.to_dict() if isinstance(sample_files, Sample) else sample_files
+            for sample, sample_files in sample_dict.items()}
+
+
+def represent_sample(dumper, sample):
+    return dumper.represent_dict(sample.to_dict())
+
+
+# The sample sheet can be written with yaml.dump or yaml.safe_dump without
+# converting the Sample records first
+for dumper in (yaml.Dumper, yaml.SafeDumper,
+                getattr(yaml, 'CDumper', None), getattr(yaml, 'CSafeDumper', None)):
+    if dumper is not None:
+        yaml.add_representer(Sample, represent_sample, Dumper=dumper)
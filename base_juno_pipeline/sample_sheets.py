@@ -0,0 +1,100 @@
+'''
+Writing and reading of the sample sheets of the Juno pipelines. The sample
+sheet is read by every Snakemake process (including every cluster job), so
+for big cohorts the time needed to parse it matters. YAML sample sheets are
+written and read with the libyaml (C) Dumper and Loader when PyYAML was
+built with it. Compact JSON and msgpack sample sheets can be used instead
+(msgpack needs the msgpack package to be installed). The format is taken
+from the extension of the sample sheet unless it is given explicitly and
+RunSnakemake passes it to the Snakefile as config['sample_sheet_format'] so
+the Snakefile can read the sample sheet with read_sample_sheet.
+'''
+
+from base_juno_pipeline.sample_records import to_plain_sample_dict
+import json
+import pathlib
+import yaml
+
+# Use the C implementation of PyYAML if available
+YAML_DUMPER = getattr(yaml, 'CSafeDumper', yaml.SafeDumper)
+YAML_LOADER = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+
+# Format of the sample sheet: extensions (the first one is used for new files)
+SAMPLE_SHEET_FORMATS = {'yaml': ('.yaml', '.yml'),
+                        'json': ('.json',),
+                        'msgpack': ('.msgpack', '.mpk')}
+
+
+def get_sample_sheet_format(sample_sheet, sample_sheet_format=None):
+    '''
+    Get the format of a sample sheet: the given sample_sheet_format or the
+    format that belongs to the extension of the file (yaml if the extension
+    is unknown)
+    '''
+    if sample_sheet_format is not None:
+        assert sample_sheet_format in SAMPLE_SHEET_FORMATS, \
+            f'Unknown sample sheet format {sample_sheet_format}. Choose one of: {", ".join(SAMPLE_SHEET_FORMATS)}.'
+        return sample_sheet_format
+    suffix = pathlib.Path(sample_sheet).suffix.lower()
+    for format_, extensions in SAMPLE_SHEET_FORMATS.items():
+        if suffix in extensions:
+            return format_
+    return 'yaml'
+
+
+def get_sample_sheet_name(name, sample_sheet_format):
+    '''File name for a sample sheet of the given format (e.g. sample_sheet.json)'''
+    return f'{name}{SAMPLE_SHEET_FORMATS[sample_sheet_format][0]}'
+
+
+def get_processed_samples_file(sample_sheet, sample_sheet_format=None):
+    '''
+    File (next to a sample sheet in the audit trail) with all the samples
+    processed in the runs with the same output directory
+    '''
+    sample_sheet_format = get_sample_sheet_format(sample_sheet, sample_sheet_format)
+    return pathlib.Path(sample_sheet).with_name(get_sample_sheet_name('processed_samples', sample_sheet_format))
+
+
+def import_msgpack():
+    try:
+        import msgpack
+    except ImportError:
+        raise ImportError(
+            'The msgpack package is needed for msgpack sample sheets. Install it (pip install msgpack) or use a yaml or json sample sheet.'
+        )
+    return msgpack
+
+
+def write_sample_sheet(sample_dict, sample_sheet, sample_sheet_format=None):
+    '''
+    Write a sample_dict ({sample: {R1: file, R2: file...}}, the values can
+    also be Sample records) as a sample sheet. Returns the format that was
+    used
+    '''
+    sample_sheet_format = get_sample_sheet_format(sample_sheet, sample_sheet_format)
+    sample_dict = to_plain_sample_dict(sample_dict)
+    if sample_sheet_format == 'msgpack':
+        msgpack = import_msgpack()
+        with open(sample_sheet, 'wb') as file_:
+            file_.write(msgpack.packb(sample_dict, use_bin_type=True))
+    elif sample_sheet_format == 'json':
+        with open(sample_sheet, 'w') as file_:
+            json.dump(sample_dict, file_, separators=(',', ':'))
+    else:
+        with open(sample_sheet, 'w') as file_:
+            yaml.dump(sample_dict, file_, Dumper=YAML_DUMPER, default_flow_style=False)
+    return sample_sheet_format
+
+
+def read_sample_sheet(sample_sheet, sample_sheet_format=None):
+    '''Read a sample sheet written by write_sample_sheet (or any yaml file)'''
+    sample_sheet_format = get_sample_sheet_format(sample_sheet, sample_sheet_format)
+    if sample_sheet_format == 'msgpack':
+        msgpack = import_msgpack()
+        with open(sample_sheet, 'rb') as file_:
+            return msgpack.unpackb(file_.read(), raw=False) or {}
+    with open(sample_sheet) as file_:
+        if sample_sheet_format == 'json':
+            return json.load(file_) or {}
+        return yaml.load(file_, Loader=YAML_LOADER) or {}
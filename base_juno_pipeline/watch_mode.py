@@ -0,0 +1,218 @@
+'''
+Watch mode for the Juno pipelines. Instead of running the pipeline once for
+the samples that are in the input directory, the input directory is polled
+and a new (incremental) run is started for the samples that became ready
+since the previous run. A sample is ready when all its files are there (R1
+and R2 and/or the assembly) and none of them changed (size and modification
+time) in at least two polls that are the debounce window apart, so files that are still being copied or
+written by the sequencer are not used. Only the stat information of the
+files is used to detect changes: the input directory is listed once per
+poll and the files are only opened (to validate them) once they are stable.
+Using PipelineStartup(use_cache=True) avoids validating the same stable
+files again in every poll.
+'''
+
+from base_juno_pipeline import helper_functions
+from base_juno_pipeline.base_juno_pipeline import RunSnakemake
+from datetime import datetime
+import json
+import os
+import pathlib
+import time
+
+# Files that a sample needs (per input_type of PipelineStartup) to be ready
+EXPECTED_FILES = {'fastq': ('R1', 'R2'),
+                'fasta': ('assembly',),
+                'both': ('R1', 'R2', 'assembly')}
+
+
+class InputWatcher(helper_functions.JunoHelpers):
+    '''
+    Class to poll the input directory of a PipelineStartup every
+    poll_interval seconds and start a run with the samples that are ready.
+    The make_run function receives the sample_dict of the ready samples and
+    a name for the run (e.g. to make its output directory) and returns the
+    RunSnakemake of the run (it should write the sample sheet of the run).
+    The runs are started in separate (spawned) processes, so they have to 
+    be picklable, and at most max_concurrent_runs run at the same time 
+    (samples that get ready while all the runs are busy are started 
+    together in the next run). A sample
+    is only run again if its files change. The samples that were run (and
+    their files) are stored in the state_file (if given), so the watcher can
+    be restarted without running them again. Errors while polling (e.g. 
+    files removed while the input directory is listed) are reported and the
+    directory is polled again in the next poll
+    '''
+
+    def __init__(self,
+                pipeline_startup,
+                make_run,
+                poll_interval=60,
+                debounce=120,
+                max_concurrent_runs=1,
+                state_file=None):
+        '''Constructor'''
+        self.pipeline_startup = pipeline_startup
+        self.make_run = make_run
+        self.poll_interval = poll_interval
+        self.debounce = debounce
+        self.max_concurrent_runs = max_concurrent_runs
+        self.state_file = None if state_file is None else pathlib.Path(state_file)
+        self.__validate_arguments()
+        # Finished runs: {'name': run_name, 'samples': [...], 'successful': bool}
+        self.runs = []
+        self.__running = {}
+        self.__file_states = {}
+        self.__previous_file_states = {}
+        self.__num_runs = 0
+        self.__processed_samples = self.__read_state()
+        self.pipeline_startup.input_file_filter = self.is_stable
+
+    def __validate_arguments(self):
+        assert self.poll_interval > 0, \
+            "poll_interval should be a positive number of seconds"
+        assert self.debounce >= 0, \
+            "debounce should be 0 or a positive number of seconds"
+        assert int(self.max_concurrent_runs) > 0, \
+            "max_concurrent_runs should be a positive number"
+
+    def __read_state(self):
+        if self.state_file is None or not self.state_file.is_file():
+            return {}
+        with open(self.state_file) as file_:
+            return json.load(file_)
+
+    def __write_state(self):
+        if self.state_file is None:
+            return
+        self.state_file.parent.mkdir(parents=True, exist_ok=True)
+        tmp_state_file = self.state_file.with_name(f'.{self.state_file.name}.tmp')
+        with open(tmp_state_file, 'w') as file_:
+            json.dump(self.__processed_samples, file_)
+        os.replace(tmp_state_file, self.state_file)
+
+    def is_stable(self, input_file):
+        '''
+        Whether an InputFile (see sample_discovery) did not change during the
+        debounce window: its size and modification time are the same as in
+        the previous poll and in the polls of the last debounce seconds. The
+        modification time itself is not used since files that are copied 
+        with it (e.g. cp -p or rsync -t) look old while they are still being
+        copied
+        '''
+        now = time.monotonic()
+        fingerprint = (input_file.size, input_file.mtime_ns)
+        previous_state = self.__previous_file_states.get(input_file.path)
+        seen_before = previous_state is not None and previous_state[0] == fingerprint
+        unchanged_since = previous_state[1] if seen_before else now
+        self.__file_states[input_file.path] = (fingerprint, unchanged_since)
+        return seen_before and now - unchanged_since >= self.debounce
+
+    def __get_fingerprint(self, sample_files):
+        input_files = self.pipeline_startup.input_files
+        return sorted([file_path, input_files[file_path].size, input_files[file_path].mtime_ns]
+                        for file_path in sample_files.values())
+
+    def get_ready_samples(self, sample_dict):
+        '''
+        Function to get the part of a sample_dict with the samples that have
+        all the expected files and were not run yet with the same files
+        '''
+        expected_files = EXPECTED_FILES[self.pipeline_startup.input_type]
+        ready_samples = {}
+        for sample, sample_files in sample_dict.items():
+            if not all(key in sample_files for key in expected_files):
+                continue
+            if self.__processed_samples.get(sample) != self.__get_fingerprint(sample_files):
+                ready_samples[sample] = sample_files
+        return ready_samples
+
+    def poll(self):
+        '''
+        Check the input directory once. The finished runs are collected and,
+        if fewer than max_concurrent_runs are running, a run is started with
+        the samples that are ready. Returns the name of the started run or
+        None
+        '''
+        self.__collect_finished_runs()
+        self.__previous_file_states, self.__file_states = self.__file_states, {}
+        sample_dict = self.pipeline_startup.find_samples()
+        ready_samples = self.get_ready_samples(sample_dict)
+        if not ready_samples or len(self.__running) >= int(self.max_concurrent_runs):
+            return None
+        return self.__start_run(ready_samples)
+
+    def __start_run(self, sample_dict):
+        self.__num_runs += 1
+        run_name = f"run_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{self.__num_runs}"
+        print(self.message_formatter(
+            f"Starting {run_name} with {len(sample_dict)} new samples: {', '.join(map(str, sample_dict))}"
+        ))
+        # The samples are not run again (unless their files change), also if
+        # the run fails, to avoid starting failing runs in every poll
+        for sample, sample_files in sample_dict.items():
+            self.__processed_samples[sample] = self.__get_fingerprint(sample_files)
+        self.__write_state()
+        try:
+            run = self.make_run(sample_dict, run_name)
+        except Exception as err:
+            print(self.error_formatter(f"The run {run_name} could not be made: {err}"))
+            self.runs.append({'name': run_name, 'samples': list(sample_dict), 'successful': False})
+            return None
+        process = RunSnakemake.start_in_process(run, run_name)
+        self.__running[run_name] = (process, list(sample_dict))
+        return run_name
+
+    def __collect_finished_runs(self, wait=False):
+        for run_name, (process, samples) in list(self.__running.items()):
+            if wait:
+                process.join()
+            elif process.is_alive():
+                continue
+            process.join()
+            successful = process.exitcode == 0
+            self.runs.append({'name': run_name, 'samples': samples, 'successful': successful})
+            del self.__running[run_name]
+            if successful:
+                print(self.message_formatter(f"{run_name} finished successfully."))
+            else:
+                print(self.error_formatter(
+                    f"{run_name} failed. Its samples will only be run again if their files change: {', '.join(map(str, samples))}"
+                ))
+
+    def num_running_runs(self):
+        '''Number of runs that are still running'''
+        self.__collect_finished_runs()
+        return len(self.__running)
+
+    def wait_for_runs(self):
+        '''Wait until all the started runs are finished'''
+        self.__collect_finished_runs(wait=True)
+
+    def watch(self, max_polls=None):
+        '''
+        Poll the input directory every poll_interval seconds until
+        interrupted (or max_polls times). The runs that were started are
+        waited for before returning
+        '''
+        num_polls = 0
+        print(self.message_formatter(
+            f"Watching {self.pipeline_startup.input_dir} for new samples (every {self.poll_interval} seconds)..."
+        ))
+        try:
+            while True:
+                try:
+                    self.poll()
+                except Exception as err:
+                    print(self.error_formatter(
+                        f"The input directory could not be checked: {err}. It will be checked again in {self.poll_interval} seconds."
+                    ))
+                num_polls += 1
+                if max_polls is not None and num_polls >= max_polls:
+                    break
+                time.sleep(self.poll_interval)
+        except KeyboardInterrupt:
+            print(self.message_formatter("Stopped watching the input directory. Waiting for the running runs..."))
+        finally:
+            self.wait_for_runs()
+        return self.runs
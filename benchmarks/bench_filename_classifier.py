@@ -0,0 +1,119 @@
+'''
+Benchmark of the classification of input file names. A list of synthetic
+file names is generated with a mix of Illumina fastq names, other fastq
+names, fasta assemblies and files that do not belong to any sample (as found
+in sequencing run directories). The names are classified with the
+classifiers of filename_classifiers and with the regular expressions that
+were used before (every name through the regular expression) and the time
+per name, the number of classified names and the number of names that are
+classified differently (only expected for Illumina names) are stored as JSON.
+
+Usage: python benchmarks/bench_filename_classifier.py [--names 1000000]
+        [--runs 3] [--output FILE]
+'''
+
+import argparse
+import json
+import pathlib
+import platform
+import random
+import re
+import statistics
+import sys
+import time
+
+sys.path.insert(0, str(pathlib.Path(__file__).absolute().parent.parent))
+from base_juno_pipeline.filename_classifiers import FastaClassifier, FastqClassifier
+
+LEGACY_FASTQ_PATTERN = re.compile(r'(.*?)(?:_S\d+_|_S\d+.|_|\.)(?:_L555_)?(?:p)?R?(1|2)(?:_.*\.|\..*\.|\.)f(ast)?q(\.gz)?')
+LEGACY_FASTA_PATTERN = re.compile(r'(.*?).fasta')
+
+
+def legacy_fastq(file_name):
+    match = LEGACY_FASTQ_PATTERN.fullmatch(file_name)
+    if match:
+        return match.group(1), f'R{match.group(2)}'
+
+
+def legacy_fasta(file_name):
+    match = LEGACY_FASTA_PATTERN.fullmatch(file_name)
+    if match:
+        return match.group(1), 'assembly'
+
+
+def make_file_names(num_names, seed=1):
+    '''
+    Synthetic file names: 40% Illumina fastq, 20% other fastq names, 20%
+    fasta and 20% other files
+    '''
+    rng = random.Random(seed)
+    file_names = []
+    for name_num in range(num_names):
+        sample = f'{rng.choice(["", "MB", "RIVM_"])}{name_num:07d}'
+        read = rng.choice([1, 2])
+        kind = rng.random()
+        if kind < 0.4:
+            file_names.append(f'{sample}_S{rng.randint(1, 400)}_L00{rng.randint(1, 4)}_R{read}_001.fastq.gz')
+        elif kind < 0.6:
+            file_names.append(rng.choice([f'{sample}_R{read}.fastq.gz', f'{sample}_{read}.fq',
+                                        f'{sample}_R{read}_filt.fq.gz']))
+        elif kind < 0.8:
+            file_names.append(f'{sample}.fasta')
+        else:
+            file_names.append(rng.choice([f'{sample}.bam', f'{sample}_R{read}_fastqc.html',
+                                        'SampleSheet.csv', f'{sample}.fasta.fai', f'{sample}.md5']))
+    return file_names
+
+
+def time_classification(classifiers, file_names, runs):
+    '''Median time (in seconds) to classify all names with all classifiers'''
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        for classify in classifiers:
+            for file_name in file_names:
+                classify(file_name)
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                    formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--names', type=int, default=1000000, metavar='INT',
+                        help='Number of synthetic file names.')
+    parser.add_argument('--runs', type=int, default=3, metavar='INT',
+                        help='Number of times the names are classified (the median time is reported).')
+    parser.add_argument('--output', type=pathlib.Path, default=pathlib.Path('bench_filename_classifier.json'),
+                        metavar='FILE', help='JSON file to store the results.')
+    args = parser.parse_args()
+
+    file_names = make_file_names(args.names)
+    classifiers = [FastqClassifier().classify, FastaClassifier().classify]
+    legacy_classifiers = [legacy_fastq, legacy_fasta]
+    results = {'python': platform.python_version(),
+                'platform': platform.platform(),
+                'num_names': len(file_names),
+                'runs': args.runs}
+    for label, functions in [('classifiers', classifiers), ('legacy_regex', legacy_classifiers)]:
+        total_time = time_classification(functions, file_names, args.runs)
+        results[label] = {'total_time': total_time,
+                        'time_per_name': total_time / max(len(file_names), 1),
+                        'num_classified': sum(any(classify(file_name) for classify in functions)
+                                            for file_name in file_names)}
+    # Only Illumina names that the legacy regular expression parsed wrongly
+    # (e.g. with a sample number of more than two digits) are different
+    different = [file_name for file_name in file_names
+                if [classify(file_name) for classify in classifiers]
+                != [classify(file_name) for classify in legacy_classifiers]]
+    results['num_different'] = len(different)
+    results['num_different_illumina'] = sum('_001.' in file_name for file_name in different)
+    results['speedup'] = results['legacy_regex']['total_time'] / max(results['classifiers']['total_time'], 1e-9)
+    print(json.dumps(results, indent=2))
+    with open(args.output, 'w') as file_:
+        json.dump(results, file_, indent=2)
+    print(f'Results stored in {args.output}')
+
+
+if __name__ == '__main__':
+    sys.exit(main())
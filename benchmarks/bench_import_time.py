@@ -0,0 +1,71 @@
+'''
+Benchmark of the start-up time of the base_juno_pipeline library. It times
+'python -m base_juno_pipeline --help' and 'import base_juno_pipeline' in 
+fresh interpreters and fails (exit code 1) if the median time of the help 
+command is above the given maximum. Heavy dependencies (pandas, snakemake)
+should only be imported when they are used.
+
+Usage: python benchmarks/bench_import_time.py [--runs 10] [--max-seconds 1.0]
+'''
+
+import argparse
+import json
+import pathlib
+import statistics
+import subprocess
+import sys
+import time
+
+REPO_DIR = pathlib.Path(__file__).absolute().parent.parent
+HEAVY_MODULES = ['pandas', 'snakemake']
+
+
+def time_command(command, runs):
+    '''Median wall time (in seconds) of running a command several times'''
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(command, cwd=REPO_DIR, check=True,
+                        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings)
+
+
+def get_heavy_modules_imported():
+    '''Heavy modules that are imported by just importing the library'''
+    code = ('import sys, base_juno_pipeline; '
+            f'print(",".join(m for m in {HEAVY_MODULES} if m in sys.modules))')
+    output = subprocess.check_output([sys.executable, '-c', code], cwd=REPO_DIR)
+    return [module for module in output.decode().strip().split(',') if module]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                    formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=10, metavar='INT',
+                        help='Number of times every command is run.')
+    parser.add_argument('--max-seconds', type=float, default=1.0, metavar='FLOAT',
+                        help='Maximum median time for "python -m base_juno_pipeline --help".')
+    parser.add_argument('--output', type=pathlib.Path, metavar='FILE',
+                        help='JSON file to store the results.')
+    args = parser.parse_args()
+
+    results = {
+        'python_startup': time_command([sys.executable, '-c', 'pass'], args.runs),
+        'import_base_juno_pipeline': time_command([sys.executable, '-c', 'import base_juno_pipeline'], args.runs),
+        'help': time_command([sys.executable, '-m', 'base_juno_pipeline', '--help'], args.runs),
+        'heavy_modules_imported': get_heavy_modules_imported()
+    }
+    print(json.dumps(results, indent=2))
+    if args.output is not None:
+        with open(args.output, 'w') as file_:
+            json.dump(results, file_, indent=2)
+    if results['help'] > args.max_seconds or results['heavy_modules_imported']:
+        print(f'Start-up too slow (> {args.max_seconds} s) or heavy modules imported at start-up.',
+                file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
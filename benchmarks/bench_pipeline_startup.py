@@ -0,0 +1,119 @@
+'''
+Benchmark of the start-up of Juno pipelines at cohort scale. Synthetic 
+input directories are generated with the given numbers of samples (paired
+fastq.gz files and a fasta assembly per sample), both as a flat directory
+and with the layout of the Juno-assembly output (clean_fastq and 
+de_novo_assembly_filtered). For every directory the time needed by 
+PipelineStartup.start_juno_pipeline, PipelineStartup.make_sample_dict and 
+FileHelpers.validate_file_has_min_lines is measured and the results are 
+stored as JSON so regressions in the discovery time can be spotted.
+
+Usage: python benchmarks/bench_pipeline_startup.py [--samples 100 10000 100000]
+        [--min-num-lines 4] [--max-workers N] [--workdir DIR] [--output FILE]
+'''
+
+import argparse
+import gzip
+import json
+import pathlib
+import platform
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, str(pathlib.Path(__file__).absolute().parent.parent))
+from base_juno_pipeline import base_juno_pipeline
+from base_juno_pipeline import helper_functions
+
+FASTQ_RECORD = b'@read1\nACGTACGTACGT\n+\nIIIIIIIIIIII\n'
+FASTA_RECORD = b'>contig1\nACGTACGTACGTACGTACGTACGTACGTACGT\n'
+
+
+def make_input_dir(input_dir, num_samples, layout):
+    '''
+    Make a synthetic input directory with num_samples samples. The layout 
+    can be 'flat' (all files in input_dir) or 'juno_assembly'
+    '''
+    if layout == 'juno_assembly':
+        fastq_dir = input_dir.joinpath('clean_fastq')
+        fasta_dir = input_dir.joinpath('de_novo_assembly_filtered')
+    else:
+        fastq_dir = fasta_dir = input_dir
+    fastq_dir.mkdir(parents=True, exist_ok=True)
+    fasta_dir.mkdir(parents=True, exist_ok=True)
+    # All samples get the same (small) contents, only compressed once
+    fastq_content = gzip.compress(FASTQ_RECORD * 4)
+    for sample_num in range(num_samples):
+        sample = f'sample{sample_num:06d}'
+        for read in ['R1', 'R2']:
+            with open(fastq_dir.joinpath(f'{sample}_{read}.fastq.gz'), 'wb') as file_:
+                file_.write(fastq_content)
+        with open(fasta_dir.joinpath(f'{sample}.fasta'), 'wb') as file_:
+            file_.write(FASTA_RECORD * 4)
+
+
+def time_function(function, *args, **kwargs):
+    '''Wall time (in seconds) of calling a function once'''
+    start = time.perf_counter()
+    function(*args, **kwargs)
+    return time.perf_counter() - start
+
+
+def benchmark_input_dir(input_dir, min_num_lines, max_workers):
+    '''Time the discovery of the samples in an input directory'''
+    pipeline = base_juno_pipeline.PipelineStartup(input_dir, 'both',
+                                                min_num_lines=min_num_lines,
+                                                max_workers=max_workers)
+    results = {'start_juno_pipeline': time_function(pipeline.start_juno_pipeline),
+                'make_sample_dict': time_function(pipeline.make_sample_dict),
+                'num_samples_found': len(pipeline.sample_dict)}
+    input_files = [sample_files['R1'] for sample_files in pipeline.sample_dict.values()]
+    file_helpers = helper_functions.FileHelpers()
+    start = time.perf_counter()
+    for input_file in input_files:
+        file_helpers.validate_file_has_min_lines(input_file, min_num_lines)
+    results['validate_file_has_min_lines_per_file'] = (time.perf_counter() - start) / max(len(input_files), 1)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                    formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--samples', type=int, nargs='+', default=[100, 10000, 100000], metavar='INT',
+                        help='Numbers of samples of the generated input directories.')
+    parser.add_argument('--layouts', nargs='+', default=['flat', 'juno_assembly'],
+                        choices=['flat', 'juno_assembly'],
+                        help='Layouts of the generated input directories.')
+    parser.add_argument('--min-num-lines', type=int, default=4, metavar='INT',
+                        help='min_num_lines passed to PipelineStartup.')
+    parser.add_argument('--max-workers', type=int, default=None, metavar='INT',
+                        help='max_workers passed to PipelineStartup.')
+    parser.add_argument('--workdir', type=pathlib.Path, default=None, metavar='DIR',
+                        help='Directory where the input directories are generated (default: a temporary directory). '
+                        'Use a directory on the file system you want to benchmark (e.g. NFS).')
+    parser.add_argument('--output', type=pathlib.Path, default=pathlib.Path('bench_pipeline_startup.json'),
+                        metavar='FILE', help='JSON file to store the results.')
+    args = parser.parse_args()
+
+    results = {'python': platform.python_version(),
+                'platform': platform.platform(),
+                'min_num_lines': args.min_num_lines,
+                'max_workers': args.max_workers,
+                'runs': []}
+    with tempfile.TemporaryDirectory(dir=args.workdir) as tmp_dir:
+        for layout in args.layouts:
+            for num_samples in args.samples:
+                input_dir = pathlib.Path(tmp_dir).joinpath(f'{layout}_{num_samples}')
+                generation_time = time_function(make_input_dir, input_dir, num_samples, layout)
+                run = {'layout': layout, 'num_samples': num_samples,
+                        'generation_time': generation_time}
+                run.update(benchmark_input_dir(input_dir, args.min_num_lines, args.max_workers))
+                results['runs'].append(run)
+                print(json.dumps(run))
+    with open(args.output, 'w') as file_:
+        json.dump(results, file_, indent=2)
+    print(f'Results stored in {args.output}')
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,103 @@
+'''
+Benchmark of the memory used by a sample_dict with dictionaries (the default)
+and with compact Sample records (PipelineStartup(compact_sample_dict=True)).
+For the given numbers of samples (paired fastq files and a fasta assembly per
+sample, in the layout of the Juno-assembly output) both structures are built
+in memory, without making any files, the memory they allocate is measured
+with tracemalloc and the time needed to write them as a sample sheet (yaml)
+is measured. The results are stored as JSON.
+
+Usage: python benchmarks/bench_sample_records.py [--samples 10000 100000 1000000]
+        [--max-dump-samples 100000] [--output FILE]
+'''
+
+import argparse
+import gc
+import io
+import json
+import os
+import pathlib
+import platform
+import sys
+import time
+import tracemalloc
+import yaml
+
+sys.path.insert(0, str(pathlib.Path(__file__).absolute().parent.parent))
+from base_juno_pipeline.sample_records import Sample
+
+INPUT_DIR = '/data/BioGrid/archive/reanalysis/run_2021_0001'
+
+
+def sample_files(sample_num):
+    '''Full paths of the input files of a sample (like PipelineStartup)'''
+    sample = f'sample{sample_num:07d}'
+    return sample, {'R1': os.path.join(INPUT_DIR, 'clean_fastq', f'{sample}_R1.fastq.gz'),
+                    'R2': os.path.join(INPUT_DIR, 'clean_fastq', f'{sample}_R2.fastq.gz'),
+                    'assembly': os.path.join(INPUT_DIR, 'de_novo_assembly_filtered', f'{sample}.fasta')}
+
+
+def make_dict_sample_dict(num_samples):
+    sample_dict = {}
+    for sample_num in range(num_samples):
+        sample, files = sample_files(sample_num)
+        sample_dict[sample] = files
+    return sample_dict
+
+
+def make_compact_sample_dict(num_samples):
+    sample_dict = {}
+    for sample_num in range(num_samples):
+        sample, files = sample_files(sample_num)
+        sample_dict[sample] = Sample(INPUT_DIR, files)
+    return sample_dict
+
+
+def measure(make_function, num_samples, dump):
+    '''Memory (bytes) allocated by the sample_dict and time to build/dump it'''
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    sample_dict = make_function(num_samples)
+    build_time = time.perf_counter() - start
+    memory, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    results = {'memory_bytes': memory,
+                'memory_bytes_per_sample': memory / max(num_samples, 1),
+                'build_time': build_time}
+    if dump:
+        start = time.perf_counter()
+        yaml.safe_dump(sample_dict, io.StringIO(), default_flow_style=False)
+        results['yaml_dump_time'] = time.perf_counter() - start
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                    formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--samples', type=int, nargs='+', default=[10000, 100000, 1000000], metavar='INT',
+                        help='Numbers of samples of the sample_dicts.')
+    parser.add_argument('--max-dump-samples', type=int, default=100000, metavar='INT',
+                        help='Only time writing the sample sheet for sample_dicts up to this number of samples.')
+    parser.add_argument('--output', type=pathlib.Path, default=pathlib.Path('bench_sample_records.json'),
+                        metavar='FILE', help='JSON file to store the results.')
+    args = parser.parse_args()
+
+    results = {'python': platform.python_version(),
+                'platform': platform.platform(),
+                'runs': []}
+    for num_samples in args.samples:
+        dump = num_samples <= args.max_dump_samples
+        run = {'num_samples': num_samples,
+                'dict': measure(make_dict_sample_dict, num_samples, dump),
+                'compact': measure(make_compact_sample_dict, num_samples, dump)}
+        run['memory_ratio'] = run['compact']['memory_bytes'] / max(run['dict']['memory_bytes'], 1)
+        results['runs'].append(run)
+        print(json.dumps(run))
+    with open(args.output, 'w') as file_:
+        json.dump(results, file_, indent=2)
+    print(f'Results stored in {args.output}')
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,107 @@
+'''
+Benchmark of writing and reading sample sheets. A sample_dict with the given
+numbers of samples (paired fastq files and a fasta assembly per sample) is
+written and read back in every format of sample_sheets (yaml with the
+libyaml Dumper/Loader, json and msgpack if it is installed) and, as a
+reference, as yaml with the pure Python yaml.dump/yaml.safe_load. The
+median times and the file sizes are stored as JSON.
+
+Usage: python benchmarks/bench_sample_sheets.py [--samples 10000]
+        [--runs 5] [--workdir DIR] [--output FILE]
+'''
+
+import argparse
+import importlib.util
+import json
+import os
+import pathlib
+import platform
+import statistics
+import sys
+import tempfile
+import time
+import yaml
+
+sys.path.insert(0, str(pathlib.Path(__file__).absolute().parent.parent))
+from base_juno_pipeline.sample_sheets import YAML_DUMPER, get_sample_sheet_name, \
+    read_sample_sheet, write_sample_sheet
+
+INPUT_DIR = '/data/BioGrid/archive/reanalysis/run_2021_0001'
+
+
+def make_sample_dict(num_samples):
+    sample_dict = {}
+    for sample_num in range(num_samples):
+        sample = f'sample{sample_num:07d}'
+        sample_dict[sample] = {'R1': os.path.join(INPUT_DIR, 'clean_fastq', f'{sample}_R1.fastq.gz'),
+                                'R2': os.path.join(INPUT_DIR, 'clean_fastq', f'{sample}_R2.fastq.gz'),
+                                'assembly': os.path.join(INPUT_DIR, 'de_novo_assembly_filtered', f'{sample}.fasta')}
+    return sample_dict
+
+
+def pure_python_yaml_write(sample_dict, sample_sheet):
+    with open(sample_sheet, 'w') as file_:
+        yaml.dump(sample_dict, file_, default_flow_style=False)
+
+
+def pure_python_yaml_read(sample_sheet):
+    with open(sample_sheet) as file_:
+        return yaml.safe_load(file_)
+
+
+def median_time(function, runs, *args):
+    '''Median wall time (in seconds) of calling a function runs times'''
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        function(*args)
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                    formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--samples', type=int, nargs='+', default=[10000], metavar='INT',
+                        help='Numbers of samples of the sample sheets.')
+    parser.add_argument('--runs', type=int, default=5, metavar='INT',
+                        help='Number of times every sample sheet is written and read (the median time is reported).')
+    parser.add_argument('--workdir', type=pathlib.Path, default=None, metavar='DIR',
+                        help='Directory where the sample sheets are written (default: a temporary directory).')
+    parser.add_argument('--output', type=pathlib.Path, default=pathlib.Path('bench_sample_sheets.json'),
+                        metavar='FILE', help='JSON file to store the results.')
+    args = parser.parse_args()
+
+    formats = ['yaml', 'json']
+    if importlib.util.find_spec('msgpack') is not None:
+        formats.append('msgpack')
+    results = {'python': platform.python_version(),
+                'platform': platform.platform(),
+                'libyaml': YAML_DUMPER is not yaml.SafeDumper,
+                'runs': []}
+    with tempfile.TemporaryDirectory(dir=args.workdir) as tmp_dir:
+        for num_samples in args.samples:
+            sample_dict = make_sample_dict(num_samples)
+            run = {'num_samples': num_samples}
+            sample_sheet = pathlib.Path(tmp_dir).joinpath('pure_python_sample_sheet.yaml')
+            run['pure_python_yaml'] = {'write_time': median_time(pure_python_yaml_write, args.runs,
+                                                                sample_dict, sample_sheet),
+                                        'read_time': median_time(pure_python_yaml_read, args.runs, sample_sheet),
+                                        'file_size': sample_sheet.stat().st_size}
+            for sample_sheet_format in formats:
+                sample_sheet = pathlib.Path(tmp_dir).joinpath(get_sample_sheet_name('sample_sheet', sample_sheet_format))
+                run[sample_sheet_format] = {
+                    'write_time': median_time(write_sample_sheet, args.runs, sample_dict, sample_sheet),
+                    'read_time': median_time(read_sample_sheet, args.runs, sample_sheet),
+                    'file_size': sample_sheet.stat().st_size
+                }
+                assert read_sample_sheet(sample_sheet) == sample_dict
+            results['runs'].append(run)
+            print(json.dumps(run))
+    with open(args.output, 'w') as file_:
+        json.dump(results, file_, indent=2)
+    print(f'Results stored in {args.output}')
+
+
+if __name__ == '__main__':
+    sys.exit(main())
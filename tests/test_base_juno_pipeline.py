@@ -1,14 +1,32 @@
 import argparse
+import gzip
+import hashlib
+import importlib.util
+import json
 import os
 import pathlib
 from sys import path
+import sqlite3
 import subprocess
+import sys
+import tempfile
+import time
 import unittest
+from unittest import mock
+import yaml
 
 main_script_path = str(pathlib.Path(pathlib.Path(__file__).parent.absolute()).parent.absolute())
 path.insert(0, main_script_path)
 from base_juno_pipeline import base_juno_pipeline
 from base_juno_pipeline import helper_functions
+from base_juno_pipeline.cluster_executors import fill_in_resources, get_executor
+from base_juno_pipeline.filename_classifiers import FastaClassifier, FastqClassifier, RegexClassifier, get_classifier
+from base_juno_pipeline.instrumentation import PhaseTimer
+from base_juno_pipeline.resource_model import ResourceModel
+from base_juno_pipeline.run_history import JobHistoryCollector, JobRecord, RunHistory
+from base_juno_pipeline.sample_records import Sample
+from base_juno_pipeline.sample_sheets import get_sample_sheet_name, read_sample_sheet, write_sample_sheet
+from base_juno_pipeline.watch_mode import InputWatcher
 
 def make_non_empty_file(file_path, content='this\nfile\nhas\ncontents'):
     with open(file_path, 'w') as file_:
@@ -72,6 +90,187 @@ class TestFileJunoHelpers(unittest.TestCase):
         os.system(f'rm -f {empty_file}')
         os.system(f'rm -f {empty_file}.gz')
 
+    def test_lines_are_counted_decompressed_when_gzipped(self):
+        """Testing that the lines of a gzipped file are counted after
+        decompressing it and that a last line without newline also counts"""
+        JunoHelpers = helper_functions.JunoHelpers()
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            gz_file = pathlib.Path(tmp_dir).joinpath('reads.fastq.gz')
+            with gzip.open(gz_file, 'wb') as file_:
+                file_.write(b'@read\nACGT\n+\nIIII\n' * 250 + b'last line')
+            self.assertEqual(JunoHelpers.count_lines(gz_file, block_size=64), 1001)
+            self.assertEqual(JunoHelpers.count_lines(gz_file, max_num_lines=10, block_size=64), 13)
+            self.assertTrue(JunoHelpers.validate_file_has_min_lines(gz_file, min_num_lines=1001))
+            self.assertFalse(JunoHelpers.validate_file_has_min_lines(gz_file, min_num_lines=1002))
+
+    def test_truncated_gzipped_file_is_not_valid(self):
+        """Testing that a truncated or corrupt gzipped file is not valid
+        (instead of raising an error)"""
+        JunoHelpers = helper_functions.JunoHelpers()
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            gz_file = pathlib.Path(tmp_dir).joinpath('reads.fastq.gz')
+            with gzip.open(gz_file, 'wb') as file_:
+                file_.write(b'@read\nACGT\n+\nIIII\n' * 250)
+            truncated_file = pathlib.Path(tmp_dir).joinpath('truncated.fastq.gz')
+            truncated_file.write_bytes(gz_file.read_bytes()[:20])
+            corrupt_file = pathlib.Path(tmp_dir).joinpath('corrupt.fastq.gz')
+            corrupt_file.write_bytes(gz_file.read_bytes()[:10] + b'not deflate data' * 10)
+            for file_path in [truncated_file, corrupt_file]:
+                for approximate in [False, True]:
+                    self.assertFalse(
+                        JunoHelpers.validate_file_has_min_lines(file_path, min_num_lines=4, approximate=approximate)
+                        )
+
+    def test_approximate_num_lines_of_gzipped_file(self):
+        """Testing that the number of lines of a gzipped file can be estimated
+        from the gzip trailer"""
+        JunoHelpers = helper_functions.JunoHelpers()
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            gz_file = pathlib.Path(tmp_dir).joinpath('reads.fastq.gz')
+            with gzip.open(gz_file, 'wb') as file_:
+                file_.write(b'@read\nACGT\n+\nIIII\n' * 100000)
+            estimated_num_lines = JunoHelpers.estimate_gz_num_lines(gz_file, sample_size=1024)
+            self.assertAlmostEqual(estimated_num_lines, 400000, delta=4000)
+            self.assertTrue(
+                JunoHelpers.validate_file_has_min_lines(gz_file, min_num_lines=300000, approximate=True)
+                )
+            self.assertFalse(
+                JunoHelpers.validate_file_has_min_lines(gz_file, min_num_lines=500000, approximate=True)
+                )
+
+    def test_gzipped_files_that_cannot_be_estimated(self):
+        """Testing that multi-member gzipped files and files that could be
+        bigger than 4 GiB (ISIZE wraps around) are counted instead of
+        estimated"""
+        JunoHelpers = helper_functions.JunoHelpers()
+        reads = b''.join(b'@read%d\n%s\n+\n%s\n' % (read_num, b'ACGT' * 25, b'IIF#' * 25)
+                        for read_num in range(50000))
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            multi_member_file = pathlib.Path(tmp_dir).joinpath('multi_member.fastq.gz')
+            split = len(reads) // 3
+            multi_member_file.write_bytes(gzip.compress(reads[:split]) + gzip.compress(reads[split:]))
+            self.assertIsNone(JunoHelpers.estimate_gz_num_lines(multi_member_file))
+            self.assertTrue(
+                JunoHelpers.validate_file_has_min_lines(multi_member_file, min_num_lines=200000, approximate=True)
+                )
+            self.assertFalse(
+                JunoHelpers.validate_file_has_min_lines(multi_member_file, min_num_lines=200001, approximate=True)
+                )
+            gz_file = pathlib.Path(tmp_dir).joinpath('reads.fastq.gz')
+            gz_file.write_bytes(gzip.compress(reads))
+            self.assertIsNotNone(JunoHelpers.estimate_gz_num_lines(gz_file))
+            # A compression ratio that would make the file bigger than 4 GiB
+            JunoHelpers.gz_ratio_margin = 10**6
+            self.assertIsNone(JunoHelpers.estimate_gz_num_lines(gz_file))
+
+    def test_stage_file(self):
+        """Testing that files are staged in-process, that writable files are
+        never hard linked and that an existing destination is replaced"""
+        JunoHelpers = helper_functions.JunoHelpers()
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            source = pathlib.Path(tmp_dir).joinpath('source.txt')
+            destination = pathlib.Path(tmp_dir).joinpath('destination.txt')
+            make_non_empty_file(source)
+            make_non_empty_file(destination, content='old content')
+            with mock.patch('subprocess.Popen') as popen:
+                method = JunoHelpers.stage_file(source, destination)
+            popen.assert_not_called()
+            self.assertIn(method, ('reflink', 'copy'))
+            self.assertEqual(destination.read_text(), source.read_text())
+            self.assertNotEqual(destination.stat().st_ino, source.stat().st_ino)
+            # Changing the source does not change the staged file
+            make_non_empty_file(source, content='new content')
+            self.assertEqual(destination.read_text(), 'this\nfile\nhas\ncontents')
+            # Read-only files can be hard linked
+            source.chmod(0o444)
+            with mock.patch.object(helper_functions.fcntl, 'ioctl', side_effect=OSError(95, 'Not supported')):
+                method = JunoHelpers.stage_file(source, destination)
+            self.assertEqual(method, 'hardlink')
+            self.assertEqual(destination.stat().st_ino, source.stat().st_ino)
+            # Destination can be a directory
+            staged_dir = pathlib.Path(tmp_dir).joinpath('staged')
+            staged_dir.mkdir()
+            JunoHelpers.stage_file(source, staged_dir)
+            self.assertEqual(staged_dir.joinpath('source.txt').read_text(), 'new content')
+            self.assertEqual(sorted(os.listdir(tmp_dir)), ['destination.txt', 'source.txt', 'staged'])
+
+
+class TestCsvJunoHelpers(unittest.TestCase):
+    """Testing csv Helper Functions"""
+
+    csv_content = ("sample,genus,species,reads,coverage,contaminated,notes\n"
+                    "0012,salmonella,enterica,100,30.5,False,\n"
+                    "1234,escherichia,,200,NA,True,resequenced\n"
+                    "\n"
+                    "abc,listeria,monocytogenes,300,40,,\n")
+
+    def nan_to_none(self, table):
+        return {sample: {col: None if value != value else value for col, value in row.items()}
+                for sample, row in table.items()}
+
+    @unittest.skipIf(importlib.util.find_spec('pandas') is None, "pandas is not installed")
+    def test_read_csv_as_dict_same_as_pandas(self):
+        """Testing that the csv reader gives the same result as the pandas 
+        based reader it replaced"""
+        import pandas
+        JunoHelpers = helper_functions.JunoHelpers()
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            csv_file = pathlib.Path(tmp_dir).joinpath('metadata.csv')
+            make_non_empty_file(csv_file, content=self.csv_content)
+            expected_output = pandas.read_csv(csv_file, dtype={'sample': str})
+            expected_output = expected_output.set_index('sample').to_dict(orient='index')
+            output = JunoHelpers.read_csv_as_dict(csv_file)
+        self.assertEqual(self.nan_to_none(output), self.nan_to_none(expected_output))
+        for sample in output:
+            for col in output[sample]:
+                self.assertIsInstance(output[sample][col], type(expected_output[sample][col]))
+
+    def test_read_csv_as_dict_with_usecols_and_read_only(self):
+        """Testing that only the requested columns are kept and that the 
+        result can be read-only"""
+        JunoHelpers = helper_functions.JunoHelpers()
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            csv_file = pathlib.Path(tmp_dir).joinpath('metadata.csv')
+            make_non_empty_file(csv_file, content=self.csv_content)
+            output = JunoHelpers.read_csv_as_dict(csv_file, usecols=['sample', 'genus'], read_only=True)
+        self.assertEqual({sample: dict(row) for sample, row in output.items()},
+                        {'0012': {'genus': 'salmonella'},
+                        '1234': {'genus': 'escherichia'},
+                        'abc': {'genus': 'listeria'}})
+        with self.assertRaises(TypeError):
+            output['0012']['genus'] = 'shigella'
+
+
+class TestCondaJunoHelpers(unittest.TestCase):
+    """Testing Conda Helper Functions"""
+
+    def make_conda_meta_record(self, conda_prefix, name, version):
+        record = {'name': name, 'version': version, 'build': 'py_0', 'subdir': 'noarch',
+                'channel': 'https://conda.anaconda.org/bioconda/noarch'}
+        with open(conda_prefix.joinpath('conda-meta', f'{name}-{version}-py_0.json'), 'w') as file_:
+            json.dump(record, file_)
+
+    def test_conda_packages_are_read_from_conda_meta(self):
+        """Testing that the packages of a conda environment are read from the
+        conda-meta directory and cached until the directory changes"""
+        JunoHelpers = helper_functions.JunoHelpers()
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            conda_prefix = pathlib.Path(tmp_dir).joinpath('env')
+            conda_prefix.joinpath('conda-meta').mkdir(parents=True)
+            self.make_conda_meta_record(conda_prefix, 'snakemake', '6.2.1')
+            cache_dir = pathlib.Path(tmp_dir).joinpath('cache')
+            expected_packages = [{'name': 'snakemake', 'version': '6.2.1', 
+                                'build': 'py_0', 'channel': 'bioconda'}]
+            self.assertEqual(JunoHelpers.get_conda_packages(conda_prefix, cache_dir), expected_packages)
+            with mock.patch.object(JunoHelpers, 'read_conda_meta') as read_conda_meta:
+                self.assertEqual(JunoHelpers.get_conda_packages(conda_prefix, cache_dir), expected_packages)
+                read_conda_meta.assert_not_called()
+            self.make_conda_meta_record(conda_prefix, 'pandas', '1.3.2')
+            packages = JunoHelpers.get_conda_packages(conda_prefix, cache_dir)
+            self.assertEqual([package['name'] for package in packages], ['pandas', 'snakemake'])
+            self.assertIn('snakemake                        6.2.1',
+                        JunoHelpers.format_conda_packages(conda_prefix, packages))
+
 
 class TestTextJunoHelpers(unittest.TestCase):
     """Testing Helper Functions"""
@@ -115,6 +314,23 @@ class TestTextJunoHelpers(unittest.TestCase):
         self.assertIsInstance(JunoHelpers.get_commit_git(main_script_path), str)
         self.assertFalse(commit_available)
 
+    def test_git_info_read_without_calling_git(self):
+        """Testing that the URL and commit of a repository are read from the 
+        git directory (also with packed refs) without calling git"""
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            git = ['git', '-C', tmp_dir, '-c', 'user.name=juno', '-c', 'user.email=juno@example.org']
+            subprocess.run(git + ['init', '-q'], check=True)
+            subprocess.run(git + ['remote', 'add', 'origin', 'https://example.org/juno.git'], check=True)
+            subprocess.run(git + ['commit', '-q', '--allow-empty', '-m', 'test'], check=True)
+            expected_commit = subprocess.check_output(git + ['log', '-n', '1', '--pretty=format:"%H"']).decode()
+            JunoHelpers = helper_functions.JunoHelpers()
+            with mock.patch('subprocess.check_output', side_effect=AssertionError('git was called')):
+                self.assertEqual(JunoHelpers.get_repo_url(tmp_dir), 'https://example.org/juno.git')
+                self.assertEqual(JunoHelpers.get_commit_git(tmp_dir), expected_commit)
+            subprocess.run(git + ['pack-refs', '--all', '--prune'], check=True)
+            with mock.patch('subprocess.check_output', side_effect=AssertionError('git was called')):
+                self.assertEqual(JunoHelpers.get_commit_git(tmp_dir), expected_commit)
+
     def test_get_commit_git_from_non_git_repo(self):
         """Testing that the git commit function gives right output when no git repo"""
         JunoHelpers = helper_functions.JunoHelpers()
@@ -122,6 +338,14 @@ class TestTextJunoHelpers(unittest.TestCase):
         self.assertEqual(JunoHelpers.get_commit_git(os.path.expanduser('~')), 
                         'Not available. This might be because this folder is not a repository or it was downloaded manually instead of through the command line.')
 
+    def test_get_commit_git_from_invalid_git_file(self):
+        """Testing that a .git file without gitdir: line is not a git repo
+        (instead of raising an error)"""
+        JunoHelpers = helper_functions.JunoHelpers()
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            make_non_empty_file(pathlib.Path(tmp_dir).joinpath('.git'), content='not a git file')
+            self.assertEqual(JunoHelpers.get_commit_git(tmp_dir), JunoHelpers.git_not_available)
+
 
 class TestPipelineStartup(unittest.TestCase):
     """Testing the pipeline startup (generating dict with samples) from general
@@ -262,6 +486,81 @@ class TestPipelineStartup(unittest.TestCase):
         self.assertDictEqual(pipeline.sample_dict, expected_output)
         self.assertEqual(pipeline.juno_metadata, None)
 
+    def test_both_listed_in_one_pass(self):
+        """Testing that a flat input directory with fastq and fasta files is 
+        only listed once, that every file is validated once and that samples
+        without assembly are reported instead of crashing the merge"""
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            input_dir = pathlib.Path(tmp_dir)
+            for sample in ['sample1', 'sample2']:
+                make_non_empty_file(input_dir.joinpath(f'{sample}_R1.fastq'))
+                make_non_empty_file(input_dir.joinpath(f'{sample}_R2.fastq'))
+                make_non_empty_file(input_dir.joinpath(f'{sample}.fasta'))
+            make_non_empty_file(input_dir.joinpath('reference.fasta'))
+            discovery = 'base_juno_pipeline.sample_discovery.InputDiscovery'
+            pipeline = base_juno_pipeline.PipelineStartup(input_dir, 'both', min_num_lines=2)
+            scan_dir = base_juno_pipeline.InputDiscovery.scan_dir
+            with mock.patch(f'{discovery}.scan_dir', autospec=True, side_effect=scan_dir) as scan, \
+                    mock.patch(f'{discovery}.validate_file_has_min_lines', return_value=True) as validate:
+                pipeline.start_juno_pipeline()
+            self.assertEqual(scan.call_count, 1)
+            self.assertEqual(validate.call_count, 7)
+            self.assertDictEqual(pipeline.sample_dict,
+                                {sample: {'R1': str(input_dir.joinpath(f'{sample}_R1.fastq')),
+                                        'R2': str(input_dir.joinpath(f'{sample}_R2.fastq')),
+                                        'assembly': str(input_dir.joinpath(f'{sample}.fasta'))}
+                                for sample in ['sample1', 'sample2']})
+
+            input_dir.joinpath('sample2.fasta').unlink()
+            pipeline = base_juno_pipeline.PipelineStartup(input_dir, 'both')
+            with self.assertRaisesRegex(KeyError, 'The assembly is mising for sample sample2'):
+                pipeline.start_juno_pipeline()
+
+    def test_recursive_discovery(self):
+        """Testing that the samples of nested run directories are found, that
+        the depth limit and the include/exclude globs are applied and that 
+        samples found in more than one run (also with their R1 and R2 in
+        different runs) are reported"""
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            input_dir = pathlib.Path(tmp_dir)
+            sample_files = {'sampleA': 'run1', 'sampleB': 'run2', 
+                            'sampleC': 'run2/lane1', 'sampleD': 'undetermined'}
+            for sample, run_dir in sample_files.items():
+                input_dir.joinpath(run_dir).mkdir(parents=True, exist_ok=True)
+                for read in ['R1', 'R2']:
+                    make_non_empty_file(input_dir.joinpath(run_dir, f'{sample}_{read}.fastq.gz'))
+            # Symlink loops are only walked once
+            input_dir.joinpath('run1', 'loop').symlink_to(input_dir)
+
+            def find_samples(**kwargs):
+                pipeline = base_juno_pipeline.PipelineStartup(input_dir, 'fastq', recursive=True,
+                                                            max_workers=2, **kwargs)
+                pipeline.start_juno_pipeline()
+                return pipeline.sample_dict
+
+            sample_dict = find_samples()
+            self.assertEqual(sorted(sample_dict), ['sampleA', 'sampleB', 'sampleC', 'sampleD'])
+            self.assertEqual(sample_dict['sampleC']['R1'],
+                            str(input_dir.joinpath('run2', 'lane1', 'sampleC_R1.fastq.gz')))
+            self.assertEqual(sorted(find_samples(max_depth=1)), ['sampleA', 'sampleB', 'sampleD'])
+            self.assertEqual(sorted(find_samples(exclude=['undetermined'])), 
+                            ['sampleA', 'sampleB', 'sampleC'])
+            self.assertEqual(sorted(find_samples(include=['run2/*'])), ['sampleB', 'sampleC'])
+            with self.assertRaises(AssertionError):
+                base_juno_pipeline.PipelineStartup(input_dir, 'fastq', max_depth=1)
+
+            input_dir.joinpath('run3').mkdir()
+            for read in ['R1', 'R2']:
+                make_non_empty_file(input_dir.joinpath('run3', f'sampleA_{read}.fastq.gz'))
+            with self.assertRaisesRegex(ValueError, 'sampleA'):
+                find_samples()
+            self.assertIn('sampleA', find_samples(exclude=['run3']))
+            # Also if the reads of the sample are in different directories
+            input_dir.joinpath('run3', 'sampleA_R1.fastq.gz').unlink()
+            input_dir.joinpath('run1', 'sampleA_R2.fastq.gz').unlink()
+            with self.assertRaisesRegex(ValueError, 'sampleA'):
+                find_samples()
+
     def test_files_smaller_than_minlen(self):
         """Testing the pipeline startup fails if you set a min_num_lines 
         different than 0"""
@@ -321,6 +620,404 @@ class TestPipelineStartup(unittest.TestCase):
         with self.assertRaisesRegex(AssertionError, 'does not contain one or more of the expected column names'):
             test.get_metadata_from_csv_file(expected_colnames=['Sample', 'Genus'])
 
+    def test_max_workers_gives_same_sample_dict(self):
+        """Testing that validating the files in a thread pool gives the same
+        sample_dict as validating them one by one"""
+        serial_pipeline = base_juno_pipeline.PipelineStartup(
+            pathlib.Path('fake_dir_wsamples'), 'fastq', min_num_lines=2, max_workers=1
+        )
+        serial_pipeline.start_juno_pipeline()
+        parallel_pipeline = base_juno_pipeline.PipelineStartup(
+            pathlib.Path('fake_dir_wsamples'), 'fastq', min_num_lines=2, max_workers=4
+        )
+        parallel_pipeline.start_juno_pipeline()
+        self.assertDictEqual(serial_pipeline.sample_dict, parallel_pipeline.sample_dict)
+
+    def test_compact_sample_dict(self):
+        """Testing that the compact sample_dict (with Sample records) can be
+        used as the default sample_dict and is written as the same sample 
+        sheet"""
+        for input_dir, input_type in [('fake_dir_wsamples', 'fastq'), ('fake_dir_juno', 'both')]:
+            default_pipeline = base_juno_pipeline.PipelineStartup(pathlib.Path(input_dir), input_type)
+            default_pipeline.start_juno_pipeline()
+            compact_pipeline = base_juno_pipeline.PipelineStartup(pathlib.Path(input_dir), input_type,
+                                                                compact_sample_dict=True)
+            compact_pipeline.start_juno_pipeline()
+            self.assertDictEqual(compact_pipeline.sample_dict, default_pipeline.sample_dict)
+            for sample, sample_files in compact_pipeline.sample_dict.items():
+                self.assertIsInstance(sample_files, Sample)
+                self.assertFalse(hasattr(sample_files, '__dict__'))
+                self.assertEqual(sample_files['R1'], default_pipeline.sample_dict[sample]['R1'])
+            self.assertEqual(yaml.safe_dump(compact_pipeline.sample_dict),
+                            yaml.safe_dump(default_pipeline.sample_dict))
+            self.assertEqual(compact_pipeline.sample_input_sizes, default_pipeline.sample_input_sizes)
+        with self.assertRaises(KeyError):
+            sample_files['metadata'] = 'metadata.csv'
+
+    def test_fail_with_invalid_max_workers(self):
+        """Testing the pipeline startup fails if max_workers is not positive"""
+        with self.assertRaises(AssertionError):
+            base_juno_pipeline.PipelineStartup('fake_dir_wsamples', 'fastq', max_workers=0)
+
+    def test_cache_skips_unchanged_files(self):
+        """Testing that files that did not change since the previous run are
+        not read again when the cache is used and that the cache is not used
+        anymore for files that changed or were removed"""
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            input_dir = pathlib.Path(tmp_dir).joinpath('input')
+            input_dir.mkdir()
+            for sample in ['sample1', 'sample2']:
+                make_non_empty_file(input_dir.joinpath(f'{sample}_R1.fastq'))
+                make_non_empty_file(input_dir.joinpath(f'{sample}_R2.fastq'))
+            cache_file = pathlib.Path(tmp_dir).joinpath('cache.sqlite')
+            validator = 'base_juno_pipeline.sample_discovery.InputDiscovery.validate_file_has_min_lines'
+
+            def start_pipeline():
+                pipeline = base_juno_pipeline.PipelineStartup(input_dir, 'fastq', min_num_lines=2,
+                                                            use_cache=True, cache_file=cache_file)
+                with mock.patch(validator, return_value=True) as validate:
+                    pipeline.start_juno_pipeline()
+                return pipeline.sample_dict, validate.call_count
+
+            first_sample_dict, first_call_count = start_pipeline()
+            second_sample_dict, second_call_count = start_pipeline()
+            self.assertEqual(first_call_count, 4)
+            self.assertEqual(second_call_count, 0)
+            self.assertDictEqual(first_sample_dict, second_sample_dict)
+
+            make_non_empty_file(input_dir.joinpath('sample1_R1.fastq'), content='new\ncontent\nin\nfile\n')
+            input_dir.joinpath('sample2_R1.fastq').unlink()
+            input_dir.joinpath('sample2_R2.fastq').unlink()
+            third_sample_dict, third_call_count = start_pipeline()
+            self.assertEqual(third_call_count, 1)
+            self.assertEqual(list(third_sample_dict), ['sample1'])
+            with sqlite3.connect(str(cache_file)) as connection:
+                num_records = connection.execute('SELECT COUNT(*) FROM files').fetchone()[0]
+            self.assertEqual(num_records, 2)
+
+    def test_cache_keeps_filtered_files(self):
+        """Testing that the cache records of files that are left out by a
+        filter (e.g. still being written) or by the globs of a recursive walk
+        are kept and only the ones of removed files are deleted"""
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            input_dir = pathlib.Path(tmp_dir).joinpath('input')
+            input_dir.mkdir()
+            for sample in ['sample1', 'sample2']:
+                make_non_empty_file(input_dir.joinpath(f'{sample}_R1.fastq'))
+                make_non_empty_file(input_dir.joinpath(f'{sample}_R2.fastq'))
+            cache_file = pathlib.Path(tmp_dir).joinpath('cache.sqlite')
+
+            def get_cached_paths():
+                with sqlite3.connect(str(cache_file)) as connection:
+                    return sorted(pathlib.Path(row[0]).name for row in connection.execute('SELECT path FROM files'))
+
+            all_files = ['sample1_R1.fastq', 'sample1_R2.fastq', 'sample2_R1.fastq', 'sample2_R2.fastq']
+            for pipeline_kwargs in [{}, {'recursive': True}]:
+                cache_file.unlink(missing_ok=True)
+                pipeline = base_juno_pipeline.PipelineStartup(input_dir, 'fastq', use_cache=True,
+                                                            cache_file=cache_file, **pipeline_kwargs)
+                pipeline.find_samples()
+                self.assertEqual(get_cached_paths(), all_files)
+                pipeline.input_file_filter = lambda input_file: 'sample2' not in input_file.name
+                self.assertEqual(list(pipeline.find_samples()), ['sample1'])
+                self.assertEqual(get_cached_paths(), all_files)
+                pipeline.exclude = ['sample1_R2*']
+                pipeline.find_samples()
+                self.assertEqual(get_cached_paths(), all_files)
+            input_dir.joinpath('sample2_R2.fastq').unlink()
+            pipeline.input_file_filter = None
+            pipeline.exclude = None
+            pipeline.find_samples()
+            self.assertEqual(get_cached_paths(), ['sample1_R1.fastq', 'sample1_R2.fastq', 'sample2_R1.fastq'])
+
+    def test_incremental_sample_dict(self):
+        """Testing that only the samples that are new or changed since the 
+        previous run are kept when a previous sample sheet is given"""
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            input_dir = pathlib.Path(tmp_dir).joinpath('input')
+            input_dir.mkdir()
+            for sample in ['sample1', 'sample2']:
+                make_non_empty_file(input_dir.joinpath(f'{sample}_R1.fastq'))
+                make_non_empty_file(input_dir.joinpath(f'{sample}_R2.fastq'))
+            previous_sample_sheet = pathlib.Path(tmp_dir).joinpath('sample_sheet.yaml')
+            with open(previous_sample_sheet, 'w') as file_:
+                yaml.dump({'sample1': {'R1': str(input_dir.joinpath('sample1_R1.fastq')),
+                                        'R2': str(input_dir.joinpath('sample1_R2.fastq'))}},
+                            file_)
+            make_non_empty_file(input_dir.joinpath('sample3_R1.fastq'))
+            make_non_empty_file(input_dir.joinpath('sample3_R2.fastq'))
+            os.utime(previous_sample_sheet, ns=(0, 0))
+            for sample in ['sample1', 'sample2']:
+                for read in ['R1', 'R2']:
+                    os.utime(input_dir.joinpath(f'{sample}_{read}.fastq'), ns=(0, 0))
+
+            pipeline = base_juno_pipeline.PipelineStartup(input_dir, 'fastq',
+                                                        previous_sample_sheet=previous_sample_sheet)
+            pipeline.start_juno_pipeline()
+            self.assertEqual(sorted(pipeline.sample_dict), ['sample2', 'sample3'])
+            self.assertEqual(sorted(pipeline.full_sample_dict), ['sample1', 'sample2', 'sample3'])
+
+            os.utime(input_dir.joinpath('sample1_R2.fastq'))
+            pipeline.start_juno_pipeline()
+            self.assertEqual(sorted(pipeline.sample_dict), ['sample1', 'sample2', 'sample3'])
+
+    def test_incremental_runs_use_all_processed_samples(self):
+        """Testing that the samples of all the previous runs with the same
+        output directory are skipped (not only the ones of the last run)"""
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            tmp_dir = pathlib.Path(tmp_dir)
+            input_dir = tmp_dir.joinpath('input')
+            input_dir.mkdir()
+            run = base_juno_pipeline.RunSnakemake(pipeline_name='fake_pipeline',
+                                                    pipeline_version='0.1',
+                                                    output_dir=tmp_dir.joinpath('output'),
+                                                    workdir=main_script_path,
+                                                    sample_sheet=tmp_dir.joinpath('sample_sheet.yaml'),
+                                                    user_parameters='user_parameters.yaml',
+                                                    fixed_parameters='fixed_parameters.yaml')
+            run.path_to_audit.mkdir(parents=True)
+            audit_sample_sheet = run.path_to_audit.joinpath('sample_sheet.yaml')
+            processed_samples = []
+            for new_sample in ['sample1', 'sample2', 'sample3']:
+                for read in ['R1', 'R2']:
+                    make_non_empty_file(input_dir.joinpath(f'{new_sample}_{read}.fastq'))
+                    os.utime(input_dir.joinpath(f'{new_sample}_{read}.fastq'), ns=(0, 0))
+                pipeline = base_juno_pipeline.PipelineStartup(input_dir, 'fastq',
+                                                            previous_sample_sheet=audit_sample_sheet)
+                pipeline.start_juno_pipeline()
+                processed_samples.append(sorted(pipeline.sample_dict))
+                write_sample_sheet(pipeline.sample_dict, run.sample_sheet)
+                run.copy_to_audit_trail(run.sample_sheet, audit_sample_sheet)
+                run.update_processed_samples(run.path_to_audit.joinpath('processed_samples.yaml'))
+            self.assertEqual(processed_samples, [['sample1'], ['sample2'], ['sample3']])
+            self.assertEqual(sorted(read_sample_sheet(run.path_to_audit.joinpath('processed_samples.yaml'))),
+                            ['sample1', 'sample2', 'sample3'])
+
+    def test_samples_of_failed_runs_are_not_processed(self):
+        """Testing that the samples of a run that failed or that only 
+        unlocked the working directory are picked up by the next incremental
+        run"""
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            tmp_dir = pathlib.Path(tmp_dir)
+            input_dir = tmp_dir.joinpath('input')
+            input_dir.mkdir()
+            for read in ['R1', 'R2']:
+                make_non_empty_file(input_dir.joinpath(f'sample1_{read}.fastq'))
+                os.utime(input_dir.joinpath(f'sample1_{read}.fastq'), ns=(0, 0))
+            user_parameters = tmp_dir.joinpath('user_parameters.yaml')
+            make_non_empty_file(user_parameters, content='fake_parameter: null')
+            run = base_juno_pipeline.RunSnakemake(pipeline_name='fake_pipeline',
+                                                    pipeline_version='0.1',
+                                                    output_dir=tmp_dir.joinpath('output'),
+                                                    workdir=tmp_dir,
+                                                    sample_sheet=tmp_dir.joinpath('sample_sheet.yaml'),
+                                                    user_parameters=user_parameters,
+                                                    fixed_parameters=user_parameters,
+                                                    local=True)
+
+            def get_incremental_samples():
+                pipeline = base_juno_pipeline.PipelineStartup(input_dir, 'fastq',
+                                                            previous_sample_sheet=run.get_audit_sample_sheet())
+                pipeline.start_juno_pipeline()
+                write_sample_sheet(pipeline.sample_dict, run.sample_sheet)
+                return sorted(pipeline.sample_dict)
+
+            self.assertEqual(get_incremental_samples(), ['sample1'])
+            with mock.patch('snakemake.snakemake', return_value=False):
+                with self.assertRaises(AssertionError):
+                    run.run_snakemake()
+            self.assertEqual(get_incremental_samples(), ['sample1'])
+            run.unlock = True
+            with mock.patch('snakemake.snakemake', return_value=True):
+                self.assertTrue(run.run_snakemake())
+            self.assertEqual(get_incremental_samples(), ['sample1'])
+            run.unlock = False
+            with mock.patch('snakemake.snakemake', return_value=True):
+                self.assertTrue(run.run_snakemake())
+            self.assertEqual(get_incremental_samples(), [])
+
+
+class TestFilenameClassifiers(unittest.TestCase):
+    """Testing the classification of the input files by their name"""
+
+    def test_fastq_names(self):
+        """Testing that Illumina names are parsed correctly and other names
+        as before"""
+        classifier = FastqClassifier()
+        expected_output = {'12345_S182_L001_R1_001.fastq.gz': ('12345_S182_L001', 'R1'),
+                            '12345_S182_L001_R2_001.fastq.gz': ('12345_S182_L001', 'R2'),
+                            '12345_S182_L555_R1_001.fastq.gz': ('12345', 'R1'),
+                            'RIVM_1_S1_L004_R2_001.fq': ('RIVM_1_S1_L004', 'R2'),
+                            'RIVM_1_S1_R2_001.fq': ('RIVM_1', 'R2'),
+                            'sample_S12_R1_001.fastq': ('sample', 'R1'),
+                            'sample1_R1.fastq': ('sample1', 'R1'),
+                            'sample2_R2_filt.fq.gz': ('sample2', 'R2'),
+                            'sample3_1.fq': ('sample3', 'R1'),
+                            '1234_S001_PE_R1.fastq.gz': ('1234', 'R1'),
+                            'sample1_R1_fastqc.html': None,
+                            'sample1_R1.bam': None,
+                            'sample1.fasta': None}
+        for file_name, classification in expected_output.items():
+            self.assertEqual(classifier.classify(file_name), classification, file_name)
+        # Illumina names that the general regular expression parsed correctly
+        # keep their sample name
+        for file_name in ['12345_S1_L001_R1_001.fastq.gz', '12345_S12_L002_R2_001.fastq.gz', 
+                            '12345_S1_L555_R1_001.fastq.gz', '12345_S12_L555_R2_001.fastq.gz',
+                            '12345_S10_R1_001.fastq.gz', 'sample_a_S3_L004_R2_001.fq']:
+            self.assertEqual(classifier.classify(file_name), classifier.parse(file_name), file_name)
+
+    def test_lanes_are_different_samples(self):
+        """Testing that the files of different lanes of a sample are not
+        taken for the same sample (so no lane is lost)"""
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            for lane in ['L001', 'L002']:
+                for read in ['R1', 'R2']:
+                    make_non_empty_file(pathlib.Path(tmp_dir).joinpath(f'S_S1_{lane}_{read}_001.fastq'))
+            pipeline = base_juno_pipeline.PipelineStartup(tmp_dir, 'fastq')
+            pipeline.start_juno_pipeline()
+            self.assertDictEqual(pipeline.sample_dict,
+                                {f'S_S1_{lane}': {read: str(pathlib.Path(tmp_dir).joinpath(f'S_S1_{lane}_{read}_001.fastq'))
+                                                for read in ['R1', 'R2']}
+                                for lane in ['L001', 'L002']})
+
+    def test_fasta_names(self):
+        """Testing that only files ending with .fasta are accepted as 
+        assemblies"""
+        classifier = FastaClassifier()
+        self.assertEqual(classifier.classify('sample1.fasta'), ('sample1', 'assembly'))
+        self.assertIsNone(classifier.classify('samplefasta'))
+        self.assertIsNone(classifier.classify('sample1.fasta.fai'))
+        self.assertIsNone(classifier.classify('.fasta'))
+
+    def test_custom_naming_scheme(self):
+        """Testing that a pipeline can use its own naming scheme"""
+        classifier = RegexClassifier('dotted_fastq', r'(?P<sample>[^.]+)\.(?P<read>[12])\.fq',
+                                    ['.fq'], read_names={'1': 'R1', '2': 'R2'})
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            for read in ['1', '2']:
+                make_non_empty_file(pathlib.Path(tmp_dir).joinpath(f'sample1.{read}.fq'))
+            pipeline = base_juno_pipeline.PipelineStartup(tmp_dir, 'fastq',
+                                                        naming_schemes={'fastq': classifier})
+            pipeline.start_juno_pipeline()
+            self.assertDictEqual(pipeline.sample_dict,
+                                {'sample1': {'R1': str(pathlib.Path(tmp_dir).joinpath('sample1.1.fq')),
+                                            'R2': str(pathlib.Path(tmp_dir).joinpath('sample1.2.fq'))}})
+        with self.assertRaises(AssertionError):
+            get_classifier('unknown_scheme')
+
+
+class FakeRun(helper_functions.JunoHelpers):
+    """Run that only writes the names of its samples (and can be slow)"""
+
+    def __init__(self, sample_dict, output_dir, seconds=0):
+        self.sample_dict = sample_dict
+        self.output_dir = output_dir
+        self.seconds = seconds
+
+    def run_snakemake(self):
+        time.sleep(self.seconds)
+        with open(self.output_dir.joinpath('samples.json'), 'w') as file_:
+            json.dump(sorted(self.sample_dict), file_)
+        return True
+
+
+class TestInputWatcher(unittest.TestCase):
+    """Testing the watch mode that starts runs for the samples that are 
+    ready"""
+
+    def test_runs_for_ready_samples(self):
+        """Testing that only complete samples with files that did not change
+        during the debounce window are run, that they are run only once and
+        that no more than max_concurrent_runs runs are started"""
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            input_dir = pathlib.Path(tmp_dir).joinpath('input')
+            input_dir.mkdir()
+            for read in ['R1', 'R2']:
+                make_non_empty_file(input_dir.joinpath(f'sample1_{read}.fastq'))
+                os.utime(input_dir.joinpath(f'sample1_{read}.fastq'), ns=(0, 0))
+            make_non_empty_file(input_dir.joinpath('sample2_R1.fastq'))
+            os.utime(input_dir.joinpath('sample2_R1.fastq'), ns=(0, 0))
+            output_dir = pathlib.Path(tmp_dir).joinpath('output')
+            state_file = pathlib.Path(tmp_dir).joinpath('watch_state.json')
+            run_seconds = {'value': 0}
+
+            def make_run(sample_dict, run_name):
+                run_dir = output_dir.joinpath(run_name)
+                run_dir.mkdir(parents=True)
+                return FakeRun(sample_dict, run_dir, seconds=run_seconds['value'])
+
+            def run_samples(watcher):
+                return [json.load(open(output_dir.joinpath(run['name'], 'samples.json')))
+                        for run in watcher.runs]
+
+            pipeline = base_juno_pipeline.PipelineStartup(input_dir, 'fastq', min_num_lines=2)
+            watcher = InputWatcher(pipeline, make_run, poll_interval=0.1, debounce=0.5,
+                                    state_file=state_file)
+            # Old files (e.g. copied with cp -p) are also not used until they
+            # did not change in two polls
+            self.assertIsNone(watcher.poll())
+            time.sleep(0.6)
+            self.assertIsNotNone(watcher.poll())
+            watcher.wait_for_runs()
+            self.assertEqual(run_samples(watcher), [['sample1']])
+            self.assertTrue(watcher.runs[0]['successful'])
+
+            # A new file is not used until it stopped changing
+            make_non_empty_file(input_dir.joinpath('sample2_R2.fastq'))
+            self.assertIsNone(watcher.poll())
+            time.sleep(0.6)
+            run_seconds['value'] = 3
+            self.assertIsNotNone(watcher.poll())
+            # No second run while the first one is running
+            for read in ['R1', 'R2']:
+                make_non_empty_file(input_dir.joinpath(f'sample3_{read}.fastq'))
+                os.utime(input_dir.joinpath(f'sample3_{read}.fastq'), ns=(0, 0))
+            self.assertIsNone(watcher.poll())
+            time.sleep(0.6)
+            self.assertIsNone(watcher.poll())
+            self.assertEqual(watcher.num_running_runs(), 1)
+            run_seconds['value'] = 0
+            # watch waits for the running run before returning
+            watcher.watch(max_polls=1)
+            self.assertEqual(watcher.num_running_runs(), 0)
+            watcher.watch(max_polls=1)
+            self.assertEqual(run_samples(watcher), [['sample1'], ['sample2'], ['sample3']])
+            self.assertIsNone(watcher.poll())
+
+            # The samples that were run are not run again by a new watcher
+            new_watcher = InputWatcher(base_juno_pipeline.PipelineStartup(input_dir, 'fastq', min_num_lines=2),
+                                        make_run, poll_interval=0.1, debounce=0.5, state_file=state_file)
+            self.assertIsNone(new_watcher.poll())
+            os.utime(input_dir.joinpath('sample1_R1.fastq'), ns=(10**9, 10**9))
+            self.assertIsNone(new_watcher.poll())
+            time.sleep(0.6)
+            self.assertIsNotNone(new_watcher.poll())
+            new_watcher.wait_for_runs()
+            self.assertEqual(run_samples(new_watcher), [['sample1']])
+
+    def test_errors_do_not_stop_watching(self):
+        """Testing that an error while polling (or a corrupt input file) 
+        does not stop the watch mode"""
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            input_dir = pathlib.Path(tmp_dir).joinpath('input')
+            input_dir.mkdir()
+            with gzip.open(input_dir.joinpath('sample1_R2.fastq.gz'), 'wb') as file_:
+                file_.write(b'@read\nACGT\n+\nIIII\n' * 100)
+            input_dir.joinpath('sample1_R1.fastq.gz').write_bytes(
+                input_dir.joinpath('sample1_R2.fastq.gz').read_bytes()[:20]
+            )
+            for read in ['R1', 'R2']:
+                os.utime(input_dir.joinpath(f'sample1_{read}.fastq.gz'), ns=(0, 0))
+            made_runs = []
+            pipeline = base_juno_pipeline.PipelineStartup(input_dir, 'fastq', min_num_lines=4)
+            watcher = InputWatcher(pipeline, lambda sample_dict, run_name: made_runs.append(sample_dict),
+                                    poll_interval=0.1, debounce=0)
+            # The truncated file is not valid, so the sample is not complete
+            self.assertEqual(watcher.watch(max_polls=1), [])
+            with mock.patch.object(pipeline, 'find_samples', side_effect=FileNotFoundError('removed')):
+                self.assertEqual(watcher.watch(max_polls=2), [])
+        self.assertEqual(made_runs, [])
+
 
 class TestRunSnakemake(unittest.TestCase):
     """Testing the RunSnakemake class. At least testing that it is constructed
@@ -410,6 +1107,541 @@ class TestRunSnakemake(unittest.TestCase):
                         repo_url_in_audit_trail = True
             self.assertTrue(repo_url_in_audit_trail)
 
+    def test_audit_trail_in_background(self):
+        """Testing that the audit trail can be produced in the background and
+        that it is complete after waiting for it"""
+        output_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(output_dir.cleanup)
+        fake_run = base_juno_pipeline.RunSnakemake(pipeline_name='fake_pipeline',
+                                                    pipeline_version='0.1',
+                                                    output_dir=output_dir.name,
+                                                    workdir=main_script_path,
+                                                    sample_sheet='sample_sheet.yaml',
+                                                    user_parameters='user_parameters.yaml',
+                                                    fixed_parameters='fixed_parameters.yaml')
+        fake_run.path_to_audit.mkdir(parents=True, exist_ok=True)
+        audit_files = fake_run.generate_audit_trail(wait=False)
+        fake_run.wait_for_audit_trail()
+        for audit_file in audit_files:
+            self.assertTrue(audit_file.is_file(), audit_file)
+
+    def test_input_checksums_in_audit_trail(self):
+        """Testing that the checksums of the input files are stored in the 
+        audit trail and that unchanged files are not checksummed again"""
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            tmp_dir = pathlib.Path(tmp_dir)
+            input_files = {}
+            for read in ['R1', 'R2']:
+                input_files[read] = tmp_dir.joinpath(f'sample1_{read}.fastq.gz')
+                with gzip.open(input_files[read], 'wt') as file_:
+                    file_.write(f'@read\nACGT{read}\n+\nIIII\n' * 1000)
+            sample_sheet = tmp_dir.joinpath('sample_sheet.yaml')
+            with open(sample_sheet, 'w') as file_:
+                yaml.dump({'sample1': {read: str(file_path) for read, file_path in input_files.items()}}, file_)
+            fake_run = base_juno_pipeline.RunSnakemake(pipeline_name='fake_pipeline',
+                                                        pipeline_version='0.1',
+                                                        output_dir=tmp_dir.joinpath('output'),
+                                                        workdir=main_script_path,
+                                                        sample_sheet=sample_sheet,
+                                                        user_parameters='user_parameters.yaml',
+                                                        fixed_parameters='fixed_parameters.yaml',
+                                                        input_checksums=True,
+                                                        checksum_cache_file=tmp_dir.joinpath('checksums.sqlite'))
+            fake_run.path_to_audit.mkdir(parents=True, exist_ok=True)
+            audit_files = fake_run.generate_audit_trail()
+            checksums_file = fake_run.path_to_audit.joinpath('input_checksums.yaml')
+            self.assertIn(checksums_file, audit_files)
+            with open(checksums_file) as file_:
+                checksums = yaml.safe_load(file_)
+            for read, file_path in input_files.items():
+                self.assertEqual(checksums['sample1'][read]['sha256'], 
+                                hashlib.sha256(file_path.read_bytes()).hexdigest())
+                self.assertEqual(checksums['sample1'][read]['size'], file_path.stat().st_size)
+            # Only the modified file is checksummed again
+            with gzip.open(input_files['R2'], 'at') as file_:
+                file_.write('@read\nACGT\n+\nIIII\n')
+            with mock.patch('base_juno_pipeline.input_checksums.InputChecksums.get_file_digest', 
+                            autospec=True, 
+                            side_effect=helper_functions.FileHelpers.get_file_digest) as get_file_digest:
+                fake_run.generate_audit_trail()
+            self.assertEqual([call.args[1] for call in get_file_digest.call_args_list], 
+                            [os.path.abspath(input_files['R2'])])
+            with open(checksums_file) as file_:
+                checksums = yaml.safe_load(file_)
+            self.assertEqual(checksums['sample1']['R2']['sha256'], 
+                            hashlib.sha256(input_files['R2'].read_bytes()).hexdigest())
+
+    def test_sample_sheet_formats(self):
+        """Testing that sample sheets can be written and read in all formats 
+        and that the format is passed to the pipeline"""
+        output_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(output_dir.cleanup)
+        sample_dict = {'sample1': Sample('input', R1='input/sample1_R1.fastq.gz', 
+                                        R2='input/sample1_R2.fastq.gz'),
+                        'sample2': {'assembly': 'input/sample2.fasta'}}
+        formats = ['yaml', 'json']
+        if importlib.util.find_spec('msgpack') is not None:
+            formats.append('msgpack')
+        for sample_sheet_format in formats:
+            sample_sheet = pathlib.Path(output_dir.name).joinpath(
+                get_sample_sheet_name('sample_sheet', sample_sheet_format)
+            )
+            self.assertEqual(write_sample_sheet(sample_dict, sample_sheet), sample_sheet_format)
+            self.assertEqual(read_sample_sheet(sample_sheet), sample_dict)
+        with open(pathlib.Path(output_dir.name).joinpath('sample_sheet.yaml')) as file_:
+            self.assertEqual(yaml.safe_load(file_), sample_dict)
+
+        fake_run = base_juno_pipeline.RunSnakemake(pipeline_name='fake_pipeline',
+                                                    pipeline_version='0.1',
+                                                    output_dir=output_dir.name,
+                                                    workdir=main_script_path,
+                                                    sample_sheet=sample_sheet.with_suffix('.json'),
+                                                    user_parameters='user_parameters.yaml',
+                                                    fixed_parameters=os.path.abspath('fixed_parameters.yaml'),
+                                                    snakefile=os.path.join(main_script_path, 'tests', 'Snakefile'),
+                                                    local=True,
+                                                    useconda=False,
+                                                    usesingularity=False)
+        self.assertEqual(fake_run.sample_sheet_format, 'json')
+        with mock.patch('snakemake.snakemake', return_value=True) as snakemake:
+            self.assertTrue(fake_run.run_snakemake())
+        self.assertEqual(snakemake.call_args.kwargs['config']['sample_sheet_format'], 'json')
+        self.assertTrue(fake_run.path_to_audit.joinpath('sample_sheet.json').is_file())
+        self.assertEqual(fake_run.get_sample_input_sizes(), {'sample1': 0, 'sample2': 0})
+
+    def test_audit_trail_step_times_out(self):
+        """Testing that a step of the audit trail that takes longer than the
+        audit_timeout makes the audit trail fail and that the git and conda
+        commands are killed after it"""
+        output_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(output_dir.cleanup)
+        fake_run = base_juno_pipeline.RunSnakemake(pipeline_name='fake_pipeline',
+                                                    pipeline_version='0.1',
+                                                    output_dir=output_dir.name,
+                                                    workdir=main_script_path,
+                                                    sample_sheet='sample_sheet.yaml',
+                                                    user_parameters='user_parameters.yaml',
+                                                    fixed_parameters='fixed_parameters.yaml',
+                                                    audit_timeout=0.5)
+        fake_run.path_to_audit.mkdir(parents=True, exist_ok=True)
+        with mock.patch.object(fake_run, 'get_conda_audit', side_effect=lambda conda_file: time.sleep(2)):
+            with self.assertRaisesRegex(TimeoutError, 'log_conda.txt'):
+                fake_run.generate_audit_trail()
+        with mock.patch.object(fake_run, 'get_repo_url', return_value='url') as get_repo_url, \
+                mock.patch.object(fake_run, 'get_commit_git', return_value='commit') as get_commit_git:
+            fake_run.get_git_audit(fake_run.path_to_audit.joinpath('log_git.yaml'))
+        self.assertEqual(get_repo_url.call_args.kwargs['timeout'], 0.5)
+        self.assertEqual(get_commit_git.call_args.kwargs['timeout'], 0.5)
+        with mock.patch.object(fake_run, 'get_conda_prefix', return_value=None), \
+                mock.patch('subprocess.check_output', return_value=b'packages') as check_output:
+            fake_run.get_conda_audit(fake_run.path_to_audit.joinpath('log_conda.txt'))
+        self.assertEqual(check_output.call_args.kwargs['timeout'], 0.5)
+
+    def test_timings_in_audit_trail(self):
+        """Testing that the timings of the phases of the pipeline startup and 
+        the snakemake run are written to the audit trail and passed to the 
+        hook"""
+        hook_records = []
+        timer = PhaseTimer(hook=hook_records.append)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            tmp_dir = pathlib.Path(tmp_dir)
+            input_dir = tmp_dir.joinpath('input')
+            input_dir.mkdir()
+            make_non_empty_file(input_dir.joinpath('sample1_R1.fastq'))
+            make_non_empty_file(input_dir.joinpath('sample1_R2.fastq'))
+            pipeline = base_juno_pipeline.PipelineStartup(input_dir, 'fastq', timer=timer)
+            pipeline.start_juno_pipeline()
+            output_dir = tmp_dir.joinpath('output')
+            user_parameters = tmp_dir.joinpath('user_parameters.yaml')
+            make_non_empty_file(user_parameters, content=f'output_dir: {output_dir}')
+            sample_sheet = tmp_dir.joinpath('sample_sheet.yaml')
+            with open(sample_sheet, 'w') as file_:
+                yaml.dump(pipeline.sample_dict, file_)
+            fake_run = base_juno_pipeline.RunSnakemake(pipeline_name='fake_pipeline',
+                                                        pipeline_version='0.1',
+                                                        output_dir=output_dir,
+                                                        workdir=tmp_dir,
+                                                        sample_sheet=sample_sheet,
+                                                        user_parameters=user_parameters,
+                                                        fixed_parameters=os.path.abspath('fixed_parameters.yaml'),
+                                                        snakefile=os.path.join(main_script_path, 'tests', 'Snakefile'),
+                                                        local=True,
+                                                        useconda=False,
+                                                        usesingularity=False,
+                                                        timer=timer)
+            self.assertTrue(fake_run.run_snakemake())
+            with open(output_dir.joinpath('audit_trail', 'log_timings.yaml')) as file_:
+                timings = yaml.safe_load(file_)['phases']
+        phases = [record['phase'] for record in timings]
+        for phase in ['input_discovery', 'audit_trail', 'snakemake_dag', 'snakemake_jobs']:
+            self.assertIn(phase, phases)
+        self.assertEqual(hook_records, timings)
+        for record in timings:
+            self.assertGreaterEqual(record['wall_time_s'], 0)
+            self.assertGreater(record['peak_rss_mb'], 0)
+
+    def test_job_batches(self):
+        """Testing that the jobs of every rule (except the default target and
+        the local rules) are grouped by batch size or by target runtime, also
+        for rules in included files (before the target rule) and rules made
+        with 'use rule'"""
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            tmp_dir = pathlib.Path(tmp_dir)
+            make_non_empty_file(tmp_dir.joinpath('extra_rules.smk'),
+                                content='rule third_rule:\n    shell: "true"\n\n'
+                                        'rule local_rule:\n    shell: "true"')
+            snakefile = tmp_dir.joinpath('Snakefile')
+            with open(os.path.join(main_script_path, 'tests', 'Snakefile')) as file_:
+                make_non_empty_file(snakefile, 
+                                    content='include: "extra_rules.smk"\nlocalrules: local_rule\n\n' 
+                                            + file_.read() 
+                                            + '\nuse rule second_rule as copied_rule with:\n'
+                                            + '    output: output_dir + "/copied_result.txt"\n')
+            fake_run = base_juno_pipeline.RunSnakemake(pipeline_name='fake_pipeline',
+                                                        pipeline_version='0.1',
+                                                        output_dir=tmp_dir.joinpath('output'),
+                                                        workdir=tmp_dir,
+                                                        snakefile=snakefile,
+                                                        batch_jobs=True,
+                                                        batch_size=5,
+                                                        batch_target_runtime=60,
+                                                        batch_job_runtimes={'first_rule': 2, 'third_rule': 120})
+            self.assertEqual(fake_run.get_snakefile_rules(),
+                            ['third_rule', 'local_rule', 'all', 'first_rule', 'second_rule', 'copied_rule'])
+            overwrite_groups, group_components = fake_run.make_job_batches()
+            # A rule marked as default target is the target
+            make_non_empty_file(tmp_dir.joinpath('extra_rules.smk'),
+                                content='rule third_rule:\n    default_target: True\n    shell: "true"')
+            self.assertEqual(fake_run.parse_snakefile()['default_target'], 'third_rule')
+        self.assertEqual(overwrite_groups, {'third_rule': 'batch_third_rule',
+                                            'first_rule': 'batch_first_rule',
+                                            'second_rule': 'batch_second_rule',
+                                            'copied_rule': 'batch_copied_rule'})
+        self.assertEqual(group_components, {'batch_third_rule': 1,
+                                            'batch_first_rule': 30,
+                                            'batch_second_rule': 5,
+                                            'batch_copied_rule': 5})
+
+    def test_cluster_executors(self):
+        """Testing that every cluster backend gives its own submission command 
+        and the limits to submit jobs to snakemake"""
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            for executor, submit_command in [('lsf', 'bsub'), ('slurm', 'sbatch')]:
+                fake_run = base_juno_pipeline.RunSnakemake(pipeline_name='fake_pipeline',
+                                                            pipeline_version='0.1',
+                                                            output_dir=tmp_dir,
+                                                            workdir=tmp_dir,
+                                                            executor=executor,
+                                                            max_submissions_per_second=5,
+                                                            max_jobs=20)
+                snakemake_kwargs = fake_run.get_cluster_executor().get_snakemake_kwargs()
+                self.assertIn(' wrap ', snakemake_kwargs['cluster'])
+                self.assertIn(f' 5 {submit_command} ', snakemake_kwargs['cluster'])
+                self.assertIn(str(pathlib.Path(tmp_dir, 'log', 'cluster')), snakemake_kwargs['cluster'])
+                self.assertEqual(snakemake_kwargs['nodes'], 20)
+        with self.assertRaises(AssertionError):
+            fake_run = base_juno_pipeline.RunSnakemake(pipeline_name='fake_pipeline',
+                                                        pipeline_version='0.1',
+                                                        output_dir='fake_output_dir',
+                                                        workdir=main_script_path,
+                                                        executor='sge')
+            fake_run.get_cluster_executor()
+
+    def test_cluster_status_is_cached(self):
+        """Testing that the state of all the jobs is asked to the scheduler
+        at once (using a fake bjobs) and reused until the cache expires"""
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            tmp_dir = pathlib.Path(tmp_dir)
+            bin_dir = tmp_dir.joinpath('bin')
+            bin_dir.mkdir()
+            fake_bjobs = bin_dir.joinpath('bjobs')
+            make_non_empty_file(fake_bjobs,
+                                content=f'#!/bin/sh\necho called >> {tmp_dir}/bjobs_calls\n'
+                                        'printf "101 DONE\\n102 EXIT\\n103 RUN\\n104 PEND\\n"\n')
+            fake_bjobs.chmod(0o755)
+            fake_run = base_juno_pipeline.RunSnakemake(pipeline_name='fake_pipeline',
+                                                        pipeline_version='0.1',
+                                                        output_dir=tmp_dir,
+                                                        workdir=tmp_dir,
+                                                        status_cache_ttl=60)
+            executor = fake_run.get_cluster_executor()
+            self.assertIn(' status lsf ', executor.get_snakemake_kwargs()['cluster_status'])
+            with mock.patch.dict(os.environ, {'PATH': f'{bin_dir}:{os.environ["PATH"]}'}):
+                states = [executor.get_job_state(job_id) for job_id in 
+                            ['Job <101> is submitted to queue <bio>.', '102', '103', '104', '105']]
+                with open(tmp_dir.joinpath('bjobs_calls')) as file_:
+                    self.assertEqual(len(file_.readlines()), 1)
+                executor.status_cache_ttl = 0
+                time.sleep(0.01)
+                executor.get_job_state('101')
+                with open(tmp_dir.joinpath('bjobs_calls')) as file_:
+                    self.assertEqual(len(file_.readlines()), 2)
+        self.assertEqual(states, ['success', 'failed', 'running', 'running', 'running'])
+
+    def test_cluster_status_survives_scheduler_errors(self):
+        """Testing that the cached states are used (and unknown jobs are
+        running) when the scheduler cannot be asked for the states"""
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            tmp_dir = pathlib.Path(tmp_dir)
+            bin_dir = tmp_dir.joinpath('bin')
+            bin_dir.mkdir()
+            fake_bjobs = bin_dir.joinpath('bjobs')
+            make_non_empty_file(fake_bjobs, content='#!/bin/sh\nprintf "101 DONE\\n102 RUN\\n"\n')
+            fake_bjobs.chmod(0o755)
+            executor = get_executor('lsf', log_dir=tmp_dir.joinpath('log'), status_cache_ttl=0)
+            with mock.patch.dict(os.environ, {'PATH': f'{bin_dir}:{os.environ["PATH"]}'}):
+                self.assertEqual(executor.get_job_state('101'), 'success')
+                make_non_empty_file(fake_bjobs, content='#!/bin/sh\necho "LSF is down" >&2\nexit 255\n')
+                time.sleep(0.01)
+                with mock.patch('sys.stderr'):
+                    states = [executor.get_job_state(job_id) for job_id in ['101', '102', '103']]
+            self.assertEqual(states, ['success', 'running', 'running'])
+            with mock.patch('subprocess.check_output',
+                            side_effect=subprocess.TimeoutExpired('bjobs', 60)), mock.patch('sys.stderr'):
+                self.assertEqual(executor.get_job_state('101'), 'success')
+
+    # Snakemake checks the status of cluster jobs every second (instead of 
+    # every 10 seconds) when running in CI
+    @mock.patch.dict(os.environ, {'CI': 'true'})
+    def test_local_process_executor_throttles_submissions(self):
+        """Testing that the jobs sent through the local stand-in of a cluster
+        are submitted with the maximum submission rate"""
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            tmp_dir = pathlib.Path(tmp_dir)
+            output_dir = tmp_dir.joinpath('output')
+            user_parameters = tmp_dir.joinpath('user_parameters.yaml')
+            make_non_empty_file(user_parameters, content=f'output_dir: {output_dir}')
+            sample_sheet = tmp_dir.joinpath('sample_sheet.yaml')
+            make_non_empty_file(sample_sheet, content='sample1: {}')
+            fake_run = base_juno_pipeline.RunSnakemake(pipeline_name='fake_pipeline',
+                                                        pipeline_version='0.1',
+                                                        output_dir=output_dir,
+                                                        workdir=tmp_dir,
+                                                        sample_sheet=sample_sheet,
+                                                        user_parameters=user_parameters,
+                                                        fixed_parameters=os.path.abspath('fixed_parameters.yaml'),
+                                                        snakefile=os.path.join(main_script_path, 'tests', 'Snakefile'),
+                                                        useconda=False,
+                                                        usesingularity=False,
+                                                        executor='local_process',
+                                                        max_submissions_per_second=2,
+                                                        max_jobs=3,
+                                                        status_cache_ttl=1)
+            self.assertTrue(fake_run.run_snakemake())
+            self.assertTrue(output_dir.joinpath('fake_result.txt').exists())
+            with open(output_dir.joinpath('log', 'cluster', 'submissions.txt')) as file_:
+                submission_times = [float(line.split('\t')[0]) for line in file_]
+        self.assertEqual(len(submission_times), 4)
+        # The three independent jobs can only be sent at 2 jobs per second
+        self.assertGreaterEqual(submission_times[2] - submission_times[0], 0.9)
+
+    @mock.patch.dict(os.environ, {'CI': 'true'})
+    def test_resources_estimated_from_input_size(self):
+        """Testing that the memory, threads and time limit of the jobs of the 
+        rules with resource factors are estimated from the size of the input
+        of every sample when they are submitted"""
+        resource_factors = {'first_rule': {'mem_gb': {'base': 1, 'per_gb': 1024},
+                                            'threads': {'base': 2},
+                                            'time_limit': {'base': 5, 'per_gb': 1024*10, 'max': 30}}}
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            tmp_dir = pathlib.Path(tmp_dir)
+            input_dir = tmp_dir.joinpath('input')
+            input_dir.mkdir()
+            # 2 MB for sample a
+            make_non_empty_file(input_dir.joinpath('a_R1.fastq'), content='A' * 1024**2)
+            make_non_empty_file(input_dir.joinpath('a_R2.fastq'), content='A' * 1024**2)
+            pipeline = base_juno_pipeline.PipelineStartup(input_dir, 'fastq')
+            pipeline.start_juno_pipeline()
+            self.assertEqual(pipeline.sample_input_sizes, {'a': 2 * 1024**2})
+            output_dir = tmp_dir.joinpath('output')
+            user_parameters = tmp_dir.joinpath('user_parameters.yaml')
+            make_non_empty_file(user_parameters, content=f'output_dir: {output_dir}')
+            sample_sheet = tmp_dir.joinpath('sample_sheet.yaml')
+            with open(sample_sheet, 'w') as file_:
+                yaml.dump(pipeline.sample_dict, file_)
+            fake_run = base_juno_pipeline.RunSnakemake(pipeline_name='fake_pipeline',
+                                                        pipeline_version='0.1',
+                                                        output_dir=output_dir,
+                                                        workdir=tmp_dir,
+                                                        sample_sheet=sample_sheet,
+                                                        user_parameters=user_parameters,
+                                                        fixed_parameters=os.path.abspath('fixed_parameters.yaml'),
+                                                        snakefile=os.path.join(main_script_path, 'tests', 'Snakefile'),
+                                                        useconda=False,
+                                                        usesingularity=False,
+                                                        executor='local_process',
+                                                        status_cache_ttl=1,
+                                                        resource_factors=resource_factors)
+            self.assertEqual(fake_run.get_sample_input_sizes(), pipeline.sample_input_sizes)
+            self.assertTrue(fake_run.run_snakemake())
+            with open(output_dir.joinpath('log', 'cluster', 'submissions.txt')) as file_:
+                submissions = [line.rstrip('\n').split('\t') for line in file_]
+        requested_resources = sorted((pathlib.Path(jobscript).name.split('.')[0], threads, mem_gb, time_limit)
+                                    for _, _, jobscript, threads, mem_gb, time_limit in submissions)
+        # Sample a has 2 MB of input, samples b and c have no input files
+        self.assertEqual(requested_resources, [('fake_pipeline_first_rule', '2', '1', '5'),
+                                                ('fake_pipeline_first_rule', '2', '1', '5'),
+                                                ('fake_pipeline_first_rule', '2', '3', '25'),
+                                                ('fake_pipeline_second_rule', '1', '4', '60')])
+
+    def test_resources_of_batches_estimated(self):
+        """Testing that the resources of a batch (group job) are estimated 
+        from the jobs in it and that jobs without memory get the default
+        memory of the executor"""
+        resource_model = ResourceModel(rule_factors={'first_rule': {'mem_gb': {'base': 1, 'per_gb': 1024},
+                                                                    'threads': {'base': 2},
+                                                                    'time_limit': {'base': 5, 'per_gb': 1024*10}}},
+                                        sample_sizes={'a': 2 * 1024**2, 'b': 0, 'c': 0})
+        command = ['submit', '--threads', '{threads}', '--mem-gb', '{mem_gb}', '--time-limit', '{time_limit}']
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            def make_jobscript(properties, target_jobs=()):
+                jobscript = pathlib.Path(tmp_dir).joinpath('jobscript.sh')
+                make_non_empty_file(jobscript, content=f'#!/bin/sh\n# properties = {json.dumps(properties)}\n'
+                                                        f"cd {tmp_dir} && python -m snakemake --target-jobs {' '.join(target_jobs)} --cores 'all'\n")
+                return jobscript
+            batch = make_jobscript({'type': 'group', 'threads': 3, 'resources': {'mem_gb': 12}},
+                                    ["'first_rule:sample=a'", "'first_rule:sample=b'", "'first_rule:sample=c'"])
+            self.assertEqual(fill_in_resources(command, resource_model, batch, default_mem_gb=4)[1:],
+                            ['--threads', '6', '--mem-gb', '5', '--time-limit', '25'])
+            # Resources without factors keep the values of Snakemake
+            batch = make_jobscript({'type': 'group', 'threads': 2, 'resources': {'mem_gb': 8, 'time_limit': 30}},
+                                    ["'second_rule:'", "'second_rule:'"])
+            self.assertEqual(fill_in_resources(command, resource_model, batch, default_mem_gb=4)[1:],
+                            ['--threads', '2', '--mem-gb', '8', '--time-limit', '30'])
+            for jobscript in [make_jobscript({'type': 'group', 'threads': 2, 'resources': {}},
+                                            ["'second_rule:sample=a'", "'second_rule:sample=b'"]),
+                            make_jobscript({'type': 'single', 'rule': 'second_rule', 'threads': 1, 'resources': {}})]:
+                self.assertEqual(fill_in_resources(command, resource_model, jobscript, default_mem_gb=4)[4], '4')
+
+    def test_run_history(self):
+        """Testing that the finished jobs are stored in the run history and 
+        used to estimate the resources and priorities of the next runs"""
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            tmp_dir = pathlib.Path(tmp_dir)
+            output_dir = tmp_dir.joinpath('output')
+            user_parameters = tmp_dir.joinpath('user_parameters.yaml')
+            make_non_empty_file(user_parameters, content=f'output_dir: {output_dir}')
+            sample_sheet = tmp_dir.joinpath('sample_sheet.yaml')
+            make_non_empty_file(sample_sheet, content='a: {}')
+            history_file = tmp_dir.joinpath('run_history.sqlite')
+            fake_run = base_juno_pipeline.RunSnakemake(pipeline_name='fake_pipeline',
+                                                        pipeline_version='0.1',
+                                                        output_dir=output_dir,
+                                                        workdir=tmp_dir,
+                                                        sample_sheet=sample_sheet,
+                                                        user_parameters=user_parameters,
+                                                        fixed_parameters=os.path.abspath('fixed_parameters.yaml'),
+                                                        snakefile=os.path.join(main_script_path, 'tests', 'Snakefile'),
+                                                        local=True,
+                                                        useconda=False,
+                                                        usesingularity=False,
+                                                        use_run_history=True,
+                                                        run_history_file=history_file)
+            self.assertTrue(fake_run.run_snakemake())
+            run_history = RunHistory(history_file)
+            records = run_history.get_records('fake_pipeline')
+            self.assertEqual(sorted(record.sample for record in records['first_rule']), ['a', 'b', 'c'])
+            self.assertEqual([record.sample for record in records['second_rule']], [None])
+            # Without benchmark files the wall times include the time in the
+            # queue, so they are not used for the time limits
+            self.assertFalse(any(record.benchmarked for record in records['first_rule']))
+            self.assertEqual(run_history.estimate_resources('fake_pipeline'), {})
+            # A slow per-sample rule with benchmarks
+            benchmark_file = tmp_dir.joinpath('benchmark.tsv')
+            make_non_empty_file(benchmark_file, 
+                                content='s\th:m:s\tmax_rss\tmax_vms\tcpu_time\n600.5\t0:10:00\t2048.0\t3000\t550.1\n')
+            wall_time_s, cpu_time_s, max_rss_mb = JobHistoryCollector.read_benchmark(benchmark_file)
+            run_history.add_records('fake_pipeline', 
+                                    [JobRecord('slow_rule', sample, wall_time_s, cpu_time_s, max_rss_mb,
+                                                benchmarked=True)
+                                    for sample in ['a', 'b', 'c']])
+            self.assertEqual(run_history.estimate_resources('fake_pipeline')['slow_rule'], 
+                            {'time_limit': 16, 'mem_gb': 3})
+            self.assertEqual(run_history.get_priority_rules('fake_pipeline'), ['slow_rule'])
+            fake_run.history_estimates = run_history.estimate_resources('fake_pipeline')
+            resource_model = fake_run.get_resource_model()
+        self.assertEqual(resource_model.estimate('slow_rule', resources={'mem_gb': 10}),
+                        {'mem_gb': 3, 'threads': 1, 'time_limit': 16})
+
+    def test_sharded_run(self):
+        """Testing that the samples are split in shards that run at the same
+        time and that their outputs and audit trails are merged"""
+        samples = [f'sample{i}' for i in range(5)]
+        self.assertEqual(
+            base_juno_pipeline.RunSnakemake.split_sample_dict(
+                {sample: {} for sample in samples}, 2, {'sample0': 100, 'sample1': 60, 'sample2': 50}
+            ),
+            [{'sample0': {}, 'sample3': {}, 'sample4': {}}, {'sample1': {}, 'sample2': {}}]
+        )
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            tmp_dir = pathlib.Path(tmp_dir)
+            snakefile = tmp_dir.joinpath('Snakefile')
+            make_non_empty_file(snakefile, content="""import yaml
+with open(config['sample_sheet']) as file_:
+    SAMPLES = list(yaml.safe_load(file_))
+OUT = config['output_dir']
+
+rule all:
+    input: OUT + '/summary.txt'
+
+rule per_sample:
+    output: OUT + '/samples/{sample}.txt'
+    shell: 'echo {wildcards.sample} > {output}'
+
+rule summary:
+    input: expand(OUT + '/samples/{sample}.txt', sample=SAMPLES)
+    output: OUT + '/summary.txt'
+    shell: 'cat {input} > {output}'
+""")
+            output_dir = tmp_dir.joinpath('output')
+            user_parameters = tmp_dir.joinpath('user_parameters.yaml')
+            make_non_empty_file(user_parameters, content=f'output_dir: {output_dir}')
+            sample_sheet = tmp_dir.joinpath('sample_sheet.yaml')
+            with open(sample_sheet, 'w') as file_:
+                yaml.dump({sample: {} for sample in samples}, file_)
+            fake_run = base_juno_pipeline.RunSnakemake(pipeline_name='fake_pipeline',
+                                                        pipeline_version='0.1',
+                                                        output_dir=output_dir,
+                                                        workdir=tmp_dir,
+                                                        sample_sheet=sample_sheet,
+                                                        user_parameters=user_parameters,
+                                                        fixed_parameters=os.path.abspath('fixed_parameters.yaml'),
+                                                        snakefile=snakefile,
+                                                        local=True,
+                                                        cores=4,
+                                                        useconda=True,
+                                                        usesingularity=False)
+            # The environments are created once, before starting the shards
+            with mock.patch.object(base_juno_pipeline.RunSnakemake, 'create_environments', 
+                                    autospec=True, return_value=True) as create_environments:
+                self.assertTrue(fake_run.run_snakemake_sharded(2))
+            create_environments.assert_called_once_with(fake_run)
+            self.assertFalse(output_dir.joinpath('shards').exists())
+            self.assertFalse(output_dir.joinpath('summary.txt').exists())
+            sample_files = sorted(output_dir.joinpath('samples').iterdir())
+            self.assertEqual([file_.name for file_ in sample_files], [f'{sample}.txt' for sample in samples])
+            modification_times = [file_.stat().st_mtime_ns for file_ in sample_files]
+            with open(output_dir.joinpath('audit_trail', 'shards.yaml')) as file_:
+                shards_summary = yaml.safe_load(file_)
+            self.assertEqual(sorted(sum([shard['samples'] for shard in shards_summary.values()], [])), samples)
+            # The summaries of every shard are kept with the name of the shard
+            for shard, shard_summary in shards_summary.items():
+                with open(output_dir.joinpath(f'{shard}_summary.txt')) as file_:
+                    self.assertEqual(file_.read().split(), shard_summary['samples'])
+            for shard in ['shard_0', 'shard_1']:
+                self.assertTrue(output_dir.joinpath('audit_trail', 'shards', shard, 'log_pipeline.yaml').exists())
+            # The audit trail of the complete sample sheet is at the top level
+            for audit_file in ['log_pipeline.yaml', 'log_git.yaml', 'log_conda.txt', 'user_parameters.yaml']:
+                self.assertTrue(output_dir.joinpath('audit_trail', audit_file).exists())
+            for audit_file in ['sample_sheet.yaml', 'processed_samples.yaml']:
+                self.assertEqual(sorted(read_sample_sheet(output_dir.joinpath('audit_trail', audit_file))), samples)
+            fake_run.useconda = False
+            # The final run only makes the summary of all the samples
+            self.assertTrue(fake_run.run_snakemake())
+            self.assertEqual([file_.stat().st_mtime_ns for file_ in sample_files], modification_times)
+            with open(output_dir.joinpath('summary.txt')) as file_:
+                self.assertEqual(file_.read().split(), samples)
+
     def test_pipeline(self):  
         output_dir = pathlib.Path('fake_output_dir')  
         os.system(f'echo "output_dir: {str(output_dir)}" > user_parameters.yaml')   
@@ -457,6 +1689,22 @@ class TestRunSnakemake(unittest.TestCase):
         self.assertTrue(audit_trail_path.joinpath('fake_snakemake_report.html').exists())
         
 
+class TestStartupTime(unittest.TestCase):
+    """Testing that importing the library stays fast (see also 
+    benchmarks/bench_import_time.py)"""
+
+    def test_heavy_modules_not_imported_at_startup(self):
+        """Testing that pandas and snakemake are not imported when importing 
+        the library or asking for the help of the command line"""
+        code = ('import sys, base_juno_pipeline; '
+                'print([m for m in ["pandas", "snakemake"] if m in sys.modules])')
+        output = subprocess.check_output([sys.executable, '-c', code], cwd=main_script_path)
+        self.assertEqual(output.decode().strip(), '[]')
+        help_run = subprocess.run([sys.executable, '-m', 'base_juno_pipeline', '--help'],
+                                    cwd=main_script_path, capture_output=True)
+        self.assertEqual(help_run.returncode, 0, help_run.stderr)
+
+
 class TestKwargsClass(unittest.TestCase):
     """Testing Argparse action to store kwargs (to be passed to Snakemake)"""
 